@@ -0,0 +1,121 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the sector key window rotation search against the full FFT one.
+
+Every scan is matched against a copy of itself rotated by a random yaw and slightly perturbed, so
+the true relative yaw is known. The pairs are first compared one by one, then every rotated copy
+queries a database of all the original scans (num_candidates candidates each), where the spectra
+of the keyframes are computed once at insert time. Without --dataloader, synthetic scenes are used.
+"""
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from pybind.scan_context import ScanContext
+
+
+def synthetic_scans(num_scans: int, num_points: int, rng: np.random.Generator):
+    for _ in range(num_scans):
+        num_blocks = rng.integers(20, 60)
+        centers, heights = rng.uniform(-60, 60, (num_blocks, 2)), rng.uniform(1, 15, num_blocks)
+        block = rng.integers(0, num_blocks, num_points)
+        xy = centers[block] + rng.normal(0, 2, (num_points, 2))
+        z = rng.uniform(0, 1, num_points) * heights[block] - 2.0
+        yield np.c_[xy, z]
+
+
+def rotate(scan: np.ndarray, yaw: float) -> np.ndarray:
+    c, s = np.cos(yaw), np.sin(yaw)
+    return scan @ np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]]).T
+
+
+def database_query_time(mode: str, pairs, num_candidates: int) -> float:
+    scan_context = ScanContext(rotation_search=mode, num_candidates=num_candidates)
+    for _, scan_context_2 in pairs:
+        scan_context.add_scan_context(scan_context_2)
+    scan_context.build_database()
+    start = time.perf_counter()
+    for scan_context_1, _ in pairs:
+        scan_context.query_database(scan_context_1)
+    return time.perf_counter() - start
+
+
+def main(
+    data: Optional[Path] = typer.Argument(None, help="Data directory for the dataloader"),
+    dataloader: Optional[str] = typer.Option(None, help="Use scans from this dataloader"),
+    sequence: Optional[str] = typer.Option(None),
+    num_scans: int = typer.Option(200),
+    noise: float = typer.Option(0.3, help="Std of the perturbation of the rotated copy [m]"),
+    num_candidates: int = typer.Option(10, help="Candidates verified per database query"),
+    seed: int = typer.Option(0),
+):
+    rng = np.random.default_rng(seed)
+    if dataloader is not None:
+        from scan_context.datasets import dataset_factory
+
+        dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+        indices = np.linspace(0, len(dataset) - 1, min(num_scans, len(dataset))).astype(int)
+        scans = (dataset[idx] for idx in indices)
+    else:
+        scans = synthetic_scans(num_scans, 20000, rng)
+
+    modes = ["vkey_window", "full_fft"]
+    scan_contexts = {mode: ScanContext(rotation_search=mode) for mode in modes}
+    encoder = scan_contexts[modes[0]]
+    pairs, gt_yaws = [], []
+    for scan in scans:
+        yaw = rng.uniform(0, 2 * np.pi)
+        rotated = rotate(scan, yaw) + rng.normal(0, noise, scan.shape)
+        pairs.append((encoder.make_scan_context(rotated), encoder.make_scan_context(scan)))
+        gt_yaws.append(yaw)
+    gt_yaws = np.asarray(gt_yaws)
+
+    table = Table(title=f"Rotation search on {len(pairs)} pairs")
+    table.add_column("Mode", style="cyan")
+    table.add_column("Time per pair", style="magenta")
+    table.add_column("Time per query", style="magenta")
+    table.add_column("Mean distance", style="green")
+    table.add_column("Yaw error < 1 sector", style="green")
+    for mode in modes:
+        start = time.perf_counter()
+        results = [scan_contexts[mode].distance(*pair) for pair in pairs]
+        elapsed = time.perf_counter() - start
+        dists, yaws = np.asarray(results).T
+        yaw_errors = np.abs(np.angle(np.exp(1j * (yaws - gt_yaws))))
+        query_time = database_query_time(mode, pairs, num_candidates)
+        table.add_row(
+            mode,
+            f"{1e6 * elapsed / len(pairs):.1f} us",
+            f"{1e6 * query_time / len(pairs):.1f} us",
+            f"{np.mean(dists):.4f}",
+            f"{100 * np.mean(yaw_errors < np.deg2rad(6.0)):.1f} %",
+        )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
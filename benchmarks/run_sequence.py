@@ -0,0 +1,99 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the per-frame Python loop against the native run_sequence driver.
+
+The loop is what ScanContextPipeline did for every frame: process_new_scan, check_for_closure and
+a threshold on the distances, with a Python round trip per scan. run_sequence runs the whole
+sequence in C++ and returns the same scores and closures as two arrays. The synthetic scans are
+small, so the per-frame overhead is visible next to the encoding and the search.
+"""
+import time
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+from sparse_descriptors import synthetic_scans  # the same scenes, without empty sectors
+
+from pybind.scan_context import ScanContext
+
+
+def run_loop(scans, threshold: float):
+    scan_context = ScanContext()
+    start = time.perf_counter()
+    scores, closures = [], []
+    for scan in scans:
+        scan_context.process_new_scan(scan)
+        query_idx, candidate_ids, candidate_dists, _ = scan_context.check_for_closure()
+        if query_idx == -1:
+            continue
+        for candidate_id, dist in zip(candidate_ids, candidate_dists):
+            scores.append([query_idx, candidate_id, dist])
+            if dist < threshold:
+                closures.append([candidate_id, query_idx])
+    return time.perf_counter() - start, np.asarray(scores).reshape(-1, 3), len(closures)
+
+
+def run_native(scans, threshold: float, offsets=None):
+    scan_context = ScanContext()
+    start = time.perf_counter()
+    scores, closures = scan_context.run_sequence(scans, offsets, closure_threshold=threshold)
+    return time.perf_counter() - start, scores, len(closures)
+
+
+def main(
+    num_scans: int = typer.Option(2000),
+    num_points: int = typer.Option(2000, help="Points per scan"),
+    threshold: float = typer.Option(0.4),
+    seed: int = typer.Option(0),
+):
+    scans = list(synthetic_scans(num_scans, num_points, 0.0, np.random.default_rng(seed)))
+    offsets = np.cumsum([0] + [len(scan) for scan in scans])
+    packed = np.concatenate(scans)
+
+    loop_time, loop_scores, loop_closures = run_loop(scans, threshold)
+    title = f"Per-frame loop vs native driver, {num_scans} scans of {num_points} points"
+    table = Table(title=title)
+    table.add_column("Driver", style="cyan")
+    table.add_column("Per scan", style="magenta")
+    table.add_column("Closures", style="magenta")
+    table.add_column("Speedup", style="green")
+    table.add_column("Same scores", style="green")
+    table.add_row(
+        "Python loop", f"{1e6 * loop_time / num_scans:.1f} us", f"{loop_closures}", "1.00x", "-"
+    )
+    for name, (native_time, scores, closures) in (
+        ("run_sequence (list)", run_native(scans, threshold)),
+        ("run_sequence (packed)", run_native(packed, threshold, offsets)),
+    ):
+        table.add_row(
+            name,
+            f"{1e6 * native_time / num_scans:.1f} us",
+            f"{closures}",
+            f"{loop_time / native_time:.2f}x",
+            f"{np.array_equal(scores, loop_scores)}",
+        )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
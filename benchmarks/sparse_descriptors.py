@@ -0,0 +1,124 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the verification on dense descriptors against the sparse (bitmask) ones.
+
+The scans of each sparsity level are added to a database and queried in one batch, once with
+dense and once with sparse descriptors; both give the same closures. Without --dataloader,
+synthetic scenes are used, with a growing fraction of empty sectors. With a dataloader, its scans
+are grouped by their own fraction of empty sectors.
+"""
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from pybind.scan_context import ScanContext
+
+
+def synthetic_scans(num_scans: int, num_points: int, sparsity: float, rng: np.random.Generator):
+    """Scans of num_scans // 4 places, only the points of a random fraction of sectors are kept."""
+    num_sectors = 60
+    places = []
+    for _ in range(max(num_scans // 4, 1)):
+        num_blocks = rng.integers(20, 60)
+        centers, heights = rng.uniform(-60, 60, (num_blocks, 2)), rng.uniform(1, 15, num_blocks)
+        places.append((centers, heights))
+    for scan_idx in range(num_scans):
+        centers, heights = places[scan_idx % len(places)]
+        block = rng.integers(0, len(centers), num_points)
+        xy = centers[block] + rng.normal(0, 2, (num_points, 2))
+        z = rng.uniform(0, 1, num_points) * heights[block] - 2.0
+        azimuth = np.degrees(np.arctan2(xy[:, 1], xy[:, 0])) % 360
+        sector = (azimuth // (360 / num_sectors)).astype(int)
+        kept_sectors = rng.random(num_sectors) >= sparsity
+        yield np.c_[xy, z][kept_sectors[sector]]
+
+
+def empty_sectors(scan_context: np.ndarray) -> float:
+    return float(np.mean(~scan_context.any(axis=0)))
+
+
+def run_queries(scan_contexts: List[np.ndarray], sparse: bool):
+    scan_context = ScanContext(num_candidates=20, sparse_descriptors=sparse)
+    for descriptor in scan_contexts:
+        scan_context.add_scan_context(descriptor)
+    start = time.perf_counter()
+    results = scan_context.check_for_closures(scan_context.get_ids())
+    return time.perf_counter() - start, results
+
+
+def main(
+    data: Optional[Path] = typer.Argument(None, help="Data directory for the dataloader"),
+    dataloader: Optional[str] = typer.Option(None, help="Use scans from this dataloader"),
+    sequence: Optional[str] = typer.Option(None),
+    num_scans: int = typer.Option(400),
+    num_groups: int = typer.Option(4, help="Sparsity groups of the dataloader scans"),
+    seed: int = typer.Option(0),
+):
+    rng = np.random.default_rng(seed)
+    encoder = ScanContext()
+    groups = []  # scan contexts of each sparsity level
+    if dataloader is not None:
+        from scan_context.datasets import dataset_factory
+
+        dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+        indices = np.linspace(0, len(dataset) - 1, min(num_scans, len(dataset))).astype(int)
+        scan_contexts = [encoder.make_scan_context(dataset[idx]) for idx in indices]
+        order = np.argsort([empty_sectors(descriptor) for descriptor in scan_contexts])
+        for group in np.array_split(order, num_groups):
+            groups.append([scan_contexts[idx] for idx in np.sort(group)])
+    else:
+        for sparsity in (0.0, 0.25, 0.5, 0.75, 0.9):
+            scans = synthetic_scans(num_scans, 20000, sparsity, rng)
+            groups.append([encoder.make_scan_context(scan) for scan in scans])
+
+    table = Table(title=f"Dense vs sparse verification, {dataloader or 'synthetic'} scans")
+    table.add_column("Empty sectors", style="cyan")
+    table.add_column("Scans", style="cyan")
+    table.add_column("Dense per query", style="magenta")
+    table.add_column("Sparse per query", style="magenta")
+    table.add_column("Speedup", style="green")
+    table.add_column("Same results", style="green")
+    for scan_contexts in groups:
+        dense_time, dense_results = run_queries(scan_contexts, sparse=False)
+        sparse_time, sparse_results = run_queries(scan_contexts, sparse=True)
+        same = all(
+            all(np.array_equal(a, b) for a, b in zip(dense, sparse))
+            for dense, sparse in zip(dense_results, sparse_results)
+        )
+        table.add_row(
+            f"{100 * np.mean([empty_sectors(descriptor) for descriptor in scan_contexts]):.1f} %",
+            f"{len(scan_contexts)}",
+            f"{1e6 * dense_time / len(scan_contexts):.1f} us",
+            f"{1e6 * sparse_time / len(scan_contexts):.1f} us",
+            f"{dense_time / sparse_time:.2f}x",
+            f"{same}",
+        )
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
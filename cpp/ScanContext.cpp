@@ -1,8 +1,18 @@
 #include "ScanContext.hpp"
 
 #include <Eigen/Core>
+#include <algorithm>
+#include <cmath>
+#include <complex>
+#include <iterator>
+#include <map>
 #include <memory>
+#include <numeric>
+#include <stdexcept>
+#include <string>
 #include <tuple>
+#include <unordered_map>
+#include <unsupported/Eigen/FFT>
 #include <utility>
 #include <vector>
 
@@ -10,7 +20,7 @@ using std::atan2;
 using std::cos;
 using std::sin;
 
-using Eigen::MatrixXd, Eigen::Vector3d, Eigen::VectorXd;
+using Eigen::MatrixXd, Eigen::Vector2d, Eigen::Vector3d, Eigen::VectorXd;
 
 float rad2deg(float radians) { return radians * 180.0 / M_PI; }
 
@@ -52,6 +62,78 @@ std::vector<float> eig2stdvec(MatrixXd _eigmat) {
     return vec;
 }  // eig2stdvec
 
+NormalizedSC normalizeScancontext(const Eigen::Ref<const MatrixXd> &_desc) {
+    NormalizedSC nsc{_desc, std::vector<bool>(_desc.cols(), false)};
+    for (int col_idx = 0; col_idx < _desc.cols(); col_idx++) {
+        double col_norm = _desc.col(col_idx).norm();
+        if (col_norm == 0) continue;  // i.e., empty sector, never counted in the distance
+        nsc.columns.col(col_idx) /= col_norm;
+        nsc.occupied[col_idx] = true;
+    }
+    return nsc;
+}  // normalizeScancontext
+
+double signedShift(double _shift, int _num_cols) {
+    return _shift > 0.5 * _num_cols ? _shift - _num_cols : _shift;
+}  // signedShift
+
+int SparseSC::packedIndex(int _col_idx) const {
+    // i.e., the number of non-empty sectors before it
+    return __builtin_popcountll(occupied & ((uint64_t(1) << _col_idx) - 1));
+}  // SparseSC::packedIndex
+
+SparseSC makeSparseScancontext(const MatrixXd &_desc) {
+    if (_desc.cols() > 64)
+        throw std::invalid_argument("the sparse descriptors hold at most 64 sectors");
+    SparseSC ssc;
+    ssc.num_cols = _desc.cols();
+    ssc.columns.resize(_desc.rows(), _desc.cols());
+    int num_packed = 0;
+    for (int col_idx = 0; col_idx < _desc.cols(); col_idx++) {
+        double col_norm = _desc.col(col_idx).norm();
+        if (col_norm == 0) continue;
+        ssc.columns.col(num_packed++) = _desc.col(col_idx) / col_norm;
+        ssc.occupied |= uint64_t(1) << col_idx;
+    }
+    ssc.columns.conservativeResize(Eigen::NoChange, num_packed);
+    return ssc;
+}  // makeSparseScancontext
+
+SCSpectrum makeSpectrum(const NormalizedSC &_nsc) {
+    Eigen::FFT<double> fft;
+    fft.SetFlag(Eigen::FFT<double>::HalfSpectrum);
+    SCSpectrum spec;
+    spec.num_cols = int(_nsc.columns.cols());
+    spec.rings.resize(_nsc.columns.rows());
+    for (int row_idx = 0; row_idx < _nsc.columns.rows(); row_idx++) {
+        std::vector<double> ring(_nsc.columns.cols());
+        for (int col_idx = 0; col_idx < _nsc.columns.cols(); col_idx++)
+            ring[col_idx] = _nsc.columns(row_idx, col_idx);
+        fft.fwd(spec.rings[row_idx], ring);
+    }
+    std::vector<double> occupied(_nsc.occupied.begin(), _nsc.occupied.end());
+    fft.fwd(spec.occupied, occupied);
+    return spec;
+}  // makeSpectrum
+
+MatrixXd maxPoolScancontext(const MatrixXd &_desc) {
+    MatrixXd pooled((_desc.rows() + 1) / 2, (_desc.cols() + 1) / 2);
+    for (int row_idx = 0; row_idx < pooled.rows(); row_idx++)
+        for (int col_idx = 0; col_idx < pooled.cols(); col_idx++)
+            pooled(row_idx, col_idx) =
+                _desc
+                    .block(2 * row_idx, 2 * col_idx, std::min<int>(2, _desc.rows() - 2 * row_idx),
+                           std::min<int>(2, _desc.cols() - 2 * col_idx))
+                    .maxCoeff();
+    return pooled;
+}  // maxPoolScancontext
+
+double parabolicMinimumOffset(double _left, double _center, double _right) {
+    const double curvature = _left - 2 * _center + _right;
+    if (!std::isfinite(curvature) || curvature <= 0) return 0.0;
+    return std::clamp(0.5 * (_left - _right) / curvature, -0.5, 0.5);
+}  // parabolicMinimumOffset
+
 double SCManager::distDirectSC(MatrixXd &_sc1, MatrixXd &_sc2) {
     int num_eff_cols = 0;  // i.e., to exclude all-nonzero sector
     double sum_sector_similarity = 0;
@@ -72,45 +154,174 @@ double SCManager::distDirectSC(MatrixXd &_sc1, MatrixXd &_sc2) {
 
 }  // distDirectSC
 
-int SCManager::fastAlignUsingVkey(MatrixXd &_vkey1, MatrixXd &_vkey2) {
+int SCManager::fastAlignUsingVkey(const Eigen::Ref<const MatrixXd> &_vkey1,
+                                  const Eigen::Ref<const MatrixXd> &_vkey2,
+                                  double *_min_diff_norm) const {
     int argmin_vkey_shift = 0;
     double min_veky_diff_norm = 10000000;
-    for (int shift_idx = 0; shift_idx < _vkey1.cols(); shift_idx++) {
-        MatrixXd vkey2_shifted = circshift(_vkey2, shift_idx);
-
-        MatrixXd vkey_diff = _vkey1 - vkey2_shifted;
-
-        double cur_diff_norm = vkey_diff.norm();
+    const int num_cols = _vkey1.cols();
+    for (int shift_idx = 0; shift_idx < num_cols; shift_idx++) {
+        // same as (_vkey1 - circshift(_vkey2, shift_idx)).norm(), without the shifted copy
+        double cur_diff_norm = 0;
+        for (int col_idx = 0; col_idx < num_cols; col_idx++) {
+            double diff =
+                _vkey1(0, col_idx) - _vkey2(0, (col_idx - shift_idx + num_cols) % num_cols);
+            cur_diff_norm += diff * diff;
+        }
+        cur_diff_norm = std::sqrt(cur_diff_norm);
         if (cur_diff_norm < min_veky_diff_norm) {
             argmin_vkey_shift = shift_idx;
             min_veky_diff_norm = cur_diff_norm;
         }
     }
 
+    if (_min_diff_norm != nullptr) *_min_diff_norm = min_veky_diff_norm;
     return argmin_vkey_shift;
 
 }  // fastAlignUsingVkey
 
-std::pair<double, int> SCManager::distanceBtnScanContext(MatrixXd &_sc1, MatrixXd &_sc2) {
-    // 1. fast align using variant key (not in original IROS18)
-    MatrixXd vkey_sc1 = makeSectorkeyFromScancontext(_sc1);
-    MatrixXd vkey_sc2 = makeSectorkeyFromScancontext(_sc2);
-    int argmin_vkey_shift = fastAlignUsingVkey(vkey_sc1, vkey_sc2);
+double SCManager::distAtShift(const NormalizedSC &_nsc1,
+                              const NormalizedSC &_nsc2,
+                              int _num_shift,
+                              double _bound) const {
+    // column col_idx of circshift(_sc2, _num_shift) is column (col_idx - _num_shift) of _sc2. the
+    // cartesian context does not wrap around, its columns shifted beyond the edges are empty
+    const int num_cols = _nsc1.columns.cols();
+    const bool circular = DESCRIPTOR == DescriptorType::POLAR;
+    const int lateral_shift = int(signedShift(_num_shift, num_cols));
+    auto shifted_col = [&](int col_idx) {
+        return circular ? (col_idx - _num_shift + num_cols) % num_cols : col_idx - lateral_shift;
+    };
+    auto is_common = [&](int col_idx) {
+        const int shifted_col_idx = shifted_col(col_idx);
+        return shifted_col_idx >= 0 && shifted_col_idx < num_cols && _nsc1.occupied[col_idx] &&
+               _nsc2.occupied[shifted_col_idx];
+    };
+
+    int num_eff_cols = 0;  // i.e., to exclude all-nonzero sector
+    for (int col_idx = 0; col_idx < num_cols; col_idx++)
+        if (is_common(col_idx)) num_eff_cols++;
+    if (num_eff_cols == 0)
+        return std::numeric_limits<double>::quiet_NaN();  // as 0 / 0 in distDirectSC
+
+    // a sector similarity is at most 1, so the remaining sectors bound the final distance
+    double sum_sector_similarity = 0;
+    int num_remaining_cols = num_eff_cols;
+    for (int col_idx = 0; col_idx < num_cols; col_idx++) {
+        if (!is_common(col_idx)) continue;
+
+        sum_sector_similarity +=
+            _nsc1.columns.col(col_idx).dot(_nsc2.columns.col(shifted_col(col_idx)));
+        num_remaining_cols--;
+
+        double lower_bound = 1.0 - (sum_sector_similarity + num_remaining_cols) / num_eff_cols;
+        if (lower_bound >= _bound) return lower_bound;  // early exit, can not beat the bound
+    }
+
+    return 1.0 - sum_sector_similarity / num_eff_cols;
+}  // distAtShift
+
+double SCManager::distAtShift(const SparseSC &_ssc1,
+                              const SparseSC &_ssc2,
+                              int _num_shift,
+                              double _bound) const {
+    // bit col_idx of the rotated mask is bit (col_idx - _num_shift) of _ssc2, as circshift. the
+    // cartesian context is shifted without wrapping around instead
+    const int num_cols = _ssc1.num_cols;
+    const uint64_t all_cols = num_cols == 64 ? ~uint64_t(0) : (uint64_t(1) << num_cols) - 1;
+    const bool circular = DESCRIPTOR == DescriptorType::POLAR;
+    const int lateral_shift = int(signedShift(_num_shift, num_cols));
+    uint64_t shifted = _ssc2.occupied;
+    if (circular && _num_shift != 0)
+        shifted = ((shifted << _num_shift) | (shifted >> (num_cols - _num_shift))) & all_cols;
+    else if (!circular)
+        shifted =
+            lateral_shift >= 0 ? (shifted << lateral_shift) & all_cols : shifted >> -lateral_shift;
+    const uint64_t common = _ssc1.occupied & shifted;
+    const int num_eff_cols = __builtin_popcountll(common);
+    if (num_eff_cols == 0)
+        return std::numeric_limits<double>::quiet_NaN();  // as 0 / 0 in distDirectSC
 
-    const int SEARCH_RADIUS = round(0.5 * SEARCH_RATIO * _sc1.cols());  // a half of search range
-    std::vector<int> shift_idx_search_space{argmin_vkey_shift};
+    // same sums in the same order as the dense distAtShift, over the common sectors only
+    double sum_sector_similarity = 0;
+    int num_remaining_cols = num_eff_cols;
+    for (uint64_t remaining = common; remaining != 0; remaining &= remaining - 1) {
+        const int col_idx = __builtin_ctzll(remaining);
+        const int shifted_col_idx =
+            circular ? (col_idx - _num_shift + num_cols) % num_cols : col_idx - lateral_shift;
+        sum_sector_similarity += _ssc1.columns.col(_ssc1.packedIndex(col_idx))
+                                     .dot(_ssc2.columns.col(_ssc2.packedIndex(shifted_col_idx)));
+        num_remaining_cols--;
+
+        double lower_bound = 1.0 - (sum_sector_similarity + num_remaining_cols) / num_eff_cols;
+        if (lower_bound >= _bound) return lower_bound;  // early exit, can not beat the bound
+    }
+
+    return 1.0 - sum_sector_similarity / num_eff_cols;
+}  // distAtShift
+
+std::vector<int> SCManager::shiftSearchSpace(int _argmin_vkey_shift) const {
+    const int SEARCH_RADIUS = round(0.5 * SEARCH_RATIO * PC_NUM_SECTOR);  // a half of search range
+    std::vector<int> shift_idx_search_space{_argmin_vkey_shift};
     for (int ii = 1; ii < SEARCH_RADIUS + 1; ii++) {
-        shift_idx_search_space.push_back((argmin_vkey_shift + ii + _sc1.cols()) % _sc1.cols());
-        shift_idx_search_space.push_back((argmin_vkey_shift - ii + _sc1.cols()) % _sc1.cols());
+        shift_idx_search_space.push_back((_argmin_vkey_shift + ii + PC_NUM_SECTOR) % PC_NUM_SECTOR);
+        shift_idx_search_space.push_back((_argmin_vkey_shift - ii + PC_NUM_SECTOR) % PC_NUM_SECTOR);
     }
     std::sort(shift_idx_search_space.begin(), shift_idx_search_space.end());
+    return shift_idx_search_space;
+}  // shiftSearchSpace
+
+template <typename Descriptor>
+std::pair<double, int> SCManager::searchShifts(const Descriptor &_desc1,
+                                               const Descriptor &_desc2,
+                                               const std::vector<int> &_shifts,
+                                               double _bound) const {
+    int argmin_shift = 0;
+    double min_sc_dist = 10000000;
+    for (int num_shift : _shifts) {
+        // a shift only matters if it beats the best one so far (exact, no approximation)
+        double cur_sc_dist = distAtShift(_desc1, _desc2, num_shift, std::min(_bound, min_sc_dist));
+        if (cur_sc_dist < min_sc_dist) {
+            argmin_shift = num_shift;
+            min_sc_dist = cur_sc_dist;
+        }
+    }
+
+    return std::make_pair(min_sc_dist, argmin_shift);
+}  // searchShifts
+
+std::pair<double, int> SCManager::searchAllShifts(const SCSpectrum &_spec1,
+                                                  const SCSpectrum &_spec2) const {
+    /*
+     * summary: the sum of the sector similarities at shift k is sum_c <sc1(:, c), sc2(:, c - k)>,
+     * i.e., the circular cross-correlation along the sector axis summed over the rings, which is
+     * ifft(sum_r fft(sc1(r, :)) * conj(fft(sc2(r, :))))(k). same for the number of effective
+     * sectors with the occupancy masks.
+     */
+    Eigen::FFT<double> fft;
+    fft.SetFlag(Eigen::FFT<double>::HalfSpectrum);
+    const size_t num_cols = _spec1.num_cols;
+    const size_t num_freqs = _spec1.occupied.size();
+    std::vector<std::complex<double>> cross_spectrum(num_freqs, 0.0);
+    for (size_t row_idx = 0; row_idx < _spec1.rings.size(); row_idx++)
+        for (size_t freq_idx = 0; freq_idx < num_freqs; freq_idx++)
+            cross_spectrum[freq_idx] +=
+                _spec1.rings[row_idx][freq_idx] * std::conj(_spec2.rings[row_idx][freq_idx]);
+    std::vector<std::complex<double>> occupied_spectrum(num_freqs);
+    for (size_t freq_idx = 0; freq_idx < num_freqs; freq_idx++)
+        occupied_spectrum[freq_idx] =
+            _spec1.occupied[freq_idx] * std::conj(_spec2.occupied[freq_idx]);
+
+    std::vector<double> sum_sector_similarity, num_eff_cols;
+    fft.inv(sum_sector_similarity, cross_spectrum, num_cols);
+    fft.inv(num_eff_cols, occupied_spectrum, num_cols);
 
-    // 2. fast columnwise diff
     int argmin_shift = 0;
     double min_sc_dist = 10000000;
-    for (int num_shift : shift_idx_search_space) {
-        MatrixXd sc2_shifted = circshift(_sc2, num_shift);
-        double cur_sc_dist = distDirectSC(_sc1, sc2_shifted);
+    for (size_t num_shift = 0; num_shift < num_cols; num_shift++) {
+        const double num_eff = std::round(num_eff_cols[num_shift]);
+        if (num_eff == 0) continue;  // nan in distDirectSC, never the minimum
+        double cur_sc_dist = 1.0 - sum_sector_similarity[num_shift] / num_eff;
         if (cur_sc_dist < min_sc_dist) {
             argmin_shift = num_shift;
             min_sc_dist = cur_sc_dist;
@@ -118,48 +329,386 @@ std::pair<double, int> SCManager::distanceBtnScanContext(MatrixXd &_sc1, MatrixX
     }
 
     return std::make_pair(min_sc_dist, argmin_shift);
+}  // searchAllShifts
+
+std::vector<NormalizedSC> SCManager::makePyramid(const Eigen::Ref<const MatrixXd> &_sc) const {
+    std::vector<NormalizedSC> pyramid;
+    MatrixXd level = _sc;
+    for (int level_idx = 0; level_idx < PYRAMID_LEVELS; level_idx++) {
+        level = maxPoolScancontext(level);
+        pyramid.push_back(normalizeScancontext(level));
+    }
+    return pyramid;
+}  // makePyramid
+
+void SCManager::rankOnPyramid(const std::vector<NormalizedSC> &_query_pyramid,
+                              std::vector<size_t> &_candidate_indexes,
+                              std::vector<float> &_ringkey_dists_sqr,
+                              std::vector<int> &_coarse_shifts,
+                              PruningStats &_stats) const {
+    /*
+     * summary: every shift on the coarsest level (e.g., 15 shifts of 5x15) costs less than the
+     * sector key alignment of a single full resolution candidate, the candidates are reordered by
+     * their coarse distance and only the NUM_CANDIDATES_FROM_TREE best are kept
+     */
+    const NormalizedSC &query_coarse = _query_pyramid.back();
+    std::vector<int> all_shifts(query_coarse.columns.cols());
+    std::iota(all_shifts.begin(), all_shifts.end(), 0);
+
+    const size_t num_candidates = _candidate_indexes.size();
+    std::vector<std::pair<double, int>> coarse_results(num_candidates);
+    for (size_t candidate_iter_idx = 0; candidate_iter_idx < num_candidates; candidate_iter_idx++) {
+        if (std::sqrt(_ringkey_dists_sqr[candidate_iter_idx]) > RINGKEY_DIST_THRES) {
+            // kept last, rejected by the ring key gate if it survives anyway
+            coarse_results[candidate_iter_idx] = {std::numeric_limits<double>::infinity(), 0};
+            continue;
+        }
+        const size_t candidate_idx = _candidate_indexes[candidate_iter_idx];
+        std::vector<NormalizedSC> attached_pyramid;
+        coarse_results[candidate_iter_idx] = searchShifts(
+            query_coarse, pyramidAt(candidate_idx, attached_pyramid).back(), all_shifts);
+    }
+
+    std::vector<size_t> order(num_candidates);
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(), [&](size_t lhs, size_t rhs) {
+        return coarse_results[lhs].first < coarse_results[rhs].first;
+    });
+    order.resize(std::min<size_t>(num_candidates, NUM_CANDIDATES_FROM_TREE));
+    _stats.coarse_rejected += num_candidates - order.size();
+
+    std::vector<size_t> candidate_indexes;
+    std::vector<float> ringkey_dists_sqr;
+    _coarse_shifts.clear();
+    for (size_t candidate_iter_idx : order) {
+        candidate_indexes.push_back(_candidate_indexes[candidate_iter_idx]);
+        ringkey_dists_sqr.push_back(_ringkey_dists_sqr[candidate_iter_idx]);
+        _coarse_shifts.push_back(coarse_results[candidate_iter_idx].second);
+    }
+    _candidate_indexes = std::move(candidate_indexes);
+    _ringkey_dists_sqr = std::move(ringkey_dists_sqr);
+}  // rankOnPyramid
+
+std::vector<int> SCManager::refineShiftSearchSpace(const std::vector<NormalizedSC> &_pyramid1,
+                                                   const std::vector<NormalizedSC> &_pyramid2,
+                                                   int _coarse_shift) const {
+    // a shift of k sectors on a level is 2k (+-1) sectors on the next finer one, one more sector
+    // on each side absorbs an alignment that straddles the pooling boundaries
+    const int REFINE_RADIUS = 2;
+    auto shifts_around = [&](int center_shift, int num_cols) {
+        std::vector<int> shifts;
+        for (int ii = -REFINE_RADIUS; ii <= REFINE_RADIUS; ii++)
+            shifts.push_back(((center_shift + ii) % num_cols + num_cols) % num_cols);
+        return shifts;
+    };
+
+    int shift = _coarse_shift;
+    for (int level_idx = int(_pyramid1.size()) - 2; level_idx >= 0; level_idx--) {
+        const int num_cols = _pyramid1[level_idx].columns.cols();
+        shift = searchShifts(_pyramid1[level_idx], _pyramid2[level_idx],
+                             shifts_around(2 * shift, num_cols))
+                    .second;
+    }
+    return shifts_around(2 * shift, PC_NUM_SECTOR);
+}  // refineShiftSearchSpace
+
+template <typename Descriptor>
+double SCManager::refineShift(const Descriptor &_desc1,
+                              const Descriptor &_desc2,
+                              int _num_shift,
+                              double _sc_dist) const {
+    const int num_cols = PC_NUM_SECTOR;
+    const double prev_dist = distAtShift(_desc1, _desc2, (_num_shift - 1 + num_cols) % num_cols);
+    const double next_dist = distAtShift(_desc1, _desc2, (_num_shift + 1) % num_cols);
+    const double shift = _num_shift + parabolicMinimumOffset(prev_dist, _sc_dist, next_dist);
+    return shift < 0 ? shift + num_cols : shift;
+}  // refineShift
+
+Vector2d SCManager::estimateTranslation(const Eigen::Ref<const MatrixXd> &_cart1,
+                                        const Eigen::Ref<const MatrixXd> &_cart2,
+                                        double _yaw) const {
+    /*
+     * summary: _cart2 is resampled (nearest cell) in the frame of _cart1 with the yaw, then every
+     * shift within TRANSLATION_SEARCH_RADIUS cells is scored by the cosine similarity of the
+     * overlapping cells. the best one is refined with a parabola along each axis.
+     */
+    const int num_cells = _cart1.rows();
+    const double half_extent = 0.5 * num_cells;
+    const double cos_yaw = cos(_yaw), sin_yaw = sin(_yaw);
+    MatrixXd rotated = MatrixXd::Zero(num_cells, num_cells);
+    for (int x_idx = 0; x_idx < num_cells; x_idx++) {
+        for (int y_idx = 0; y_idx < num_cells; y_idx++) {
+            // cell center in the frame 1 (in cells), rotated back by the yaw into the frame 2
+            const double x1 = x_idx + 0.5 - half_extent, y1 = y_idx + 0.5 - half_extent;
+            const int x2_idx = int(std::floor(cos_yaw * x1 + sin_yaw * y1 + half_extent));
+            const int y2_idx = int(std::floor(-sin_yaw * x1 + cos_yaw * y1 + half_extent));
+            if (x2_idx < 0 || x2_idx >= num_cells || y2_idx < 0 || y2_idx >= num_cells) continue;
+            rotated(x_idx, y_idx) = _cart2(x2_idx, y2_idx);
+        }
+    }
+
+    // _cart1(c) ~ rotated(c - shift)
+    const int radius = std::min(TRANSLATION_SEARCH_RADIUS, num_cells - 1);
+    const int window = 2 * radius + 1;
+    MatrixXd dists = MatrixXd::Constant(window, window, std::numeric_limits<double>::infinity());
+    for (int dx = -radius; dx <= radius; dx++) {
+        for (int dy = -radius; dy <= radius; dy++) {
+            const int x_begin = std::max(0, dx), x_end = std::min(num_cells, num_cells + dx);
+            const int y_begin = std::max(0, dy), y_end = std::min(num_cells, num_cells + dy);
+            const auto overlap1 = _cart1.block(x_begin, y_begin, x_end - x_begin, y_end - y_begin);
+            const auto overlap2 =
+                rotated.block(x_begin - dx, y_begin - dy, x_end - x_begin, y_end - y_begin);
+            const double norms = overlap1.norm() * overlap2.norm();
+            if (norms == 0) continue;
+            dists(dx + radius, dy + radius) = 1.0 - overlap1.cwiseProduct(overlap2).sum() / norms;
+        }
+    }
+
+    int best_x, best_y;
+    if (!std::isfinite(dists.minCoeff(&best_x, &best_y)))
+        return Vector2d::Constant(std::numeric_limits<double>::quiet_NaN());
+    auto offset = [](const auto &line, int idx) {
+        if (idx == 0 || idx == line.size() - 1) return 0.0;  // no neighbour on one side
+        return parabolicMinimumOffset(line(idx - 1), line(idx), line(idx + 1));
+    };
+    const double shift_x = best_x - radius + offset(dists.col(best_y), best_x);
+    const double shift_y = best_y - radius + offset(dists.row(best_x), best_y);
+    return CART_CELL_SIZE * Vector2d(shift_x, shift_y);
+}  // estimateTranslation
+
+std::pair<double, int> SCManager::distanceBtnScanContext(MatrixXd &_sc1, MatrixXd &_sc2) {
+    const bool polar = DESCRIPTOR == DescriptorType::POLAR;
+    if (polar && ROTATION_SEARCH == RotationSearch::FULL_FFT)
+        return searchAllShifts(makeSpectrum(normalizeScancontext(_sc1)),
+                               makeSpectrum(normalizeScancontext(_sc2)));
+
+    // 1. fast align using variant key (not in original IROS18), around no lateral shift otherwise
+    int argmin_vkey_shift = 0;
+    if (polar) {
+        MatrixXd vkey_sc1 = makeSectorkeyFromScancontext(_sc1);
+        MatrixXd vkey_sc2 = makeSectorkeyFromScancontext(_sc2);
+        argmin_vkey_shift = fastAlignUsingVkey(vkey_sc1, vkey_sc2);
+    }
+
+    // 2. fast columnwise diff
+    return searchShifts(normalizeScancontext(_sc1), normalizeScancontext(_sc2),
+                        shiftSearchSpace(argmin_vkey_shift));
 
 }  // distanceBtnScanContext
 
-MatrixXd SCManager::makeScancontext(const std::vector<Vector3d> &_scan_down) {
-    int num_pts_scan_down = _scan_down.size();
+bool SCManager::pointToBin(const Vector3d &_point, int &_ring_idx, int &_sctor_idx) const {
+    // xyz to ring, sector (wihtin 2d plane)
+    float azim_range = sqrt(_point.x() * _point.x() + _point.y() * _point.y());
 
-    // main
-    const int NO_POINT = -1000;
-    MatrixXd desc = NO_POINT * MatrixXd::Ones(PC_NUM_RING, PC_NUM_SECTOR);
+    // if range is out of roi, pass (before computing the azimuth, which is the costly part)
+    if (azim_range > PC_MAX_RADIUS) return false;
+
+    float azim_angle = xy2theta(_point.x(), _point.y());
+    _ring_idx =
+        std::max(std::min(PC_NUM_RING, int(ceil((azim_range / PC_MAX_RADIUS) * PC_NUM_RING))), 1);
+    _sctor_idx =
+        std::max(std::min(PC_NUM_SECTOR, int(ceil((azim_angle / 360.0) * PC_NUM_SECTOR))), 1);
+    return true;
+}  // SCManager::pointToBin
 
-    float azim_angle, azim_range;  // wihtin 2d plane
-    int ring_idx, sctor_idx;
+namespace {
+// view of a vector of points as an N x 3 point matrix, without copying it
+Eigen::Map<const PointMatrix> asPointMatrix(const std::vector<Vector3d> &_scan) {
+    return Eigen::Map<const PointMatrix>(_scan.empty() ? nullptr : _scan[0].data(),
+                                         Eigen::Index(_scan.size()), 3);
+}
 
-    for (const auto &point3d : _scan_down) {
-        // xyz to ring, sector
-        azim_range = sqrt(point3d.x() * point3d.x() + point3d.y() * point3d.y());
-        azim_angle = xy2theta(point3d.x(), point3d.y());
+void checkPoints(const PointsRef &_points) {
+    if (_points.cols() < 3) throw std::invalid_argument("the scans must be N x 3 or N x 4 arrays");
+}
+}  // namespace
 
-        // if range is out of roi, pass
-        if (azim_range > PC_MAX_RADIUS) continue;
+double SCManager::intensityScale(const PointsRef &_points) const {
+    if (!NORMALIZE_INTENSITY || _points.cols() < 4 || _points.rows() == 0) return 1.0;
+    const double max_intensity = _points.col(3).maxCoeff();
+    return max_intensity > 0 ? 1.0 / max_intensity : 1.0;
+}  // SCManager::intensityScale
 
-        ring_idx = std::max(
-            std::min(PC_NUM_RING, int(ceil((azim_range / PC_MAX_RADIUS) * PC_NUM_RING))), 1);
-        sctor_idx =
-            std::max(std::min(PC_NUM_SECTOR, int(ceil((azim_angle / 360.0) * PC_NUM_SECTOR))), 1);
+std::vector<int> SCManager::preprocessScan(const PointsRef &_points,
+                                           double _intensity_scale,
+                                           std::vector<int> *_bins) const {
+    checkPoints(_points);
+    const double min_radius_sq = PC_MIN_RADIUS * PC_MIN_RADIUS;
+    const double max_radius_sq = PC_MAX_RADIUS * PC_MAX_RADIUS;
+    const bool has_intensity = _points.cols() > 3;
+    auto in_roi = [&](int point_idx) {
+        const double range_sq = _points.row(point_idx).head<2>().squaredNorm();
+        const double z = _points(point_idx, 2);
+        return range_sq >= min_radius_sq && range_sq <= max_radius_sq && z >= PC_MIN_HEIGHT &&
+               z <= PC_MAX_HEIGHT &&
+               (!has_intensity || _intensity_scale * _points(point_idx, 3) >= MIN_INTENSITY);
+    };
+    const int num_points = int(_points.rows());
 
-        // taking maximum z
-        if (desc(ring_idx - 1, sctor_idx - 1) <
-            point3d.z() + LIDAR_HEIGHT)  // -1 means cpp starts from 0
-            desc(ring_idx - 1, sctor_idx - 1) =
-                point3d.z() + LIDAR_HEIGHT;  // update for taking maximum value at that bin
+    std::vector<int> preprocessed;
+    if (DOWNSAMPLING == Downsampling::NONE) {
+        preprocessed.reserve(num_points);
+        for (int point_idx = 0; point_idx < num_points; point_idx++)
+            if (in_roi(point_idx)) preprocessed.push_back(point_idx);
+        return preprocessed;
     }
 
-    // reset no points to zero (for cosine dist later)
-    for (int row_idx = 0; row_idx < desc.rows(); row_idx++)
-        for (int col_idx = 0; col_idx < desc.cols(); col_idx++)
-            if (desc(row_idx, col_idx) == NO_POINT) desc(row_idx, col_idx) = 0;
+    if (DOWNSAMPLING == Downsampling::BIN_MAX) {
+        std::vector<int> highest(PC_NUM_RING * PC_NUM_SECTOR, -1);
+        std::vector<double> highest_z(highest.size());  // not to read the points back
+        int ring_idx, sctor_idx;
+        for (int point_idx = 0; point_idx < num_points; point_idx++) {
+            const Vector3d point3d = _points.row(point_idx).head<3>().transpose();
+            if (!in_roi(point_idx) || !pointToBin(point3d, ring_idx, sctor_idx)) continue;
+            const int bin_idx = (ring_idx - 1) * PC_NUM_SECTOR + (sctor_idx - 1);
+            if (highest[bin_idx] == -1 || highest_z[bin_idx] < point3d.z()) {
+                highest[bin_idx] = point_idx;
+                highest_z[bin_idx] = point3d.z();
+            }
+        }
+        for (int bin_idx = 0; bin_idx < int(highest.size()); bin_idx++) {
+            if (highest[bin_idx] == -1) continue;
+            preprocessed.push_back(highest[bin_idx]);
+            if (_bins != nullptr) _bins->push_back(bin_idx);
+        }
+        return preprocessed;
+    }
+
+    // Downsampling::VOXEL
+    struct VoxelHash {
+        size_t operator()(const Eigen::Vector3i &voxel) const {
+            const uint32_t *vec = reinterpret_cast<const uint32_t *>(voxel.data());
+            return ((1 << 20) - 1) & (vec[0] * 73856093 ^ vec[1] * 19349669 ^ vec[2] * 83492791);
+        }
+    };
+    std::unordered_map<Eigen::Vector3i, int, VoxelHash> grid;
+    grid.reserve(num_points);
+    for (int point_idx = 0; point_idx < num_points; point_idx++) {
+        if (!in_roi(point_idx)) continue;
+        const Vector3d point3d = _points.row(point_idx).head<3>().transpose();
+        const Eigen::Vector3i voxel = (point3d / VOXEL_SIZE).array().floor().cast<int>();
+        auto [it, inserted] = grid.emplace(voxel, point_idx);
+        if (!inserted && _points(it->second, 2) < point3d.z()) it->second = point_idx;
+    }
+    preprocessed.reserve(grid.size());
+    for (const auto &[voxel, point_idx] : grid) preprocessed.push_back(point_idx);
+    return preprocessed;
+}  // SCManager::preprocessScan
+
+MatrixXd SCManager::makeScancontext(const std::vector<Vector3d> &_scan_down,
+                                    MatrixXd *_cartesian) const {
+    return makeScancontext(asPointMatrix(_scan_down), _cartesian);
+}  // SCManager::makeScancontext
 
+MatrixXd SCManager::makeScancontext(const PointsRef &_points, MatrixXd *_cartesian) const {
+    MatrixXd desc;
+    if (DESCRIPTOR == DescriptorType::POLAR)
+        encodeScan(_points, &desc, nullptr, _cartesian);
+    else
+        encodeScan(_points, nullptr, &desc, _cartesian);
     return desc;
 }  // SCManager::makeScancontext
 
-MatrixXd SCManager::makeRingkeyFromScancontext(MatrixXd &_desc) {
+bool SCManager::pointToCartesianBin(const Vector3d &_point, int &_row_idx, int &_col_idx) const {
+    // longitudinal (x) rows over [-PC_MAX_RADIUS, PC_MAX_RADIUS], lateral (y) columns over
+    // [-CC_MAX_LATERAL, CC_MAX_LATERAL]
+    if (std::abs(_point.x()) >= PC_MAX_RADIUS || std::abs(_point.y()) >= CC_MAX_LATERAL)
+        return false;
+    _row_idx = int((_point.x() + PC_MAX_RADIUS) / (2 * PC_MAX_RADIUS) * PC_NUM_RING);
+    _col_idx = int((_point.y() + CC_MAX_LATERAL) / (2 * CC_MAX_LATERAL) * PC_NUM_SECTOR);
+    return true;
+}  // SCManager::pointToCartesianBin
+
+void SCManager::encodeScan(const PointsRef &_points,
+                           MatrixXd *_polar,
+                           MatrixXd *_cartesian_context,
+                           MatrixXd *_cartesian) const {
+    checkPoints(_points);
+    const bool has_intensity = _points.cols() > 3;
+    if (BIN_ENCODER == BinEncoder::MAX_INTENSITY && !has_intensity)
+        throw std::invalid_argument("the max intensity encoding needs N x 4 points");
+    const double intensity_scale = intensityScale(_points);
+    const bool preprocess = DOWNSAMPLING != Downsampling::NONE || PC_MIN_RADIUS > 0 ||
+                            std::isfinite(PC_MIN_HEIGHT) || std::isfinite(PC_MAX_HEIGHT) ||
+                            (has_intensity && std::isfinite(MIN_INTENSITY));
+    std::vector<int> preprocessed, bins;  // the polar bins of the points already, with BIN_MAX
+    if (preprocess) preprocessed = preprocessScan(_points, intensity_scale, &bins);
+    const int num_points = preprocess ? int(preprocessed.size()) : int(_points.rows());
+
+    // main
+    const int NO_POINT = -1000;
+    const bool take_maximum =
+        BIN_ENCODER == BinEncoder::MAX_HEIGHT || BIN_ENCODER == BinEncoder::MAX_INTENSITY;
+    const MatrixXd empty_desc =
+        (take_maximum ? NO_POINT : 0) * MatrixXd::Ones(PC_NUM_RING, PC_NUM_SECTOR);
+    MatrixXd polar_counts, cartesian_context_counts;
+    if (_polar != nullptr) *_polar = empty_desc;
+    if (_cartesian_context != nullptr) *_cartesian_context = empty_desc;
+    if (BIN_ENCODER == BinEncoder::MEAN_HEIGHT) {
+        polar_counts = MatrixXd::Zero(PC_NUM_RING, PC_NUM_SECTOR);
+        cartesian_context_counts = MatrixXd::Zero(PC_NUM_RING, PC_NUM_SECTOR);
+    }
+    if (_cartesian != nullptr)
+        *_cartesian = NO_POINT * MatrixXd::Ones(CART_NUM_CELLS, CART_NUM_CELLS);
+    const double cart_half_extent = 0.5 * CART_NUM_CELLS * CART_CELL_SIZE;
+
+    auto encode = [&](MatrixXd &desc, MatrixXd &counts, int row_idx, int col_idx,
+                      const Vector3d &point3d, int point_idx) {
+        double &bin = desc(row_idx, col_idx);
+        switch (BIN_ENCODER) {
+            case BinEncoder::MAX_HEIGHT:
+                // taking maximum z
+                if (bin < point3d.z() + LIDAR_HEIGHT) bin = point3d.z() + LIDAR_HEIGHT;
+                break;
+            case BinEncoder::MAX_INTENSITY:
+                bin = std::max(bin, intensity_scale * _points(point_idx, 3));
+                break;
+            case BinEncoder::POINT_COUNT:
+                bin += 1;
+                break;
+            case BinEncoder::MEAN_HEIGHT:
+                bin += point3d.z() + LIDAR_HEIGHT;
+                counts(row_idx, col_idx) += 1;
+                break;
+        }
+    };
+
+    // every descriptor is filled from the same pass over the points
+    int ring_idx, sctor_idx, row_idx, col_idx;
+    for (int iter_idx = 0; iter_idx < num_points; iter_idx++) {
+        const int point_idx = preprocess ? preprocessed[iter_idx] : iter_idx;
+        const Vector3d point3d = _points.row(point_idx).head<3>().transpose();
+        if (_cartesian != nullptr && std::abs(point3d.x()) < cart_half_extent &&
+            std::abs(point3d.y()) < cart_half_extent) {
+            double &cell = (*_cartesian)(int((point3d.x() + cart_half_extent) / CART_CELL_SIZE),
+                                         int((point3d.y() + cart_half_extent) / CART_CELL_SIZE));
+            cell = std::max(cell, point3d.z() + LIDAR_HEIGHT);
+        }
+        if (_cartesian_context != nullptr && pointToCartesianBin(point3d, row_idx, col_idx))
+            encode(*_cartesian_context, cartesian_context_counts, row_idx, col_idx, point3d,
+                   point_idx);
+        if (_polar != nullptr && !bins.empty())
+            encode(*_polar, polar_counts, bins[iter_idx] / PC_NUM_SECTOR,
+                   bins[iter_idx] % PC_NUM_SECTOR, point3d, point_idx);
+        else if (_polar != nullptr && pointToBin(point3d, ring_idx, sctor_idx))
+            // -1 means cpp starts from 0
+            encode(*_polar, polar_counts, ring_idx - 1, sctor_idx - 1, point3d, point_idx);
+    }
+
+    // reset no points to zero (for cosine dist later)
+    for (auto [desc, counts] : {std::make_pair(_polar, &polar_counts),
+                                std::make_pair(_cartesian_context, &cartesian_context_counts)}) {
+        if (desc == nullptr) continue;
+        if (take_maximum)
+            *desc = (desc->array() == NO_POINT).select(0, *desc);
+        else if (BIN_ENCODER == BinEncoder::MEAN_HEIGHT)
+            *desc = (counts->array() > 0).select(desc->array() / counts->array(), 0);
+    }
+    if (_cartesian != nullptr)
+        *_cartesian = (_cartesian->array() == NO_POINT).select(0, *_cartesian);
+}  // SCManager::encodeScan
+
+MatrixXd SCManager::makeRingkeyFromScancontext(MatrixXd &_desc) const {
     /*
      * summary: rowwise mean vector
      */
@@ -172,7 +721,7 @@ MatrixXd SCManager::makeRingkeyFromScancontext(MatrixXd &_desc) {
     return invariant_key;
 }  // SCManager::makeRingkeyFromScancontext
 
-MatrixXd SCManager::makeSectorkeyFromScancontext(MatrixXd &_desc) {
+MatrixXd SCManager::makeSectorkeyFromScancontext(MatrixXd &_desc) const {
     /*
      * summary: columnwise mean vector
      */
@@ -185,8 +734,82 @@ MatrixXd SCManager::makeSectorkeyFromScancontext(MatrixXd &_desc) {
     return variant_key;
 }  // SCManager::makeSectorkeyFromScancontext
 
-void SCManager::makeAndSaveScancontextAndKeys(const std::vector<Vector3d> &_scan_down) {
-    MatrixXd sc = makeScancontext(_scan_down);  // v1
+bool SCManager::makeAndSaveScancontextAndKeys(const PointsRef &_points, const Vector3d &_position) {
+    MatrixXd cartesian;
+    MatrixXd sc = makeScancontext(_points, ESTIMATE_TRANSLATION ? &cartesian : nullptr);  // v1
+    return saveScancontextAndKeys(sc, _position, cartesian);
+}  // SCManager::makeAndSaveScancontextAndKeys
+
+void SCManager::processScan(const PointsRef &_points,
+                            double _score_thres,
+                            double _closure_thres,
+                            std::vector<double> &_scores,
+                            std::vector<double> &_closures) {
+    if (!makeAndSaveScancontextAndKeys(_points)) return;
+    const auto [query_id, candidate_ids, candidate_dists, candidate_yaws] = detectLoopClosureID();
+    if (query_id == -1) return;
+    for (size_t candidate_iter_idx = 0; candidate_iter_idx < candidate_ids.size();
+         candidate_iter_idx++) {
+        const double dist = candidate_dists[candidate_iter_idx];
+        if (!(dist < _score_thres)) continue;
+        const double candidate_id = candidate_ids[candidate_iter_idx];
+        _scores.insert(_scores.end(), {double(query_id), candidate_id, dist});
+        if (!(dist < _closure_thres)) continue;
+        // as the initial guesses of the python side, no translation if it was not estimated
+        const Vector2d translation = candidate_translations_[candidate_iter_idx].unaryExpr(
+            [](double value) { return std::isnan(value) ? 0.0 : value; });
+        const double cos_yaw = std::cos(candidate_yaws[candidate_iter_idx]);
+        const double sin_yaw = std::sin(candidate_yaws[candidate_iter_idx]);
+        _closures.insert(_closures.end(), {candidate_id, double(query_id),           //
+                                           cos_yaw, -sin_yaw, 0.0, translation.x(),  //
+                                           sin_yaw, cos_yaw, 0.0, translation.y(),   //
+                                           0.0, 0.0, 1.0, 0.0,                       //
+                                           0.0, 0.0, 0.0, 1.0});
+    }
+}  // SCManager::processScan
+
+bool SCManager::makeAndSaveScancontextAndKeys(const std::vector<Vector3d> &_scan_down,
+                                              const Vector3d &_position) {
+    return makeAndSaveScancontextAndKeys(asPointMatrix(_scan_down), _position);
+}  // SCManager::makeAndSaveScancontextAndKeys
+
+bool SCManager::saveScancontextAndKeys(const MatrixXd &_sc,
+                                       const Vector3d &_position,
+                                       const MatrixXd &_cartesian) {
+    const size_t id = num_scans_seen_++;
+    if (!isKeyframe(_sc, _position)) return false;
+
+    appendKeyframe(_sc, id, _position, _cartesian);
+    if (MAX_MEMORY_BYTES == 0) return true;
+    auto total_bytes = [this]() {
+        size_t bytes = 0;
+        for (const auto &structure : memoryUsage()) bytes += structure.second;
+        return bytes;
+    };
+    if (total_bytes() <= MAX_MEMORY_BYTES) return true;
+    // an eviction invalidates the tree, evict a batch down to the low-water mark so that it is
+    // rebuilt once per batch rather than at every insert
+    const size_t low_water_bytes = size_t(EVICTION_LOW_WATER * double(MAX_MEMORY_BYTES));
+    while (polarcontexts_.size() > size_t(NUM_EXCLUDE_RECENT) && total_bytes() > low_water_bytes)
+        evictOne();
+    return true;
+}  // SCManager::saveScancontextAndKeys
+
+void SCManager::restoreScancontextAndKeys(const MatrixXd &_sc,
+                                          size_t _id,
+                                          size_t _last_matched,
+                                          const MatrixXd &_cartesian) {
+    appendKeyframe(_sc, _id, NO_POSITION, _cartesian);
+    polarcontext_last_matched_.back() = _last_matched;
+    num_scans_seen_ = std::max(num_scans_seen_, _id + 1);
+}  // SCManager::restoreScancontextAndKeys
+
+void SCManager::appendKeyframe(const MatrixXd &_sc,
+                               size_t _id,
+                               const Vector3d &_position,
+                               const MatrixXd &_cartesian) {
+    if (attached_.num_keyframes > 0) throw std::logic_error("an attached database is read-only");
+    MatrixXd sc = _sc;
     MatrixXd ringkey = makeRingkeyFromScancontext(sc);
     MatrixXd sectorkey = makeSectorkeyFromScancontext(sc);
     std::vector<float> polarcontext_invkey_vec = eig2stdvec(ringkey);
@@ -195,63 +818,572 @@ void SCManager::makeAndSaveScancontextAndKeys(const std::vector<Vector3d> &_scan
     polarcontext_invkeys_.push_back(ringkey);
     polarcontext_vkeys_.push_back(sectorkey);
     polarcontext_invkeys_mat_.push_back(polarcontext_invkey_vec);
+    if (PYRAMID_LEVELS > 0) polarcontext_pyramids_.push_back(makePyramid(sc));
+    if (DESCRIPTOR == DescriptorType::POLAR && ROTATION_SEARCH == RotationSearch::FULL_FFT)
+        polarcontext_spectra_.push_back(makeSpectrum(normalizeScancontext(sc)));
+    if (SPARSE_DESCRIPTORS) polarcontext_sparse_.push_back(makeSparseScancontext(sc));
+    polarcontext_cartesians_.push_back(_cartesian);
 
-}  // SCManager::makeAndSaveScancontextAndKeys
+    polarcontext_ids_.push_back(_id);
+    polarcontext_last_matched_.push_back(_id);
+    polarcontext_positions_.push_back(_position);
+}  // SCManager::appendKeyframe
 
-std::tuple<int, std::vector<size_t>, std::vector<double>, std::vector<double>> SCManager::detectLoopClosureID() {
-    auto curr_key = polarcontext_invkeys_mat_.back();  // current observation (query)
-    auto curr_desc = polarcontexts_.back();            // current observation (query)
+bool SCManager::isKeyframe(const MatrixXd &_sc, const Vector3d &_position) const {
+    if (polarcontexts_.empty()) return true;
 
-    // knn search
-    std::vector<size_t> candidate_indexes(NUM_CANDIDATES_FROM_TREE);
-    std::vector<float> out_dists_sqr(NUM_CANDIDATES_FROM_TREE);
-    std::vector<double> candidate_dists(NUM_CANDIDATES_FROM_TREE);
-    std::vector<double> candidate_yaws(NUM_CANDIDATES_FROM_TREE);
+    const Vector3d &prev_position = polarcontext_positions_.back();
+    if (KEYFRAME_MIN_DISTANCE > 0 && !_position.hasNaN() && !prev_position.hasNaN() &&
+        (_position - prev_position).norm() < KEYFRAME_MIN_DISTANCE)
+        return false;
+
+    if (KEYFRAME_SC_DIST_THRES > 0) {
+        // a nearly identical descriptor is aligned already, no need to search the shifts
+        const double dist =
+            distAtShift(normalizeScancontext(_sc), normalizeScancontext(polarcontexts_.back()), 0,
+                        KEYFRAME_SC_DIST_THRES);
+        if (dist < KEYFRAME_SC_DIST_THRES) return false;
+    }
+    return true;
+}  // SCManager::isKeyframe
+
+int SCManager::indexOf(size_t _id) const {
+    auto it = std::lower_bound(polarcontext_ids_.begin(), polarcontext_ids_.end(), _id);
+    if (it == polarcontext_ids_.end() || *it != _id) return -1;
+    return int(it - polarcontext_ids_.begin());
+}  // SCManager::indexOf
+
+void SCManager::evictOne() {
+    /*
+     * step 1: the keyframe closest to its successor in the ring key space, if close enough
+     * step 2: otherwise, the least recently matched one (the oldest among ties)
+     * the NUM_EXCLUDE_RECENT latest keyframes are not candidates, the caller checks there is one
+     */
+    const size_t num_evictable = polarcontexts_.size() - NUM_EXCLUDE_RECENT;
+    size_t victim = num_evictable;
+    double min_successor_dist = EVICTION_RINGKEY_DIST;
+    for (size_t idx = 0; idx < num_evictable; idx++) {
+        const double successor_dist =
+            (polarcontext_invkeys_[idx] - polarcontext_invkeys_[idx + 1]).norm();
+        if (successor_dist < min_successor_dist) {
+            min_successor_dist = successor_dist;
+            victim = idx;
+        }
+    }
+    if (victim == num_evictable) {
+        victim = 0;
+        for (size_t idx = 1; idx < num_evictable; idx++)
+            if (polarcontext_last_matched_[idx] < polarcontext_last_matched_[victim]) victim = idx;
+    }
+
+    polarcontexts_.erase(polarcontexts_.begin() + victim);
+    polarcontext_invkeys_.erase(polarcontext_invkeys_.begin() + victim);
+    polarcontext_vkeys_.erase(polarcontext_vkeys_.begin() + victim);
+    polarcontext_invkeys_mat_.erase(polarcontext_invkeys_mat_.begin() + victim);
+    if (!polarcontext_pyramids_.empty())
+        polarcontext_pyramids_.erase(polarcontext_pyramids_.begin() + victim);
+    if (!polarcontext_spectra_.empty())
+        polarcontext_spectra_.erase(polarcontext_spectra_.begin() + victim);
+    polarcontext_cartesians_.erase(polarcontext_cartesians_.begin() + victim);
+    if (!polarcontext_sparse_.empty())
+        polarcontext_sparse_.erase(polarcontext_sparse_.begin() + victim);
+    polarcontext_ids_.erase(polarcontext_ids_.begin() + victim);
+    polarcontext_last_matched_.erase(polarcontext_last_matched_.begin() + victim);
+    polarcontext_positions_.erase(polarcontext_positions_.begin() + victim);
+
+    // the tree indexes are stale now, it is rebuilt at the next query
+    polarcontext_tree_.reset();
+    polarcontext_invkeys_to_search_.clear();
+}  // SCManager::evictOne
+
+std::map<std::string, size_t> SCManager::memoryUsage() const {
+    // all the descriptors and keys have the same size, no need to visit them (but the optional
+    // cartesian grids). the live entries only, not the spare capacity of the vectors, so that the
+    // evictions do not depend on the insertion history (e.g., the same after a resume)
+    const size_t num_keyframes = polarcontexts_.size();
+    const size_t key_vec_bytes = sizeof(std::vector<float>) + PC_NUM_RING * sizeof(float);
+    std::map<std::string, size_t> usage;
+    usage["scan_contexts"] = polarcontexts_.size() * sizeof(MatrixXd) +
+                             num_keyframes * PC_NUM_RING * PC_NUM_SECTOR * sizeof(double);
+    usage["ring_keys"] = polarcontext_invkeys_.size() * sizeof(MatrixXd) +
+                         num_keyframes * PC_NUM_RING * sizeof(double) +
+                         polarcontext_invkeys_mat_.size() * key_vec_bytes;
+    usage["sector_keys"] = polarcontext_vkeys_.size() * sizeof(MatrixXd) +
+                           num_keyframes * PC_NUM_SECTOR * sizeof(double);
+    usage["pyramids"] = polarcontext_pyramids_.size() * sizeof(std::vector<NormalizedSC>);
+    for (int rows = PC_NUM_RING, cols = PC_NUM_SECTOR, level_idx = 0;
+         !polarcontext_pyramids_.empty() && level_idx < PYRAMID_LEVELS; level_idx++) {
+        rows = (rows + 1) / 2, cols = (cols + 1) / 2;
+        usage["pyramids"] += polarcontext_pyramids_.size() *
+                             (sizeof(NormalizedSC) + rows * cols * sizeof(double) + (cols + 7) / 8);
+    }
+    usage["spectra"] = polarcontext_spectra_.size() * sizeof(SCSpectrum);
+    for (const auto &spec : polarcontext_spectra_)
+        usage["spectra"] +=
+            (spec.rings.size() + 1) * spec.occupied.size() * sizeof(std::complex<double>) +
+            spec.rings.size() * sizeof(std::vector<std::complex<double>>);
+    usage["cartesians"] = polarcontext_cartesians_.size() * sizeof(MatrixXd);
+    for (const auto &cartesian : polarcontext_cartesians_)
+        usage["cartesians"] += cartesian.size() * sizeof(double);
+    usage["sparse"] = polarcontext_sparse_.size() * sizeof(SparseSC);
+    for (const auto &ssc : polarcontext_sparse_)
+        usage["sparse"] += ssc.columns.size() * sizeof(double);
+    usage["keyframe_info"] = polarcontext_ids_.size() * sizeof(size_t) +
+                             polarcontext_last_matched_.size() * sizeof(size_t) +
+                             polarcontext_positions_.size() * sizeof(Vector3d);
+    usage["tree"] = polarcontext_invkeys_to_search_.size() * key_vec_bytes;
+    if (polarcontext_tree_)
+        usage["tree"] += polarcontext_tree_->index->usedMemory(*polarcontext_tree_->index);
+    return usage;
+}  // SCManager::memoryUsage
+
+void SCManager::rebuildTree(size_t _num_keys) {
+    // a fresh copy, i.e., its capacity (in memoryUsage()) does not depend on the previous builds
+    polarcontext_tree_.reset();
+    polarcontext_invkeys_to_search_ =
+        KeyMat(polarcontext_invkeys_mat_.begin(), polarcontext_invkeys_mat_.begin() + _num_keys);
+
+    polarcontext_tree_ = std::make_unique<InvKeyTree>(
+        PC_NUM_RING /* dim */, polarcontext_invkeys_to_search_, 10 /* max leaf */);
+    // tree_point3dr_->index->buildIndex(); // inernally called in the constructor of InvKeyTree
+    // (for detail, refer the nanoflann and KDtreeVectorOfVectorsAdapoint3dor)
+}  // SCManager::rebuildTree
+
+void SCManager::attachDatabase(const DatabaseBuffers &_buffers) {
+    if (!polarcontexts_.empty())
+        throw std::logic_error("only an empty manager can attach a database");
+    attached_ = _buffers;
+    polarcontext_ids_.assign(_buffers.ids, _buffers.ids + _buffers.num_keyframes);
+    polarcontext_tree_.reset();
+    polarcontext_invkeys_to_search_.clear();
+    for (size_t idx = 0; idx < _buffers.num_keyframes; idx++)
+        polarcontext_invkeys_to_search_.emplace_back(_buffers.ringkeys + idx * PC_NUM_RING,
+                                                     _buffers.ringkeys + (idx + 1) * PC_NUM_RING);
+    polarcontext_tree_ = std::make_unique<InvKeyTree>(
+        PC_NUM_RING /* dim */, polarcontext_invkeys_to_search_, 10 /* max leaf */);
+}  // SCManager::attachDatabase
+
+void SCManager::exportDatabase(const DatabaseBuffers &_buffers) const {
+    const size_t desc_size = PC_NUM_RING * PC_NUM_SECTOR;
+    const size_t cart_size = CART_NUM_CELLS * CART_NUM_CELLS;
+    for (size_t idx = 0; idx < _buffers.num_keyframes; idx++) {
+        Eigen::Map<MatrixXd>(_buffers.descriptors + idx * desc_size, PC_NUM_RING, PC_NUM_SECTOR) =
+            descriptorAt(idx);
+        std::copy(polarcontext_invkeys_mat_[idx].begin(), polarcontext_invkeys_mat_[idx].end(),
+                  _buffers.ringkeys + idx * PC_NUM_RING);
+        Eigen::Map<MatrixXd>(_buffers.sectorkeys + idx * PC_NUM_SECTOR, 1, PC_NUM_SECTOR) =
+            sectorkeyAt(idx);
+        _buffers.ids[idx] = polarcontext_ids_[idx];
+        if (_buffers.cartesians == nullptr) continue;
+        if (size_t(cartesianAt(idx).size()) != cart_size)
+            throw std::invalid_argument("keyframe " + std::to_string(polarcontext_ids_[idx]) +
+                                        " has no cartesian grid to export");
+        Eigen::Map<MatrixXd>(_buffers.cartesians + idx * cart_size, CART_NUM_CELLS,
+                             CART_NUM_CELLS) = cartesianAt(idx);
+    }
+}  // SCManager::exportDatabase
+
+Eigen::Map<const MatrixXd> SCManager::descriptorAt(size_t _idx) const {
+    if (attached_.num_keyframes == 0)
+        return Eigen::Map<const MatrixXd>(polarcontexts_[_idx].data(), PC_NUM_RING, PC_NUM_SECTOR);
+    return Eigen::Map<const MatrixXd>(attached_.descriptors + _idx * PC_NUM_RING * PC_NUM_SECTOR,
+                                      PC_NUM_RING, PC_NUM_SECTOR);
+}  // SCManager::descriptorAt
+
+Eigen::Map<const MatrixXd> SCManager::sectorkeyAt(size_t _idx) const {
+    if (attached_.num_keyframes == 0)
+        return Eigen::Map<const MatrixXd>(polarcontext_vkeys_[_idx].data(), 1, PC_NUM_SECTOR);
+    return Eigen::Map<const MatrixXd>(attached_.sectorkeys + _idx * PC_NUM_SECTOR, 1,
+                                      PC_NUM_SECTOR);
+}  // SCManager::sectorkeyAt
+
+const std::vector<NormalizedSC> &SCManager::pyramidAt(size_t _idx,
+                                                      std::vector<NormalizedSC> &_storage) const {
+    if (attached_.num_keyframes == 0) return polarcontext_pyramids_[_idx];
+    _storage = makePyramid(descriptorAt(_idx));
+    return _storage;
+}  // SCManager::pyramidAt
+
+const SCSpectrum &SCManager::spectrumAt(size_t _idx, SCSpectrum &_storage) const {
+    if (attached_.num_keyframes == 0 && polarcontext_spectra_.size() == polarcontexts_.size())
+        return polarcontext_spectra_[_idx];
+    _storage = makeSpectrum(normalizeScancontext(descriptorAt(_idx)));
+    return _storage;
+}  // SCManager::spectrumAt
+
+Eigen::Map<const MatrixXd> SCManager::cartesianAt(size_t _idx) const {
+    if (attached_.num_keyframes == 0) {
+        const MatrixXd &cartesian = polarcontext_cartesians_[_idx];
+        return Eigen::Map<const MatrixXd>(cartesian.data(), cartesian.rows(), cartesian.cols());
+    }
+    if (attached_.cartesians == nullptr) return Eigen::Map<const MatrixXd>(nullptr, 0, 0);
+    return Eigen::Map<const MatrixXd>(attached_.cartesians + _idx * CART_NUM_CELLS * CART_NUM_CELLS,
+                                      CART_NUM_CELLS, CART_NUM_CELLS);
+}  // SCManager::cartesianAt
+
+void SCManager::updateTree(size_t _num_queries) {
+    // tree_ reconstruction (not mandatory to make everytime), at most once for a batch of queries
+    const size_t period_offset = tree_making_period_conter % TREE_MAKING_PERIOD_;
+    if (period_offset == 0 || period_offset + _num_queries > size_t(TREE_MAKING_PERIOD_) ||
+        !polarcontext_tree_)  // to save computation cost
+    {
+        rebuildTree(polarcontext_invkeys_mat_.size() - NUM_EXCLUDE_RECENT);
+    }
+    tree_making_period_conter = tree_making_period_conter + _num_queries;
+}  // SCManager::updateTree
+
+ClosureCandidates SCManager::detectLoopClosureID() {
     /*
      * step 1: candidates from ringkey tree_
      */
     if (polarcontext_invkeys_mat_.size() < NUM_EXCLUDE_RECENT + 1) {
-        return {-1, candidate_indexes, candidate_dists, candidate_yaws};  // Early return
+        candidate_translations_.assign(
+            NUM_CANDIDATES_FROM_TREE, Vector2d::Constant(std::numeric_limits<double>::quiet_NaN()));
+        return {-1, std::vector<size_t>(NUM_CANDIDATES_FROM_TREE),
+                std::vector<double>(NUM_CANDIDATES_FROM_TREE),
+                std::vector<double>(NUM_CANDIDATES_FROM_TREE)};  // Early return
     }
+    updateTree(1);
+    return detectForKeyframe(polarcontexts_.size() - 1);
+}  // SCManager::detectLoopClosureID
 
-    // tree_ reconstruction (not mandatory to make everytime)
-    if (tree_making_period_conter % TREE_MAKING_PERIOD_ == 0)  // to save computation cost
-    {
-        polarcontext_invkeys_to_search_.clear();
-        polarcontext_invkeys_to_search_.assign(
-            polarcontext_invkeys_mat_.begin(),
-            polarcontext_invkeys_mat_.end() - NUM_EXCLUDE_RECENT);
+std::vector<ClosureCandidates> SCManager::detectLoopClosureIDs(
+    const std::vector<size_t> &_query_ids) {
+    std::vector<ClosureCandidates> results;
+    const bool enough_keyframes = polarcontext_invkeys_mat_.size() >= NUM_EXCLUDE_RECENT + 1;
+    if (enough_keyframes) updateTree(_query_ids.size());
+    for (size_t query_id : _query_ids) {
+        const int query_idx = indexOf(query_id);
+        if (!enough_keyframes || query_idx < NUM_EXCLUDE_RECENT)
+            results.emplace_back(-1, std::vector<size_t>(), std::vector<double>(),
+                                 std::vector<double>());
+        else
+            results.push_back(detectForKeyframe(query_idx));
+    }
+    return results;
+}  // SCManager::detectLoopClosureIDs
+
+ClosureCandidates SCManager::detectForKeyframe(size_t _query_idx) {
+    const std::vector<NormalizedSC> NO_PYRAMID;
+    CandidateSearch search = searchCandidates(
+        polarcontexts_[_query_idx], polarcontext_invkeys_mat_[_query_idx],
+        polarcontext_vkeys_[_query_idx],
+        PYRAMID_LEVELS > 0 ? polarcontext_pyramids_[_query_idx] : NO_PYRAMID,
+        polarcontext_cartesians_[_query_idx], _query_idx + 1 - NUM_EXCLUDE_RECENT, pruning_stats_);
+    if (SEQUENCE_WINDOW > 0) {
+        for (size_t candidate_iter_idx = 0; candidate_iter_idx < search.indexes.size();
+             candidate_iter_idx++) {
+            double &dist = search.dists[candidate_iter_idx];
+            if (!std::isfinite(dist)) continue;
+            const size_t candidate_idx = search.indexes[candidate_iter_idx];
+            if (sequenceDistance(_query_idx, candidate_idx, search.shifts[candidate_iter_idx],
+                                 search.reversed[candidate_iter_idx]) <= SEQUENCE_DIST_THRES)
+                continue;
+            pruning_stats_.sequence_rejected++;
+            dist = std::numeric_limits<double>::infinity();
+            search.matched.erase(
+                std::remove(search.matched.begin(), search.matched.end(), candidate_idx),
+                search.matched.end());
+        }
+    }
+    for (size_t candidate_idx : search.matched)
+        polarcontext_last_matched_[candidate_idx] = num_scans_seen_;
+    candidate_translations_ = search.translations;
+
+    // internal indexes shift on eviction, the external ids do not
+    for (size_t &candidate_index : search.indexes)
+        candidate_index = polarcontext_ids_[candidate_index];
+    auto query_id = polarcontext_ids_[_query_idx];
+    return {query_id, search.indexes, search.dists, search.yaws};
+}  // SCManager::detectForKeyframe
+
+double SCManager::sequenceDistance(size_t _query_idx,
+                                   size_t _candidate_idx,
+                                   int _shift,
+                                   bool _reversed) const {
+    const int num_cols = PC_NUM_SECTOR;
+    const bool circular = DESCRIPTOR == DescriptorType::POLAR;
+    double min_dist = std::numeric_limits<double>::infinity();
+    for (int direction : {-1, 1}) {
+        // pairs of keyframes walking away from the match, the two windows never overlap. they
+        // follow the external ids: rejected scans and evictions leave gaps between adjacent
+        // keyframes, the window stops at a gap on the query side and skips the keyframes without
+        // a counterpart on the candidate side
+        std::vector<std::pair<size_t, size_t>> pairs;
+        const size_t query_id = polarcontext_ids_[_query_idx];
+        const size_t candidate_id = polarcontext_ids_[_candidate_idx];
+        for (int offset = 1; offset <= SEQUENCE_WINDOW && size_t(offset) <= _query_idx; offset++) {
+            const size_t window_idx = _query_idx - offset;
+            if (polarcontext_ids_[window_idx + 1] - polarcontext_ids_[window_idx] >
+                1 + SEQUENCE_ID_TOLERANCE)
+                break;
+            const long target_id =
+                long(candidate_id) + direction * long(query_id - polarcontext_ids_[window_idx]);
+            if (window_idx == 0 || target_id < 0 ||
+                target_id >= long(polarcontext_ids_[window_idx]))
+                break;
+            // the keyframe with the closest id, before the current one of the query window
+            const auto first = polarcontext_ids_.begin(), last = first + window_idx;
+            auto nearest = std::lower_bound(first, last, size_t(target_id));
+            if (nearest == last || (nearest != first && target_id - long(*std::prev(nearest)) <
+                                                            long(*nearest) - target_id))
+                nearest = std::prev(nearest);
+            if (std::abs(long(*nearest) - target_id) > long(SEQUENCE_ID_TOLERANCE)) continue;
+            pairs.emplace_back(window_idx, size_t(nearest - first));
+        }
+        if (pairs.empty()) continue;
+
+        // the whole window side by side, one block of columns per pair, for a single pass of
+        // columnwise cosine similarities at each shift
+        MatrixXd queries(PC_NUM_RING, pairs.size() * num_cols);
+        for (size_t pair_idx = 0; pair_idx < pairs.size(); pair_idx++) {
+            const MatrixXd &query = polarcontexts_[pairs[pair_idx].first];
+            if (_reversed)
+                queries.middleCols(pair_idx * num_cols, num_cols) = query.reverse();
+            else
+                queries.middleCols(pair_idx * num_cols, num_cols) = query;
+        }
+        const Eigen::RowVectorXd query_norms = queries.colwise().norm();
 
-        polarcontext_tree_.reset();
-        polarcontext_tree_ = std::make_unique<InvKeyTree>(
-            PC_NUM_RING /* dim */, polarcontext_invkeys_to_search_, 10 /* max leaf */);
-        // tree_point3dr_->index->buildIndex(); // inernally called in the constructor of InvKeyTree
-        // (for detail, refer the nanoflann and KDtreeVectorOfVectorsAdapoint3dor)
+        // the heading drifts a little along the windows, each pair takes its best shift around
+        // the one of the centre match
+        std::vector<double> pair_dists(pairs.size(), std::numeric_limits<double>::infinity());
+        for (int delta = -SEQUENCE_SHIFT_RADIUS; delta <= SEQUENCE_SHIFT_RADIUS; delta++) {
+            const int shift = ((_shift + delta) % num_cols + num_cols) % num_cols;
+            const int lateral_shift = int(signedShift(shift, num_cols));
+            MatrixXd candidates = MatrixXd::Zero(PC_NUM_RING, pairs.size() * num_cols);
+            for (size_t pair_idx = 0; pair_idx < pairs.size(); pair_idx++) {
+                const MatrixXd &candidate = polarcontexts_[pairs[pair_idx].second];
+                for (int col_idx = 0; col_idx < num_cols; col_idx++) {
+                    // as in distAtShift
+                    const int shifted_col_idx = circular ? (col_idx - shift + num_cols) % num_cols
+                                                         : col_idx - lateral_shift;
+                    if (shifted_col_idx >= 0 && shifted_col_idx < num_cols)
+                        candidates.col(pair_idx * num_cols + col_idx) =
+                            candidate.col(shifted_col_idx);
+                }
+            }
+            const Eigen::RowVectorXd norms = query_norms.cwiseProduct(candidates.colwise().norm());
+            const Eigen::RowVectorXd similarities =
+                queries.cwiseProduct(candidates).colwise().sum();
+
+            // distAtShift of each pair, i.e., over their common non-empty sectors
+            for (size_t pair_idx = 0; pair_idx < pairs.size(); pair_idx++) {
+                double sum_similarity = 0;
+                int num_eff_cols = 0;
+                for (int col_idx = pair_idx * num_cols; col_idx < int(pair_idx + 1) * num_cols;
+                     col_idx++) {
+                    if (norms(col_idx) == 0) continue;
+                    sum_similarity += similarities(col_idx) / norms(col_idx);
+                    num_eff_cols++;
+                }
+                // no common sector at all counts as unrelated scans
+                const double dist = num_eff_cols == 0 ? 1.0 : 1.0 - sum_similarity / num_eff_cols;
+                pair_dists[pair_idx] = std::min(pair_dists[pair_idx], dist);
+            }
+        }
+        min_dist = std::min(
+            min_dist, std::accumulate(pair_dists.begin(), pair_dists.end(), 0.0) / pairs.size());
     }
-    tree_making_period_conter = tree_making_period_conter + 1;
+    // nothing before the query (or around the candidate) contradicts the match
+    return std::isfinite(min_dist) ? min_dist : 0.0;
+}  // SCManager::sequenceDistance
+
+CandidateSearch SCManager::searchDatabase(const MatrixXd &_sc,
+                                          const MatrixXd &_cartesian,
+                                          PruningStats &_stats) const {
+    if (!polarcontext_tree_) return CandidateSearch();
+    MatrixXd sc = _sc;
+    MatrixXd ringkey = makeRingkeyFromScancontext(sc);
+    return searchCandidates(sc, eig2stdvec(ringkey), makeSectorkeyFromScancontext(sc),
+                            makePyramid(sc), _cartesian, polarcontext_invkeys_to_search_.size(),
+                            _stats);
+}  // SCManager::searchDatabase
 
-    double min_dist = 10000000;  // init with somthing large
-    int nn_align = 0;
-    int nn_idx = 0;
+CandidateSearch SCManager::searchCandidates(const MatrixXd &_desc,
+                                            const std::vector<float> &_ringkey,
+                                            const MatrixXd &_sectorkey,
+                                            const std::vector<NormalizedSC> &_pyramid,
+                                            const MatrixXd &_cartesian,
+                                            size_t _num_searchable,
+                                            PruningStats &_stats) const {
+    const std::vector<float> &curr_key = _ringkey;  // current observation (query)
+    const MatrixXd &curr_desc = _desc;              // current observation (query)
 
-    nanoflann::KNNResultSet<float> knnsearch_result(NUM_CANDIDATES_FROM_TREE);
-    knnsearch_result.init(&candidate_indexes[0], &out_dists_sqr[0]);
-    polarcontext_tree_->index->findNeighbors(knnsearch_result, &curr_key[0] /* query */,
-                                             nanoflann::SearchParams(10));
+    // knn search
+    const bool polar = DESCRIPTOR == DescriptorType::POLAR;
+    const bool coarse_to_fine = polar && PYRAMID_LEVELS > 0;
+    const int num_from_tree = coarse_to_fine
+                                  ? std::max(NUM_CANDIDATES_COARSE, NUM_CANDIDATES_FROM_TREE)
+                                  : NUM_CANDIDATES_FROM_TREE;
+    std::vector<size_t> candidate_indexes;
+    std::vector<float> out_dists_sqr;
+    auto knn = [&](const std::vector<float> &_key) {
+        std::vector<size_t> indexes(num_from_tree);
+        std::vector<float> dists_sqr(num_from_tree);
+        nanoflann::KNNResultSet<float> knnsearch_result(num_from_tree);
+        knnsearch_result.init(&indexes[0], &dists_sqr[0]);
+        polarcontext_tree_->index->findNeighbors(knnsearch_result, &_key[0] /* query */,
+                                                 nanoflann::SearchParams(10));
+        // the tree may hold less than num_from_tree keys, and the ones too recent for an older
+        // query
+        for (size_t result_idx = 0; result_idx < knnsearch_result.size(); result_idx++) {
+            if (indexes[result_idx] >= _num_searchable) continue;
+            candidate_indexes.push_back(indexes[result_idx]);
+            out_dists_sqr.push_back(dists_sqr[result_idx]);
+        }
+    };
+    knn(curr_key);
+
+    // the cartesian context of the query turned around, i.e., its rows and columns reversed
+    const bool reverse = !polar && AUGMENT_REVERSE;
+    const MatrixXd reversed_desc = reverse ? MatrixXd(curr_desc.reverse()) : MatrixXd();
+    if (reverse) {
+        knn(std::vector<float>(curr_key.rbegin(), curr_key.rend()));
+        // the closest num_from_tree of both, once each
+        std::vector<size_t> order(candidate_indexes.size());
+        std::iota(order.begin(), order.end(), 0);
+        std::stable_sort(order.begin(), order.end(),
+                         [&](size_t a, size_t b) { return out_dists_sqr[a] < out_dists_sqr[b]; });
+        std::vector<size_t> merged_indexes;
+        std::vector<float> merged_dists_sqr;
+        for (size_t result_idx : order) {
+            if (int(merged_indexes.size()) == num_from_tree) break;
+            if (std::find(merged_indexes.begin(), merged_indexes.end(),
+                          candidate_indexes[result_idx]) != merged_indexes.end())
+                continue;
+            merged_indexes.push_back(candidate_indexes[result_idx]);
+            merged_dists_sqr.push_back(out_dists_sqr[result_idx]);
+        }
+        candidate_indexes = merged_indexes;
+        out_dists_sqr = merged_dists_sqr;
+    }
+
+    /*
+     * step 1.5 (optional): keep the best candidates on the coarsest pyramid level
+     */
+    std::vector<int> coarse_shifts;
+    if (coarse_to_fine)
+        rankOnPyramid(_pyramid, candidate_indexes, out_dists_sqr, coarse_shifts, _stats);
+    const size_t num_candidates = candidate_indexes.size();
+    std::vector<double> candidate_dists(num_candidates);
+    std::vector<double> candidate_yaws(num_candidates);
+    std::vector<Vector2d> candidate_translations(
+        num_candidates, Vector2d::Constant(std::numeric_limits<double>::quiet_NaN()));
+    std::vector<int> candidate_shifts(num_candidates, 0);
+    std::vector<bool> candidate_reversed(num_candidates, false);
+    std::vector<size_t> matched;
 
     /*
      *  step 2: pairwise distance (find opoint3dimal columnwise best-fit using cosine distance)
+     *  the candidates come sorted by ring key distance, cheap rejections are tried first
      */
-    for (int candidate_iter_idx = 0; candidate_iter_idx < NUM_CANDIDATES_FROM_TREE;
-         candidate_iter_idx++) {
-        MatrixXd polarcontext_candidate = polarcontexts_[candidate_indexes[candidate_iter_idx]];
-        std::pair<double, int> sc_dist_result =
-            distanceBtnScanContext(curr_desc, polarcontext_candidate);
+    const bool full_search =
+        polar && ROTATION_SEARCH == RotationSearch::FULL_FFT && !coarse_to_fine;
+    // the stored sparse forms spare the normalization of the candidates, with the same results
+    const bool sparse = !full_search && !polarcontext_sparse_.empty() &&
+                        polarcontext_sparse_.size() == polarcontexts_.size();
+    const NormalizedSC curr_nsc = sparse ? NormalizedSC() : normalizeScancontext(curr_desc);
+    const SparseSC curr_ssc = sparse ? makeSparseScancontext(curr_desc) : SparseSC();
+    const NormalizedSC curr_reversed_nsc =
+        reverse && !sparse ? normalizeScancontext(reversed_desc) : NormalizedSC();
+    const SparseSC curr_reversed_ssc =
+        reverse && sparse ? makeSparseScancontext(reversed_desc) : SparseSC();
+    const SCSpectrum curr_spec = full_search ? makeSpectrum(curr_nsc) : SCSpectrum();
+    const double UNVERIFIED = std::numeric_limits<double>::infinity();
+    for (size_t candidate_iter_idx = 0; candidate_iter_idx < num_candidates; candidate_iter_idx++) {
+        const size_t candidate_idx = candidate_indexes[candidate_iter_idx];
+        candidate_dists[candidate_iter_idx] = UNVERIFIED;
+        candidate_yaws[candidate_iter_idx] = 0.0;
+
+        if (std::sqrt(out_dists_sqr[candidate_iter_idx]) > RINGKEY_DIST_THRES) {
+            _stats.ringkey_rejected++;
+            continue;
+        }
+
+        // the cartesian context is searched around no lateral shift
+        double vkey_diff_norm = 0;
+        int argmin_vkey_shift = 0;
+        if (polar && (!(full_search || coarse_to_fine) || std::isfinite(SECTORKEY_RESIDUAL_THRES)))
+            argmin_vkey_shift =
+                fastAlignUsingVkey(_sectorkey, sectorkeyAt(candidate_idx), &vkey_diff_norm);
+        if (vkey_diff_norm / std::sqrt(double(PC_NUM_SECTOR)) > SECTORKEY_RESIDUAL_THRES) {
+            _stats.sectorkey_rejected++;
+            continue;
+        }
 
+        const double bound = PRUNE_CANDIDATES ? SC_DIST_THRES : UNVERIFIED;
+        // distance and (fractional, if SUBSECTOR_YAW) shift of the best alignment
+        auto verify = [&](const auto &_curr, const auto &_candidate,
+                          std::pair<double, int> _result) -> std::pair<double, double> {
+            if (!SUBSECTOR_YAW || _result.first >= bound) return _result;
+            return {_result.first, refineShift(_curr, _candidate, _result.second, _result.first)};
+        };
+        auto verifyShifts = [&](const auto &_curr, const auto &_candidate) {
+            std::vector<NormalizedSC> attached_pyramid;
+            const std::vector<int> shifts =
+                coarse_to_fine
+                    ? refineShiftSearchSpace(_pyramid, pyramidAt(candidate_idx, attached_pyramid),
+                                             coarse_shifts[candidate_iter_idx])
+                    : shiftSearchSpace(argmin_vkey_shift);
+            return verify(_curr, _candidate, searchShifts(_curr, _candidate, shifts, bound));
+        };
+        std::pair<double, double> sc_dist_result;
+        bool reversed = false;
+        if (full_search) {
+            // the normalized candidate is only needed to refine the shift
+            SCSpectrum candidate_spec;
+            sc_dist_result = searchAllShifts(curr_spec, spectrumAt(candidate_idx, candidate_spec));
+            if (SUBSECTOR_YAW && sc_dist_result.first < bound)
+                sc_dist_result = verify(curr_nsc, normalizeScancontext(descriptorAt(candidate_idx)),
+                                        {sc_dist_result.first, int(sc_dist_result.second)});
+        } else if (sparse) {
+            sc_dist_result = verifyShifts(curr_ssc, polarcontext_sparse_[candidate_idx]);
+            if (reverse) {
+                const auto reversed_result =
+                    verifyShifts(curr_reversed_ssc, polarcontext_sparse_[candidate_idx]);
+                reversed = reversed_result.first < sc_dist_result.first;
+                if (reversed) sc_dist_result = reversed_result;
+            }
+        } else {
+            const NormalizedSC candidate_nsc = normalizeScancontext(descriptorAt(candidate_idx));
+            sc_dist_result = verifyShifts(curr_nsc, candidate_nsc);
+            if (reverse) {
+                const auto reversed_result = verifyShifts(curr_reversed_nsc, candidate_nsc);
+                reversed = reversed_result.first < sc_dist_result.first;
+                if (reversed) sc_dist_result = reversed_result;
+            }
+        }
+        if (sc_dist_result.first >= bound) {
+            _stats.early_exit_rejected++;
+            continue;
+        }
+
+        _stats.evaluated++;
         candidate_dists[candidate_iter_idx] = sc_dist_result.first;
-        candidate_yaws[candidate_iter_idx] = deg2rad(sc_dist_result.second * PC_UNIT_SECTORANGLE);
+        candidate_shifts[candidate_iter_idx] =
+            int(std::lround(sc_dist_result.second)) % PC_NUM_SECTOR;
+        candidate_reversed[candidate_iter_idx] = reversed;
+        if (polar) {
+            candidate_yaws[candidate_iter_idx] =
+                deg2rad(sc_dist_result.second * PC_UNIT_SECTORANGLE);
+        } else {
+            // the column shift of the cartesian context is a lateral offset, in the frame of the
+            // (turned around, if reversed) query
+            const double lateral_offset = signedShift(sc_dist_result.second, PC_NUM_SECTOR) * 2.0 *
+                                          CC_MAX_LATERAL / PC_NUM_SECTOR;
+            candidate_yaws[candidate_iter_idx] = reversed ? M_PI : 0.0;
+            candidate_translations[candidate_iter_idx] =
+                Vector2d(0.0, reversed ? -lateral_offset : lateral_offset);
+        }
+        const Eigen::Map<const MatrixXd> candidate_cartesian = cartesianAt(candidate_idx);
+        if (ESTIMATE_TRANSLATION && _cartesian.size() > 0 &&
+            candidate_cartesian.size() == _cartesian.size())
+            candidate_translations[candidate_iter_idx] = estimateTranslation(
+                _cartesian, candidate_cartesian, candidate_yaws[candidate_iter_idx]);
+        if (sc_dist_result.first < SC_DIST_THRES) matched.push_back(candidate_idx);
     }
-    auto query_id = polarcontexts_.size() - 1;
-    return {query_id, candidate_indexes, candidate_dists, candidate_yaws};
 
-}  // SCManager::detectLoopClosureID
+    return {candidate_indexes, candidate_dists,    candidate_yaws, candidate_translations,
+            candidate_shifts,  candidate_reversed, matched};
+}  // SCManager::searchCandidates
@@ -1,15 +1,20 @@
 #pragma once
 
 #include <Eigen/Core>
+#include <complex>
+#include <cstdint>
+#include <limits>
+#include <map>
 #include <memory>
+#include <string>
 #include <tuple>
 #include <vector>
 
 #include "KDTreeVectorOfVectorsAdaptor.h"
 #include "nanoflann.hpp"
 
-// using xyz only. but a user can exchange the original bin encoding function (i.e., max hegiht) to
-// max intensity (for detail, refer 20 ICRA Intensity Scan Context)
+// the bins hold the max height by default, see SCManager::BIN_ENCODER for the max intensity (20
+// ICRA Intensity Scan Context) and the other encodings
 using KeyMat = std::vector<std::vector<float>>;
 using InvKeyTree = KDTreeVectorOfVectorsAdaptor<KeyMat, float>;
 
@@ -20,27 +25,258 @@ float xy2theta(const float &_x, const float &_y);
 Eigen::MatrixXd circshift(Eigen::MatrixXd &_mat, int _num_shift);
 std::vector<float> eig2stdvec(Eigen::MatrixXd _eigmat);
 
+// columnwise unit-norm descriptor (for the cosine distance) and its non-empty sectors
+struct NormalizedSC {
+    Eigen::MatrixXd columns;
+    std::vector<bool> occupied;
+};
+NormalizedSC normalizeScancontext(const Eigen::Ref<const Eigen::MatrixXd> &_desc);
+
+// the same, for sparse scenes: a bitmask of the non-empty sectors (at most 64) and their unit-norm
+// columns only, packed in sector order. the distance intersects the masks before any float work
+struct SparseSC {
+    int num_cols = 0;
+    uint64_t occupied = 0;                // bit col_idx for a non-empty sector
+    Eigen::MatrixXd columns;              // rows x number of non-empty sectors
+    int packedIndex(int _col_idx) const;  // column of a non-empty sector in columns
+};
+SparseSC makeSparseScancontext(const Eigen::MatrixXd &_desc);
+
+// dft along the sector axis of a normalized descriptor, for the full rotation search. the inputs
+// are real, only the num_cols / 2 + 1 first frequencies are kept
+struct SCSpectrum {
+    std::vector<std::vector<std::complex<double>>> rings;
+    std::vector<std::complex<double>> occupied;
+    int num_cols = 0;
+};
+SCSpectrum makeSpectrum(const NormalizedSC &_nsc);
+
+// 2x2 max pooling of the polar grid (e.g., 20x60 -> 10x30), for the coarse-to-fine search
+Eigen::MatrixXd maxPoolScancontext(const Eigen::MatrixXd &_desc);
+
+// offset in [-0.5, 0.5] of the minimum of the parabola through (-1, _left), (0, _center) and
+// (1, _right), 0 if it has no minimum there (e.g., flat or not finite)
+double parabolicMinimumOffset(double _left, double _center, double _right);
+
+// a shift in [0, _num_cols) as a signed one in (-_num_cols / 2, _num_cols / 2], e.g., the lateral
+// shift of the cartesian context
+double signedShift(double _shift, int _num_cols);
+
+// a scan as rows of x, y, z and, optionally, intensity (e.g., a row-major numpy array)
+using PointMatrix = Eigen::Matrix<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>;
+using PointsRef = Eigen::Ref<const PointMatrix>;
+
+// unknown position of a scan, for the keyframe admission
+const Eigen::Vector3d NO_POSITION =
+    Eigen::Vector3d::Constant(std::numeric_limits<double>::quiet_NaN());
+
+struct PruningStats {
+    size_t evaluated = 0;            // candidates fully verified
+    size_t coarse_rejected = 0;      // ranked out on the coarsest pyramid level
+    size_t ringkey_rejected = 0;     // by the ring key distance from the tree
+    size_t sectorkey_rejected = 0;   // by the sector key alignment residual
+    size_t early_exit_rejected = 0;  // by the partial columnwise sums
+    size_t sequence_rejected = 0;    // by the distance over the windows of keyframes around them
+};
+
+// verified candidates of a query, with internal indexes (i.e., before mapping them to ids)
+struct CandidateSearch {
+    std::vector<size_t> indexes;                // sorted by ring key distance
+    std::vector<double> dists;                  // infinite if rejected
+    std::vector<double> yaws;                   // radian
+    std::vector<Eigen::Vector2d> translations;  // nan if not estimated
+    std::vector<int> shifts;                    // column shift of the best alignment
+    std::vector<bool> reversed;                 // matched to the turned-around query
+    std::vector<size_t> matched;                // the ones below SC_DIST_THRES
+};
+
+// a database in contiguous buffers owned elsewhere, e.g., a shared memory segment: the descriptors
+// (PC_NUM_RING x PC_NUM_SECTOR, column-major), ring keys, sector keys, cartesian grids (null if
+// none, CART_NUM_CELLS x CART_NUM_CELLS, column-major) and external ids of num_keyframes keyframes
+struct DatabaseBuffers {
+    double *descriptors = nullptr;
+    float *ringkeys = nullptr;
+    double *sectorkeys = nullptr;
+    double *cartesians = nullptr;
+    size_t *ids = nullptr;
+    size_t num_keyframes = 0;
+};
+
+// query id (-1 if none), candidate ids, sc distances and relative yaws
+using ClosureCandidates =
+    std::tuple<int, std::vector<size_t>, std::vector<double>, std::vector<double>>;
+
 class SCManager {
 public:
     SCManager() = default;  // reserving data space (of std::vector) could be considered. but the
                             // descriptor is lightweight so don't care.
 
-    Eigen::MatrixXd makeScancontext(const std::vector<Eigen::Vector3d> &_scan_down);
-    Eigen::MatrixXd makeRingkeyFromScancontext(Eigen::MatrixXd &_desc);
-    Eigen::MatrixXd makeSectorkeyFromScancontext(Eigen::MatrixXd &_desc);
+    enum class Downsampling { NONE, VOXEL, BIN_MAX };
+    enum class BinEncoder { MAX_HEIGHT, MAX_INTENSITY, POINT_COUNT, MEAN_HEIGHT };
+    enum class DescriptorType {
+        POLAR,     // rings x sectors, i.e., the original Scan Context
+        CARTESIAN  // Scan Context++ cartesian context: longitudinal x lateral bins
+    };
+    enum class RotationSearch {
+        VKEY_WINDOW,  // SEARCH_RATIO window around the sector key alignment
+        FULL_FFT      // every shift at once, as a correlation along the sector axis
+    };
 
-    int fastAlignUsingVkey(Eigen::MatrixXd &_vkey1, Eigen::MatrixXd &_vkey2);
+    // rows of _points kept by the roi cropping, the intensity threshold and the decimation. with
+    // BIN_MAX, _bins (if given) gets the (ring, sector) bin of each row, as ring * sectors + sector
+    std::vector<int> preprocessScan(const PointsRef &_points,
+                                    double _intensity_scale = 1.0,
+                                    std::vector<int> *_bins = nullptr) const;
+    // 1 / max intensity of _points if NORMALIZE_INTENSITY (and it has intensities), otherwise 1
+    double intensityScale(const PointsRef &_points) const;
+    bool pointToBin(const Eigen::Vector3d &_point, int &_ring_idx, int &_sctor_idx) const;
+    // also fills _cartesian (if given) with the cartesian grid of the same points, in one pass.
+    // _points is N x 3, or N x 4 with intensities
+    Eigen::MatrixXd makeScancontext(const PointsRef &_points,
+                                    Eigen::MatrixXd *_cartesian = nullptr) const;
+    Eigen::MatrixXd makeScancontext(const std::vector<Eigen::Vector3d> &_scan_down,
+                                    Eigen::MatrixXd *_cartesian = nullptr) const;
+    // the descriptors given (not null) in a single pass over the points: the polar descriptor, the
+    // cartesian context (both with the BIN_ENCODER) and the cartesian grid of the max heights
+    void encodeScan(const PointsRef &_points,
+                    Eigen::MatrixXd *_polar,
+                    Eigen::MatrixXd *_cartesian_context,
+                    Eigen::MatrixXd *_cartesian = nullptr) const;
+    bool pointToCartesianBin(const Eigen::Vector3d &_point, int &_row_idx, int &_col_idx) const;
+    Eigen::MatrixXd makeRingkeyFromScancontext(Eigen::MatrixXd &_desc) const;
+    Eigen::MatrixXd makeSectorkeyFromScancontext(Eigen::MatrixXd &_desc) const;
+
+    int fastAlignUsingVkey(const Eigen::Ref<const Eigen::MatrixXd> &_vkey1,
+                           const Eigen::Ref<const Eigen::MatrixXd> &_vkey2,
+                           double *_min_diff_norm = nullptr) const;
     double distDirectSC(Eigen::MatrixXd &_sc1,
                         Eigen::MatrixXd &_sc2);  // "d" (eq 5) in the original paper (IROS 18)
     std::pair<double, int> distanceBtnScanContext(
         Eigen::MatrixXd &_sc1,
         Eigen::MatrixXd &_sc2);  // "D" (eq 6) in the original paper (IROS 18)
 
+    // cosine distance with _nsc2 circshifted by _num_shift. stops as soon as the distance can not
+    // get below _bound, returning a lower bound (>= _bound) instead of the exact distance.
+    double distAtShift(const NormalizedSC &_nsc1,
+                       const NormalizedSC &_nsc2,
+                       int _num_shift,
+                       double _bound = std::numeric_limits<double>::infinity()) const;
+    double distAtShift(const SparseSC &_ssc1,
+                       const SparseSC &_ssc2,
+                       int _num_shift,
+                       double _bound = std::numeric_limits<double>::infinity()) const;
+    std::vector<int> shiftSearchSpace(int _argmin_vkey_shift) const;
+    template <typename Descriptor>  // NormalizedSC or SparseSC, same results
+    std::pair<double, int> searchShifts(
+        const Descriptor &_desc1,
+        const Descriptor &_desc2,
+        const std::vector<int> &_shifts,
+        double _bound = std::numeric_limits<double>::infinity()) const;
+    std::pair<double, int> searchAllShifts(const SCSpectrum &_spec1,
+                                           const SCSpectrum &_spec2) const;
+
+    // coarse-to-fine search, the pyramid goes from the finest pooled level to the coarsest one
+    std::vector<NormalizedSC> makePyramid(const Eigen::Ref<const Eigen::MatrixXd> &_sc) const;
+    void rankOnPyramid(const std::vector<NormalizedSC> &_query_pyramid,
+                       std::vector<size_t> &_candidate_indexes,
+                       std::vector<float> &_ringkey_dists_sqr,
+                       std::vector<int> &_coarse_shifts,
+                       PruningStats &_stats) const;
+    std::vector<int> refineShiftSearchSpace(const std::vector<NormalizedSC> &_pyramid1,
+                                            const std::vector<NormalizedSC> &_pyramid2,
+                                            int _coarse_shift) const;
+
+    // initial guess of a closure, i.e., p1 = R(yaw) * p2 + t for the points of the scans 1 and 2
+    template <typename Descriptor>
+    double refineShift(const Descriptor &_desc1,
+                       const Descriptor &_desc2,
+                       int _num_shift,
+                       double _sc_dist) const;  // fractional shift (sectors)
+    Eigen::Vector2d estimateTranslation(const Eigen::Ref<const Eigen::MatrixXd> &_cart1,
+                                        const Eigen::Ref<const Eigen::MatrixXd> &_cart2,
+                                        double _yaw) const;  // meter
+
     // User-side API
-    void makeAndSaveScancontextAndKeys(const std::vector<Eigen::Vector3d> &_scan_down);
-    std::tuple<int, std::vector<size_t>, std::vector<double>, std::vector<double>>
-    detectLoopClosureID();  // int: query node index, int: nearest node index, float: sc distance,
-                            // float: relative yaw
+    // every offered scan gets the next external id, whether it is admitted as a keyframe or not.
+    // the ids returned by detectLoopClosureID() stay valid after other entries are evicted.
+    // an empty _cartesian grid (e.g., ESTIMATE_TRANSLATION was off when encoding) means no
+    // translation estimate for this keyframe
+    bool makeAndSaveScancontextAndKeys(const PointsRef &_points,
+                                       const Eigen::Vector3d &_position = NO_POSITION);
+    bool makeAndSaveScancontextAndKeys(const std::vector<Eigen::Vector3d> &_scan_down,
+                                       const Eigen::Vector3d &_position = NO_POSITION);
+    bool saveScancontextAndKeys(const Eigen::MatrixXd &_sc,
+                                const Eigen::Vector3d &_position = NO_POSITION,
+                                const Eigen::MatrixXd &_cartesian = Eigen::MatrixXd());
+    // i.e., a saved keyframe (e.g., from a checkpoint), bypasses the admission
+    void restoreScancontextAndKeys(const Eigen::MatrixXd &_sc,
+                                   size_t _id,
+                                   size_t _last_matched,
+                                   const Eigen::MatrixXd &_cartesian = Eigen::MatrixXd());
+    void appendKeyframe(const Eigen::MatrixXd &_sc,
+                        size_t _id,
+                        const Eigen::Vector3d &_position,
+                        const Eigen::MatrixXd &_cartesian);
+    // inserts a scan and queries it if it is admitted, for a whole sequence without leaving c++:
+    // the candidates closer than _score_thres are appended to _scores as (query id, candidate id,
+    // distance) rows, and the ones closer than _closure_thres to _closures as (candidate id, query
+    // id, row-major 4x4 initial guess) rows
+    void processScan(const PointsRef &_points,
+                     double _score_thres,
+                     double _closure_thres,
+                     std::vector<double> &_scores,
+                     std::vector<double> &_closures);
+    ClosureCandidates detectLoopClosureID();  // of the latest keyframe, see also
+                                              // candidate_translations_
+    // each stored keyframe of _query_ids against the ones at least NUM_EXCLUDE_RECENT older, e.g.,
+    // a batch of queries from several clients sharing one tree. -1 for an unknown id.
+    std::vector<ClosureCandidates> detectLoopClosureIDs(const std::vector<size_t> &_query_ids);
+    ClosureCandidates detectForKeyframe(size_t _query_idx);
+    // mean distance between the SEQUENCE_WINDOW keyframes before the query and the ones as many
+    // scans before (or after, for a revisit in the opposite direction) the candidate, around the
+    // shift of their match
+    double sequenceDistance(size_t _query_idx,
+                            size_t _candidate_idx,
+                            int _shift,
+                            bool _reversed) const;
+    // read-only (i.e., thread-safe) search of a descriptor among all the keyframes in the tree, for
+    // a database that is not updated anymore (e.g., a reference session). call rebuildTree() with
+    // all the keyframes first.
+    CandidateSearch searchDatabase(const Eigen::MatrixXd &_sc,
+                                   const Eigen::MatrixXd &_cartesian,
+                                   PruningStats &_stats) const;
+    // candidates among the first _num_searchable keyframes for a descriptor and its keys, shared by
+    // the queries above. does not modify the database.
+    CandidateSearch searchCandidates(const Eigen::MatrixXd &_desc,
+                                     const std::vector<float> &_ringkey,
+                                     const Eigen::MatrixXd &_sectorkey,
+                                     const std::vector<NormalizedSC> &_pyramid,
+                                     const Eigen::MatrixXd &_cartesian,
+                                     size_t _num_searchable,
+                                     PruningStats &_stats) const;
+    // read-only database over the buffers of another manager (see exportDatabase), e.g., in another
+    // process: the descriptors are read in place, only the ring keys are copied (into the tree).
+    // nothing can be added afterwards. the sparse descriptors are not used, the pyramids are built
+    // on the fly
+    void attachDatabase(const DatabaseBuffers &_buffers);
+    // all the keyframes into buffers sized for them, cartesians only if _buffers.cartesians is set
+    void exportDatabase(const DatabaseBuffers &_buffers) const;
+    // keyframe _idx, stored or attached
+    Eigen::Map<const Eigen::MatrixXd> descriptorAt(size_t _idx) const;
+    Eigen::Map<const Eigen::MatrixXd> sectorkeyAt(size_t _idx) const;
+    Eigen::Map<const Eigen::MatrixXd> cartesianAt(size_t _idx) const;  // 0x0 if none
+    // stored, or built into _storage for an attached keyframe
+    const std::vector<NormalizedSC> &pyramidAt(size_t _idx,
+                                               std::vector<NormalizedSC> &_storage) const;
+    const SCSpectrum &spectrumAt(size_t _idx, SCSpectrum &_storage) const;
+    void updateTree(size_t _num_queries);  // rebuilt every TREE_MAKING_PERIOD_ queries
+    void rebuildTree(size_t _num_keys);    // tree over the first _num_keys ring keys
+
+    // keyframe admission and memory budget
+    bool isKeyframe(const Eigen::MatrixXd &_sc, const Eigen::Vector3d &_position) const;
+    int indexOf(size_t _id) const;  // -1 if _id was skipped or evicted
+    void evictOne();
+    std::map<std::string, size_t> memoryUsage() const;  // bytes per structure
 
 public:
     // hyper parameters ()
@@ -58,18 +294,72 @@ public:
     // tree
     const int NUM_EXCLUDE_RECENT =
         50;  // simply just keyframe gap, but node position distance-based exclusion is ok.
-    const int NUM_CANDIDATES_FROM_TREE = 10;  // 10 is enough. (refer the IROS 18 paper)
+    int NUM_CANDIDATES_FROM_TREE = 10;  // 10 is enough. (refer the IROS 18 paper)
 
     // loop thres
     const double SEARCH_RATIO =
         0.1;  // for fast comparison, no Brute-force, but search 10 % is okay. // not was in the
               // original conf paper, but improved ver.
-    const double SC_DIST_THRES = 0.13;  // empirically 0.1-0.2 is fine (rare false-alarms) for 20x60
-                                        // polar context (but for 0.15 <, DCS or ICP fit score check
-                                        // (e.g., in LeGO-LOAM) should be required for robustness)
+    double SC_DIST_THRES = 0.13;  // empirically 0.1-0.2 is fine (rare false-alarms) for 20x60
+                                  // polar context (but for 0.15 <, DCS or ICP fit score check
+                                  // (e.g., in LeGO-LOAM) should be required for robustness)
     // const double SC_DIST_THRES = 0.5; // 0.4-0.6 is good choice for using with robust kernel
     // (e.g., Cauchy, DCS) + icp fitness threshold / if not, recommend 0.1-0.15
 
+    // candidate pruning cascade (cheapest first), all disabled by default. rejected candidates are
+    // reported with an infinite distance.
+    double RINGKEY_DIST_THRES =
+        std::numeric_limits<double>::infinity();  // l2 distance between ring keys
+    double SECTORKEY_RESIDUAL_THRES =
+        std::numeric_limits<double>::infinity();  // rms of the aligned sector keys difference
+    // stop verifying a candidate as soon as it can not get below SC_DIST_THRES. the candidates
+    // above it are then reported with an infinite distance, i.e., not for precision-recall curves
+    // over thresholds above SC_DIST_THRES
+    bool PRUNE_CANDIDATES = false;
+    // of the queries on the stored keyframes (detectLoopClosureID(s)), not synchronized: like the
+    // keyframes, not to be updated by concurrent queries (searchDatabase() takes its own stats)
+    PruningStats pruning_stats_;
+
+    // the spectra of the polar keyframes are stored at insert time with FULL_FFT (computed per
+    // candidate otherwise, e.g., if it is only set after inserting)
+    RotationSearch ROTATION_SEARCH = RotationSearch::VKEY_WINDOW;
+
+    // coarse-to-fine candidate search, disabled by default (0 levels). each level max-pools the
+    // previous one by 2 (e.g., 10x30 and 5x15), stored at insert time so set it before inserting.
+    // NUM_CANDIDATES_COARSE candidates from the tree are ranked with every shift on the coarsest
+    // level, and the NUM_CANDIDATES_FROM_TREE best are verified around their coarse shift (i.e.,
+    // instead of the ROTATION_SEARCH).
+    int PYRAMID_LEVELS = 0;
+    int NUM_CANDIDATES_COARSE = 50;
+
+    // initial guesses for the registration of the closures, disabled by default. SUBSECTOR_YAW
+    // refines the yaw below the sector resolution with a parabola through the distances at the best
+    // shift and its two neighbours. ESTIMATE_TRANSLATION also bins the inserted scans into a
+    // cartesian max height grid (CART_NUM_CELLS x CART_NUM_CELLS cells of CART_CELL_SIZE meter,
+    // stored at insert time so set it before inserting), and searches the shift of the yaw-rotated
+    // candidate grid that best overlaps the query one within TRANSLATION_SEARCH_RADIUS cells, i.e.,
+    // the lateral search of Scan Context++ (T-RO 21) along both axes.
+    bool SUBSECTOR_YAW = false;
+    bool ESTIMATE_TRANSLATION = false;
+    int CART_NUM_CELLS = 40;
+    double CART_CELL_SIZE = 2.0;
+    int TRANSLATION_SEARCH_RADIUS = 5;
+    std::vector<Eigen::Vector2d> candidate_translations_;  // of the last query, nan if unknown
+
+    // keyframe admission, disabled by default. a scan is skipped when its descriptor is nearly
+    // identical to the previous keyframe's, or when it is closer than KEYFRAME_MIN_DISTANCE to it
+    // (only if both positions are given, e.g., from the odometry)
+    double KEYFRAME_SC_DIST_THRES = 0.0;  // cosine distance without shift
+    double KEYFRAME_MIN_DISTANCE = 0.0;   // meter
+
+    // memory budget (0: unlimited). once exceeded, keyframes are evicted, the ones closer than
+    // EVICTION_RINGKEY_DIST to their successor (i.e., spatially redundant) first, then the least
+    // recently matched, down to EVICTION_LOW_WATER of the budget (i.e., in batches, as each batch
+    // invalidates the tree). the NUM_EXCLUDE_RECENT latest keyframes are never evicted.
+    size_t MAX_MEMORY_BYTES = 0;
+    double EVICTION_RINGKEY_DIST = 0.05;
+    double EVICTION_LOW_WATER = 0.9;  // fraction of MAX_MEMORY_BYTES
+
     // config
     const int TREE_MAKING_PERIOD_ =
         50;  // i.e., remaking tree frequency, to avoid non-mandatory every remaking, to save time
@@ -77,11 +367,68 @@ public:
              // enough fast ~ 5-50ms wrt N.).
     int tree_making_period_conter = 0;
 
+    // preprocessing before binning (i.e., roi cropping and decimation), disabled by default
+    double PC_MIN_RADIUS = 0.0;  // e.g., to drop the points on the ego vehicle
+    double PC_MIN_HEIGHT = -std::numeric_limits<double>::infinity();  // z in the lidar coord
+    double PC_MAX_HEIGHT = std::numeric_limits<double>::infinity();
+    Downsampling DOWNSAMPLING =
+        Downsampling::NONE;  // VOXEL: keeps the highest point of each voxel, which only
+                             // approximates the max height of each bin (the kept point can fall in
+                             // another bin, so the points setting a bin maximum can be dropped) /
+                             // BIN_MAX: keeps the highest point of each (ring, sector) bin, i.e.,
+                             // the descriptor is exactly preserved
+    double VOXEL_SIZE = 0.5;
+    // intensity (4th column of the points, if any), checked along with the roi. the threshold is
+    // relative to the max intensity of each scan if NORMALIZE_INTENSITY
+    double MIN_INTENSITY = -std::numeric_limits<double>::infinity();
+    bool NORMALIZE_INTENSITY = false;
+
+    // bin encoding: MAX_HEIGHT (original) / MAX_INTENSITY (needs intensities, normalized as above)
+    // / POINT_COUNT / MEAN_HEIGHT. the cartesian grid always holds the max height
+    BinEncoder BIN_ENCODER = BinEncoder::MAX_HEIGHT;
+
+    // descriptor of the keyframes and of the queries. the rows of the CARTESIAN one are
+    // longitudinal bins (the ring key is then invariant to lateral shifts, e.g., another lane) and
+    // its columns lateral bins, searched without wrapping around within SEARCH_RATIO. the polar one
+    // is invariant to the heading already, AUGMENT_REVERSE also queries the cartesian context of
+    // the query turned around (reverse revisits). FULL_FFT and the pyramid are polar only, the
+    // CARTESIAN one ignores them.
+    DescriptorType DESCRIPTOR = DescriptorType::POLAR;
+    double CC_MAX_LATERAL = 40.0;  // meter, the longitudinal range is PC_MAX_RADIUS
+    bool AUGMENT_REVERSE = false;
+
+    // keep the sparse form (SparseSC) of every keyframe along with the dense descriptor, so the
+    // verification neither renormalizes the candidates nor visits their empty sectors (same
+    // results). not used by the FULL_FFT rotation search. set it before adding keyframes
+    bool SPARSE_DESCRIPTORS = false;
+
+    // temporal consistency of the candidates of a stored keyframe (0: disabled): a candidate
+    // verified on its own is rejected (i.e., reported with an infinite distance) when its
+    // sequenceDistance() over SEQUENCE_WINDOW keyframes exceeds SEQUENCE_DIST_THRES. cheaper than
+    // a registration, and spares it most of the false positives. not applied to searchDatabase()
+    int SEQUENCE_WINDOW = 0;
+    double SEQUENCE_DIST_THRES = 0.4;
+    const int SEQUENCE_SHIFT_RADIUS = 1;  // sectors around the shift of the centre match
+    // largest difference between the ids of a window and the ones of a sequence of consecutive
+    // scans, see sequenceDistance()
+    const size_t SEQUENCE_ID_TOLERANCE = 2;
+
     // data
     std::vector<double> polarcontexts_timestamp_;  // optional.
     std::vector<Eigen::MatrixXd> polarcontexts_;
     std::vector<Eigen::MatrixXd> polarcontext_invkeys_;
     std::vector<Eigen::MatrixXd> polarcontext_vkeys_;
+    std::vector<std::vector<NormalizedSC>> polarcontext_pyramids_;  // empty if PYRAMID_LEVELS is 0
+    std::vector<SCSpectrum> polarcontext_spectra_;          // empty unless a polar FULL_FFT search
+    std::vector<Eigen::MatrixXd> polarcontext_cartesians_;  // 0x0 if not ESTIMATE_TRANSLATION
+    std::vector<SparseSC> polarcontext_sparse_;             // empty if not SPARSE_DESCRIPTORS
+
+    std::vector<size_t> polarcontext_ids_;           // external id of each keyframe, increasing
+    std::vector<size_t> polarcontext_last_matched_;  // num_scans_seen_ at the last match
+    std::vector<Eigen::Vector3d> polarcontext_positions_;
+    size_t num_scans_seen_ = 0;  // i.e., the next external id
+
+    DatabaseBuffers attached_;  // num_keyframes is 0 unless attachDatabase()
 
     KeyMat polarcontext_invkeys_mat_;
     KeyMat polarcontext_invkeys_to_search_;
@@ -20,25 +20,376 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import Tuple
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 
 from . import scan_context_pybind
 
 
+def relative_transforms(yaws: np.ndarray, translations: Optional[np.ndarray] = None) -> np.ndarray:
+    """Stack of SE(3) transforms (N x 4 x 4) from N yaws (radians) and N x 2 translations."""
+    yaws = np.asarray(yaws, dtype=np.float64).reshape(-1)
+    transforms = np.tile(np.eye(4), (len(yaws), 1, 1))
+    cos_yaws, sin_yaws = np.cos(yaws), np.sin(yaws)
+    transforms[:, 0, 0] = cos_yaws
+    transforms[:, 0, 1] = -sin_yaws
+    transforms[:, 1, 0] = sin_yaws
+    transforms[:, 1, 1] = cos_yaws
+    if translations is not None:
+        transforms[:, :2, 3] = np.nan_to_num(np.asarray(translations).reshape(-1, 2))
+    return transforms
+
+
 class ScanContext:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        min_range: float = 0.0,
+        min_height: float = -np.inf,
+        max_height: float = np.inf,
+        downsampling: str = "none",
+        voxel_size: float = 0.5,
+        num_candidates: int = 10,
+        sc_dist_threshold: float = 0.13,
+        ringkey_dist_threshold: float = np.inf,
+        sectorkey_residual_threshold: float = np.inf,
+        prune_candidates: bool = False,
+        rotation_search: str = "vkey_window",
+        pyramid_levels: int = 0,
+        num_coarse_candidates: int = 50,
+        keyframe_sc_dist_threshold: float = 0.0,
+        keyframe_min_distance: float = 0.0,
+        max_memory_bytes: int = 0,
+        eviction_ringkey_dist: float = 0.05,
+        eviction_low_water: float = 0.9,
+        subsector_yaw: bool = False,
+        estimate_translation: bool = False,
+        translation_cell_size: float = 2.0,
+        translation_search_radius: int = 5,
+        bin_encoder: str = "max_height",
+        min_intensity: float = -np.inf,
+        normalize_intensity: bool = False,
+        sparse_descriptors: bool = False,
+        descriptor: str = "polar",
+        lateral_range: float = 40.0,
+        augment_reverse: bool = False,
+        sequence_window: int = 0,
+        sequence_dist_threshold: float = 0.4,
+    ) -> None:
         self._pipeline = scan_context_pybind._SCManager()
+        # Optional cropping and decimation, done natively before binning the points
+        self._pipeline._PC_MIN_RADIUS = min_range
+        self._pipeline._PC_MIN_HEIGHT = min_height
+        self._pipeline._PC_MAX_HEIGHT = max_height
+        downsampling = getattr(scan_context_pybind._Downsampling, downsampling.upper())
+        self._pipeline._DOWNSAMPLING = downsampling
+        self._pipeline._VOXEL_SIZE = voxel_size
+        # N x 4 scans: intensity threshold, relative to the max intensity of each scan if normalized
+        self._pipeline._MIN_INTENSITY = min_intensity
+        self._pipeline._NORMALIZE_INTENSITY = normalize_intensity
+        # "max_height", "max_intensity" (needs N x 4 scans), "point_count" or "mean_height"
+        bin_encoder = getattr(scan_context_pybind._BinEncoder, bin_encoder.upper())
+        self._pipeline._BIN_ENCODER = bin_encoder
+        # Scan Context++: "polar" (rings x sectors) or "cartesian" (longitudinal x lateral bins, up
+        # to lateral_range meters). The latter finds lane-shifted revisits and reports their lateral
+        # offset in initial_guesses(), augment_reverse also matches it to the turned around query
+        descriptor = getattr(scan_context_pybind._DescriptorType, descriptor.upper())
+        self._pipeline._DESCRIPTOR = descriptor
+        self._pipeline._CC_MAX_LATERAL = lateral_range
+        self._pipeline._AUGMENT_REVERSE = augment_reverse
+        # Candidate verification, rejected candidates are reported with an infinite distance
+        self._pipeline._NUM_CANDIDATES_FROM_TREE = num_candidates
+        self._pipeline._SC_DIST_THRES = sc_dist_threshold
+        self._pipeline._RINGKEY_DIST_THRES = ringkey_dist_threshold
+        self._pipeline._SECTORKEY_RESIDUAL_THRES = sectorkey_residual_threshold
+        # prune_candidates stops verifying a candidate once it can not get below sc_dist_threshold,
+        # its distance is then infinite too (i.e., not for precision-recall curves above it)
+        self._pipeline._PRUNE_CANDIDATES = prune_candidates
+        # "vkey_window" searches around the sector key alignment, "full_fft" searches every shift
+        rotation_search = getattr(scan_context_pybind._RotationSearch, rotation_search.upper())
+        self._pipeline._ROTATION_SEARCH = rotation_search
+        # Coarse-to-fine search: num_coarse_candidates are ranked on max-pooled descriptors and the
+        # num_candidates best are verified around the coarse rotation (replaces rotation_search)
+        self._pipeline._PYRAMID_LEVELS = pyramid_levels
+        self._pipeline._NUM_CANDIDATES_COARSE = num_coarse_candidates
+        # Keep a bitmask of the non-empty sectors and their packed columns for every keyframe, the
+        # verification then skips the empty sectors of sparse scenes (same results, more memory)
+        self._pipeline._SPARSE_DESCRIPTORS = sparse_descriptors
+        # Temporal consistency of the closures of check_for_closure(s): a candidate is rejected when
+        # the sequence_window keyframes around it do not match the ones before the query
+        self._pipeline._SEQUENCE_WINDOW = sequence_window
+        self._pipeline._SEQUENCE_DIST_THRES = sequence_dist_threshold
+        # Keyframe admission and memory budget, the returned ids stay valid after an eviction. Once
+        # over budget, keyframes are evicted down to eviction_low_water of it at once
+        self._pipeline._KEYFRAME_SC_DIST_THRES = keyframe_sc_dist_threshold
+        self._pipeline._KEYFRAME_MIN_DISTANCE = keyframe_min_distance
+        self._pipeline._MAX_MEMORY_BYTES = max_memory_bytes
+        self._pipeline._EVICTION_RINGKEY_DIST = eviction_ringkey_dist
+        self._pipeline._EVICTION_LOW_WATER = eviction_low_water
+        # Initial guesses for the registration: yaw below the sector resolution and a translation
+        # from the overlap of cartesian grids (search radius in cells), see initial_guesses()
+        self._pipeline._SUBSECTOR_YAW = subsector_yaw
+        self._pipeline._ESTIMATE_TRANSLATION = estimate_translation
+        self._pipeline._CART_CELL_SIZE = translation_cell_size
+        self._pipeline._TRANSLATION_SEARCH_RADIUS = translation_search_radius
+        self._candidate_yaws = np.zeros(0)
+        # Worker thread of submit(), started on first use
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def process_new_scan(self, scan: np.ndarray, position: Optional[np.ndarray] = None) -> bool:
+        """Returns False when the scan is not admitted as a keyframe, its id is still consumed.
+
+        The scan is N x 3, or N x 4 with intensities (read in place if C-contiguous float64).
+        """
+        scan = self._as_points(scan)
+        if position is None:
+            return self._pipeline._makeAndSaveScancontextAndKeys(scan)
+        return self._pipeline._makeAndSaveScancontextAndKeys(scan, np.asarray(position, float))
+
+    def make_scan_context(self, scan: np.ndarray) -> np.ndarray:
+        """Encode a scan without adding it to the database, safe to call from another thread."""
+        scan = self._as_points(scan)
+        return np.asarray(self._pipeline._makeScancontext(scan))
 
-    def process_new_scan(self, scan: np.ndarray) -> None:
-        scan = scan_context_pybind._VectorEigen3d(scan)
-        self._pipeline._makeAndSaveScancontextAndKeys(scan)
+    def make_scan_context_and_cartesian(
+        self, scan: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Same as make_scan_context, with the cartesian grid when estimate_translation is set."""
+        scan = self._as_points(scan)
+        scan_context, cartesian = self._pipeline._makeScancontextAndCartesian(scan)
+        if not self._pipeline._ESTIMATE_TRANSLATION:
+            return np.asarray(scan_context), None
+        return np.asarray(scan_context), np.asarray(cartesian)
+
+    def make_descriptors(self, scan: np.ndarray) -> Dict[str, np.ndarray]:
+        """The polar descriptor, the cartesian context and the cartesian grid, in one pass."""
+        scan = self._as_points(scan)
+        polar, cartesian_context, cartesian = self._pipeline._encodeScan(scan)
+        return {
+            "polar": np.asarray(polar),
+            "cartesian_context": np.asarray(cartesian_context),
+            "cartesian": np.asarray(cartesian),
+        }
+
+    def preprocess_scan(self, scan: np.ndarray) -> np.ndarray:
+        """The points (and intensities) of a scan that are binned, after cropping and decimation."""
+        scan = self._as_points(scan)
+        return scan[np.asarray(self._pipeline._preprocessScan(scan), int)]
+
+    @staticmethod
+    def _as_points(scan: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(scan, dtype=np.float64)
 
     def check_for_closure(self) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
-        query_node_idx, candidate_ids, candidate_dists, candidate_yaws = self._pipeline._detectLoopClosureID()
-        return query_node_idx, np.asarray(candidate_ids, int), np.asarray(candidate_dists), np.asarray(candidate_yaws)
+        (
+            query_node_idx,
+            candidate_ids,
+            candidate_dists,
+            candidate_yaws,
+        ) = self._pipeline._detectLoopClosureID()
+        self._candidate_yaws = np.asarray(candidate_yaws)
+        return (
+            query_node_idx,
+            np.asarray(candidate_ids, int),
+            np.asarray(candidate_dists),
+            np.asarray(candidate_yaws),
+        )
+
+    def check_for_closures(
+        self, query_ids: Sequence[int]
+    ) -> List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+        """Same as check_for_closure for each stored keyframe in query_ids, in one native pass.
+
+        A keyframe is only matched with the ones at least 50 keyframes older, the query id of an
+        unknown keyframe (or one without old enough keyframes) is -1.
+        """
+        results = self._pipeline._detectLoopClosureIDs([int(id) for id in query_ids])
+        return [
+            (query_id, np.asarray(ids, int), np.asarray(dists), np.asarray(yaws))
+            for query_id, ids, dists, yaws in results
+        ]
+
+    def run_sequence(
+        self,
+        scans,
+        offsets: Optional[np.ndarray] = None,
+        closure_threshold: float = 0.4,
+        score_threshold: float = np.inf,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Insert and query a whole sequence natively, as process_new_scan and check_for_closure.
+
+        scans is an iterable of N x 3 (or N x 4) scans, or all of them stacked in one array with the
+        first row of each scan (followed by the total number of rows) in offsets. Returns the
+        scores, a (query id, candidate id, distance) row per candidate closer than
+        score_threshold, and the closures, a (candidate id, query id, flattened 4 x 4 initial
+        guess) row per candidate closer than closure_threshold.
+        """
+        if offsets is not None:
+            return self._pipeline._runPackedSequence(
+                self._as_points(scans),
+                np.asarray(offsets, np.int64),
+                score_threshold,
+                closure_threshold,
+            )
+        _, scores, closures = self._pipeline._runSequence(
+            iter(scans), score_threshold, closure_threshold
+        )
+        return scores, closures
+
+    def iter_sequence(
+        self,
+        scans: Iterable[np.ndarray],
+        chunk_size: int = 64,
+        closure_threshold: float = 0.4,
+        score_threshold: float = np.inf,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Same as run_sequence, yielding the scores and closures of every chunk_size scans."""
+        scans = iter(scans)
+        while True:
+            num_frames, scores, closures = self._pipeline._runSequence(
+                scans, score_threshold, closure_threshold, chunk_size
+            )
+            if num_frames > 0:
+                yield scores, closures
+            if num_frames < chunk_size:
+                return
+
+    def build_database(self) -> None:
+        """Index all the stored keyframes for query_database(), once no more are added."""
+        self._pipeline._buildDatabase()
+
+    def query_database(
+        self, scan_context: np.ndarray, cartesian: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Candidate ids, distances, yaws and SE(3) initial guesses of an external descriptor.
+
+        Every keyframe indexed by build_database() is a candidate, none of them is modified, so
+        several threads can query the same database at once (as long as nothing is added to it).
+        """
+        cartesian = np.zeros((0, 0)) if cartesian is None else cartesian
+        ids, dists, yaws, translations = self._pipeline._searchDatabase(scan_context, cartesian)
+        yaws = np.asarray(yaws)
+        initial_guesses = relative_transforms(yaws, translations)
+        return np.asarray(ids, int), np.asarray(dists), yaws, initial_guesses
+
+    def initial_guesses(self) -> np.ndarray:
+        """SE(3) guesses (N x 4 x 4) of the candidates of the last check_for_closure().
+
+        Each one maps the candidate scan into the query frame. The translation is zero unless
+        estimate_translation was set when both scans were added.
+        """
+        translations = self._pipeline._getCandidateTranslations()
+        return relative_transforms(self._candidate_yaws, translations)
 
-    def get_scan_context(self, idx: int) -> np.ndarray:
-        scan_context = self._pipeline._getScanContext(idx)
+    def distance(
+        self, scan_context_1: np.ndarray, scan_context_2: np.ndarray
+    ) -> Tuple[float, float]:
+        """Scan Context distance and relative yaw (in radians) between two descriptors."""
+        dist, num_shift = self._pipeline._distanceBtnScanContext(scan_context_1, scan_context_2)
+        return dist, np.deg2rad(num_shift * 360.0 / scan_context_1.shape[1])
+
+    def get_pruning_stats(self) -> Dict[str, int]:
+        """Counters of check_for_closure(s), not synchronized across concurrent callers."""
+        return self._pipeline._getPruningStats()
+
+    def get_scan_context(self, id: int) -> np.ndarray:
+        scan_context = self._pipeline._getScanContext(id)
         return np.asarray(scan_context)
+
+    def get_cartesian(self, id: int) -> Optional[np.ndarray]:
+        cartesian = np.asarray(self._pipeline._getCartesian(id))
+        return cartesian if cartesian.size else None
+
+    def add_scan_context(
+        self,
+        scan_context: np.ndarray,
+        position: Optional[np.ndarray] = None,
+        cartesian: Optional[np.ndarray] = None,
+    ) -> bool:
+        scan_context = np.asarray(scan_context, dtype=np.float64)
+        position = np.full(3, np.nan) if position is None else np.asarray(position, float)
+        if cartesian is None:
+            return self._pipeline._saveScancontextAndKeys(scan_context, position)
+        cartesian = np.asarray(cartesian, dtype=np.float64)
+        return self._pipeline._saveScancontextAndKeys(scan_context, position, cartesian)
+
+    def restore_scan_context(
+        self,
+        scan_context: np.ndarray,
+        id: int,
+        last_matched: int,
+        cartesian: Optional[np.ndarray] = None,
+    ) -> None:
+        scan_context = np.asarray(scan_context, dtype=np.float64)
+        if cartesian is None:
+            self._pipeline._restoreScancontextAndKeys(scan_context, id, last_matched)
+        else:
+            cartesian = np.asarray(cartesian, dtype=np.float64)
+            self._pipeline._restoreScancontextAndKeys(scan_context, id, last_matched, cartesian)
+
+    def get_ids(self) -> np.ndarray:
+        """External ids of the stored keyframes, in increasing order."""
+        return np.asarray(self._pipeline._getIds(), dtype=int)
+
+    def get_last_matched(self) -> np.ndarray:
+        """Number of scans seen when each stored keyframe was last matched (or inserted)."""
+        return np.asarray(self._pipeline._getLastMatched(), dtype=int)
+
+    def memory_usage(self) -> Dict[str, int]:
+        return self._pipeline._memoryUsage()
+
+    def get_state(self) -> Tuple[int, int, int]:
+        return self._pipeline._getState()
+
+    def restore_state(self, counter: int, num_keys: int, num_scans_seen: int) -> None:
+        self._pipeline._restoreState(counter, num_keys, num_scans_seen)
+
+    def submit(self, method: Callable, *args, **kwargs) -> Future:
+        """Run a ScanContext method on a worker thread, in submission order.
+
+        The native calls release the GIL, so the caller (e.g., an event loop) is not blocked while
+        the descriptors are computed. Do not call the blocking methods from another thread while
+        submitted calls are pending.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ScanContext")
+        return self._executor.submit(method, *args, **kwargs)
+
+    def _process_and_get_id(
+        self, scan: np.ndarray, position: Optional[np.ndarray] = None
+    ) -> Optional[int]:
+        admitted = self.process_new_scan(scan, position)
+        # Every offered scan consumes the next id
+        return self.get_state()[2] - 1 if admitted else None
+
+    async def aprocess(
+        self, scan: np.ndarray, position: Optional[np.ndarray] = None
+    ) -> Optional[int]:
+        """process_new_scan on the worker thread, returns the id of the keyframe or None."""
+        return await asyncio.wrap_future(self.submit(self._process_and_get_id, scan, position))
+
+    async def aquery(self, query_ids: Optional[Sequence[int]] = None):
+        """check_for_closure, or check_for_closures(query_ids), after the scans submitted so far.
+
+        check_for_closure queries the latest keyframe, which another producer sharing the database
+        may have inserted in the meantime. Use aquery([id]) with the id returned by aprocess to
+        get the closures of that keyframe.
+        """
+        if query_ids is None:
+            return await asyncio.wrap_future(self.submit(self.check_for_closure))
+        return await asyncio.wrap_future(self.submit(self.check_for_closures, query_ids))
+
+    def close(self) -> None:
+        """Wait for the submitted calls and stop the worker thread."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __len__(self) -> int:
+        return self._pipeline._getNumScans()
@@ -27,8 +27,13 @@
 #include <pybind11/stl_bind.h>
 
 #include <Eigen/Core>
+#include <algorithm>
+#include <limits>
 #include <memory>
+#include <stdexcept>
+#include <string>
 #include <tuple>
+#include <utility>
 #include <vector>
 
 #include "ScanContext.hpp"
@@ -39,11 +44,76 @@ PYBIND11_MAKE_OPAQUE(std::vector<Eigen::Vector3d>);
 namespace py = pybind11;
 using namespace py::literals;
 
+namespace {
+// the data of a C-contiguous array of exactly _size values of type T, read or written in place
+template <typename T>
+T *bufferData(const py::array &_array, size_t _size, const std::string &_name) {
+    if (!py::isinstance<py::array_t<T>>(_array) || !(_array.flags() & py::array::c_style) ||
+        size_t(_array.size()) != _size)
+        throw std::invalid_argument(_name + " must hold " + std::to_string(_size) +
+                                    " C-contiguous " + std::string(py::str(py::dtype::of<T>())) +
+                                    " values");
+    return static_cast<T *>(const_cast<void *>(_array.data()));
+}
+
+// buffers of ids.size() keyframes, without cartesian grids if cartesians is empty
+DatabaseBuffers databaseBuffers(const SCManager &self,
+                                const py::array &descriptors,
+                                const py::array &ringkeys,
+                                const py::array &sectorkeys,
+                                const py::array &cartesians,
+                                const py::array &ids) {
+    DatabaseBuffers buffers;
+    buffers.num_keyframes = ids.size();
+    const size_t num_keyframes = buffers.num_keyframes;
+    buffers.descriptors = bufferData<double>(
+        descriptors, num_keyframes * self.PC_NUM_RING * self.PC_NUM_SECTOR, "descriptors");
+    buffers.ringkeys = bufferData<float>(ringkeys, num_keyframes * self.PC_NUM_RING, "ringkeys");
+    buffers.sectorkeys =
+        bufferData<double>(sectorkeys, num_keyframes * self.PC_NUM_SECTOR, "sectorkeys");
+    if (cartesians.size() > 0)
+        buffers.cartesians = bufferData<double>(
+            cartesians, num_keyframes * self.CART_NUM_CELLS * self.CART_NUM_CELLS, "cartesians");
+    buffers.ids = bufferData<size_t>(ids, num_keyframes, "ids");
+    return buffers;
+}
+
+// a numpy array of rows of _num_cols values, owning _values (i.e., without copying them)
+py::array_t<double> rowsArray(std::vector<double> &&_values, size_t _num_cols) {
+    auto *values = new std::vector<double>(std::move(_values));
+    py::capsule owner(values, [](void *ptr) { delete static_cast<std::vector<double> *>(ptr); });
+    return py::array_t<double>({values->size() / _num_cols, _num_cols}, values->data(), owner);
+}
+
+// (query id, candidate id, distance) and (candidate id, query id, 4x4 initial guess) rows
+const size_t SCORE_COLS = 3;
+const size_t CLOSURE_COLS = 18;
+}  // namespace
+
 PYBIND11_MODULE(scan_context_pybind, m) {
     auto vector3dvector = pybind_eigen_vector_of_vector<Eigen::Vector3d>(
         m, "_VectorEigen3d", "std::vector<Eigen::Vector3d>",
         py::py_array_to_vectors_double<Eigen::Vector3d>);
 
+    py::enum_<SCManager::Downsampling>(m, "_Downsampling")
+        .value("NONE", SCManager::Downsampling::NONE)
+        .value("VOXEL", SCManager::Downsampling::VOXEL)
+        .value("BIN_MAX", SCManager::Downsampling::BIN_MAX);
+
+    py::enum_<SCManager::BinEncoder>(m, "_BinEncoder")
+        .value("MAX_HEIGHT", SCManager::BinEncoder::MAX_HEIGHT)
+        .value("MAX_INTENSITY", SCManager::BinEncoder::MAX_INTENSITY)
+        .value("POINT_COUNT", SCManager::BinEncoder::POINT_COUNT)
+        .value("MEAN_HEIGHT", SCManager::BinEncoder::MEAN_HEIGHT);
+
+    py::enum_<SCManager::DescriptorType>(m, "_DescriptorType")
+        .value("POLAR", SCManager::DescriptorType::POLAR)
+        .value("CARTESIAN", SCManager::DescriptorType::CARTESIAN);
+
+    py::enum_<SCManager::RotationSearch>(m, "_RotationSearch")
+        .value("VKEY_WINDOW", SCManager::RotationSearch::VKEY_WINDOW)
+        .value("FULL_FFT", SCManager::RotationSearch::FULL_FFT);
+
     py::class_<SCManager, std::shared_ptr<SCManager>> scan_context(
         m, "_SCManager",
         "This is the low level C++ bindings, all the methods and "
@@ -53,15 +123,273 @@ PYBIND11_MODULE(scan_context_pybind, m) {
         "class to "
         "check how to use the API");
     scan_context.def(py::init<>())
-        .def("_makeAndSaveScancontextAndKeys", &SCManager::makeAndSaveScancontextAndKeys,
-             "_scan_down"_a)
+        .def_readwrite("_PC_MIN_RADIUS", &SCManager::PC_MIN_RADIUS)
+        .def_readwrite("_PC_MIN_HEIGHT", &SCManager::PC_MIN_HEIGHT)
+        .def_readwrite("_PC_MAX_HEIGHT", &SCManager::PC_MAX_HEIGHT)
+        .def_readwrite("_DOWNSAMPLING", &SCManager::DOWNSAMPLING)
+        .def_readwrite("_VOXEL_SIZE", &SCManager::VOXEL_SIZE)
+        .def_readwrite("_MIN_INTENSITY", &SCManager::MIN_INTENSITY)
+        .def_readwrite("_NORMALIZE_INTENSITY", &SCManager::NORMALIZE_INTENSITY)
+        .def_readwrite("_BIN_ENCODER", &SCManager::BIN_ENCODER)
+        .def_readwrite("_SPARSE_DESCRIPTORS", &SCManager::SPARSE_DESCRIPTORS)
+        .def_readwrite("_DESCRIPTOR", &SCManager::DESCRIPTOR)
+        .def_readwrite("_CC_MAX_LATERAL", &SCManager::CC_MAX_LATERAL)
+        .def_readwrite("_AUGMENT_REVERSE", &SCManager::AUGMENT_REVERSE)
+        .def(
+            "_preprocessScan",
+            [](const SCManager &self, const PointsRef &points) {
+                return self.preprocessScan(points, self.intensityScale(points));
+            },
+            "_points"_a, py::call_guard<py::gil_scoped_release>())
+        .def_readwrite("_NUM_CANDIDATES_FROM_TREE", &SCManager::NUM_CANDIDATES_FROM_TREE)
+        .def_readwrite("_SC_DIST_THRES", &SCManager::SC_DIST_THRES)
+        .def_readwrite("_RINGKEY_DIST_THRES", &SCManager::RINGKEY_DIST_THRES)
+        .def_readwrite("_SECTORKEY_RESIDUAL_THRES", &SCManager::SECTORKEY_RESIDUAL_THRES)
+        .def_readwrite("_PRUNE_CANDIDATES", &SCManager::PRUNE_CANDIDATES)
+        .def_readwrite("_ROTATION_SEARCH", &SCManager::ROTATION_SEARCH)
+        .def_readwrite("_PYRAMID_LEVELS", &SCManager::PYRAMID_LEVELS)
+        .def_readwrite("_NUM_CANDIDATES_COARSE", &SCManager::NUM_CANDIDATES_COARSE)
+        .def_readwrite("_KEYFRAME_SC_DIST_THRES", &SCManager::KEYFRAME_SC_DIST_THRES)
+        .def_readwrite("_KEYFRAME_MIN_DISTANCE", &SCManager::KEYFRAME_MIN_DISTANCE)
+        .def_readwrite("_MAX_MEMORY_BYTES", &SCManager::MAX_MEMORY_BYTES)
+        .def_readwrite("_EVICTION_RINGKEY_DIST", &SCManager::EVICTION_RINGKEY_DIST)
+        .def_readwrite("_EVICTION_LOW_WATER", &SCManager::EVICTION_LOW_WATER)
+        .def_readwrite("_SEQUENCE_WINDOW", &SCManager::SEQUENCE_WINDOW)
+        .def_readwrite("_SEQUENCE_DIST_THRES", &SCManager::SEQUENCE_DIST_THRES)
+        .def_readwrite("_SUBSECTOR_YAW", &SCManager::SUBSECTOR_YAW)
+        .def_readwrite("_ESTIMATE_TRANSLATION", &SCManager::ESTIMATE_TRANSLATION)
+        .def_readwrite("_CART_NUM_CELLS", &SCManager::CART_NUM_CELLS)
+        .def_readwrite("_CART_CELL_SIZE", &SCManager::CART_CELL_SIZE)
+        .def_readwrite("_TRANSLATION_SEARCH_RADIUS", &SCManager::TRANSLATION_SEARCH_RADIUS)
+        .def(
+            "_distanceBtnScanContext",
+            [](SCManager &self, Eigen::MatrixXd sc1, Eigen::MatrixXd sc2) {
+                py::gil_scoped_release release;
+                return self.distanceBtnScanContext(sc1, sc2);
+            },
+            "sc1"_a, "sc2"_a)
+        .def("_getPruningStats",
+             [](const SCManager &self) {
+                 const PruningStats &stats = self.pruning_stats_;
+                 return py::dict("evaluated"_a = stats.evaluated,
+                                 "coarse_rejected"_a = stats.coarse_rejected,
+                                 "ringkey_rejected"_a = stats.ringkey_rejected,
+                                 "sectorkey_rejected"_a = stats.sectorkey_rejected,
+                                 "early_exit_rejected"_a = stats.early_exit_rejected,
+                                 "sequence_rejected"_a = stats.sequence_rejected);
+             })
+        .def(
+            "_makeScancontext",
+            [](const SCManager &self, const PointsRef &points) {
+                return self.makeScancontext(points);
+            },
+            "_points"_a, py::call_guard<py::gil_scoped_release>())
+        .def(
+            "_makeScancontextAndCartesian",
+            [](const SCManager &self, const PointsRef &points) {
+                Eigen::MatrixXd cartesian;
+                Eigen::MatrixXd sc = self.makeScancontext(points, &cartesian);
+                return std::make_pair(sc, cartesian);
+            },
+            "_points"_a, py::call_guard<py::gil_scoped_release>())
+        .def(
+            "_encodeScan",
+            [](const SCManager &self, const PointsRef &points) {
+                Eigen::MatrixXd polar, cartesian_context, cartesian;
+                self.encodeScan(points, &polar, &cartesian_context, &cartesian);
+                return std::make_tuple(polar, cartesian_context, cartesian);
+            },
+            "_points"_a, py::call_guard<py::gil_scoped_release>())
+        .def(
+            "_makeAndSaveScancontextAndKeys",
+            [](SCManager &self, const PointsRef &points, const Eigen::Vector3d &position) {
+                return self.makeAndSaveScancontextAndKeys(points, position);
+            },
+            "_points"_a, "_position"_a = NO_POSITION, py::call_guard<py::gil_scoped_release>())
+        .def("_saveScancontextAndKeys", &SCManager::saveScancontextAndKeys, "_sc"_a,
+             "_position"_a = NO_POSITION, "_cartesian"_a = Eigen::MatrixXd(),
+             py::call_guard<py::gil_scoped_release>())
+        .def("_restoreScancontextAndKeys", &SCManager::restoreScancontextAndKeys, "_sc"_a, "_id"_a,
+             "_last_matched"_a, "_cartesian"_a = Eigen::MatrixXd(),
+             py::call_guard<py::gil_scoped_release>())
+        .def(
+            "_runSequence",
+            [](SCManager &self, const py::object &scans, double score_thres, double closure_thres,
+               size_t max_frames) {
+                // the number of scans read (up to max_frames) and their results, the iterator keeps
+                // its state for the next call
+                const py::iterator iterator = py::iter(scans);
+                Py_ssize_t num_frames_hint = PyObject_LengthHint(iterator.ptr(), 0);
+                if (num_frames_hint < 0) {
+                    PyErr_Clear();
+                    num_frames_hint = 0;
+                }
+                std::vector<double> scores, closures;
+                scores.reserve(std::min<size_t>(max_frames, num_frames_hint) *
+                               self.NUM_CANDIDATES_FROM_TREE * SCORE_COLS);
+                size_t num_frames = 0;
+                for (; num_frames < max_frames; num_frames++) {
+                    const auto item =
+                        py::reinterpret_steal<py::object>(PyIter_Next(iterator.ptr()));
+                    if (!item) {
+                        if (PyErr_Occurred()) throw py::error_already_set();
+                        break;
+                    }
+                    // read in place if C-contiguous float64, as the other bindings
+                    const auto scan =
+                        py::array_t<double, py::array::c_style | py::array::forcecast>::ensure(
+                            item);
+                    if (!scan || scan.ndim() != 2 || scan.shape(1) < 3)
+                        throw std::invalid_argument("the scans must be N x 3 or N x 4 arrays");
+                    const Eigen::Map<const PointMatrix> points(scan.data(), scan.shape(0),
+                                                               scan.shape(1));
+                    py::gil_scoped_release release;
+                    self.processScan(points, score_thres, closure_thres, scores, closures);
+                }
+                return std::make_tuple(num_frames, rowsArray(std::move(scores), SCORE_COLS),
+                                       rowsArray(std::move(closures), CLOSURE_COLS));
+            },
+            "_scans"_a, "_score_thres"_a, "_closure_thres"_a,
+            "_max_frames"_a = std::numeric_limits<size_t>::max())
+        .def(
+            "_runPackedSequence",
+            [](SCManager &self, const PointsRef &points, const std::vector<Eigen::Index> &offsets,
+               double score_thres, double closure_thres) {
+                // scan frame_idx is the rows [offsets[frame_idx], offsets[frame_idx + 1])
+                for (size_t frame_idx = 0; frame_idx + 1 < offsets.size(); frame_idx++)
+                    if (offsets[frame_idx] < 0 || offsets[frame_idx] > offsets[frame_idx + 1] ||
+                        offsets[frame_idx + 1] > points.rows())
+                        throw std::invalid_argument("the offsets must increase within the points");
+                const size_t num_frames = offsets.empty() ? 0 : offsets.size() - 1;
+                std::vector<double> scores, closures;
+                {
+                    py::gil_scoped_release release;
+                    scores.reserve(num_frames * self.NUM_CANDIDATES_FROM_TREE * SCORE_COLS);
+                    for (size_t frame_idx = 0; frame_idx < num_frames; frame_idx++)
+                        self.processScan(
+                            points.middleRows(offsets[frame_idx],
+                                              offsets[frame_idx + 1] - offsets[frame_idx]),
+                            score_thres, closure_thres, scores, closures);
+                }
+                return std::make_pair(rowsArray(std::move(scores), SCORE_COLS),
+                                      rowsArray(std::move(closures), CLOSURE_COLS));
+            },
+            "_points"_a, "_offsets"_a, "_score_thres"_a, "_closure_thres"_a)
         .def("_detectLoopClosureID",
              [](SCManager &self) {
-                 auto res = self.detectLoopClosureID();
+                 ClosureCandidates res;
+                 {
+                     py::gil_scoped_release release;
+                     res = self.detectLoopClosureID();
+                 }
                  return std::make_tuple(std::get<0>(res), py::cast(std::get<1>(res)),
                                         py::cast(std::get<2>(res)), py::cast(std::get<3>(res)));
              })
+        .def(
+            "_detectLoopClosureIDs",
+            [](SCManager &self, const std::vector<size_t> &query_ids) {
+                std::vector<ClosureCandidates> res;
+                {
+                    py::gil_scoped_release release;
+                    res = self.detectLoopClosureIDs(query_ids);
+                }
+                py::list results;
+                for (const auto &candidates : res)
+                    results.append(py::make_tuple(
+                        std::get<0>(candidates), py::cast(std::get<1>(candidates)),
+                        py::cast(std::get<2>(candidates)), py::cast(std::get<3>(candidates))));
+                return results;
+            },
+            "query_ids"_a)
+        .def(
+            "_buildDatabase", [](SCManager &self) { self.rebuildTree(self.polarcontexts_.size()); },
+            py::call_guard<py::gil_scoped_release>())
+        .def(
+            "_searchDatabase",
+            [](const SCManager &self, const Eigen::MatrixXd &sc, const Eigen::MatrixXd &cartesian) {
+                CandidateSearch search;
+                {
+                    py::gil_scoped_release release;
+                    PruningStats stats;
+                    search = self.searchDatabase(sc, cartesian, stats);
+                }
+                std::vector<size_t> ids;
+                for (size_t candidate_idx : search.indexes)
+                    ids.push_back(self.polarcontext_ids_[candidate_idx]);
+                Eigen::MatrixXd translations(search.translations.size(), 2);
+                for (size_t idx = 0; idx < search.translations.size(); idx++)
+                    translations.row(idx) = search.translations[idx].transpose();
+                return std::make_tuple(py::cast(ids), py::cast(search.dists), py::cast(search.yaws),
+                                       translations);
+            },
+            "_sc"_a, "_cartesian"_a = Eigen::MatrixXd())
+        .def(
+            "_exportDatabase",
+            [](const SCManager &self, const py::array &descriptors, const py::array &ringkeys,
+               const py::array &sectorkeys, const py::array &cartesians, const py::array &ids) {
+                const DatabaseBuffers buffers =
+                    databaseBuffers(self, descriptors, ringkeys, sectorkeys, cartesians, ids);
+                py::gil_scoped_release release;
+                self.exportDatabase(buffers);
+            },
+            "_descriptors"_a, "_ringkeys"_a, "_sectorkeys"_a, "_cartesians"_a, "_ids"_a)
+        // the arrays must outlive the manager
+        .def(
+            "_attachDatabase",
+            [](SCManager &self, const py::array &descriptors, const py::array &ringkeys,
+               const py::array &sectorkeys, const py::array &cartesians, const py::array &ids) {
+                const DatabaseBuffers buffers =
+                    databaseBuffers(self, descriptors, ringkeys, sectorkeys, cartesians, ids);
+                py::gil_scoped_release release;
+                self.attachDatabase(buffers);
+            },
+            "_descriptors"_a, "_ringkeys"_a, "_sectorkeys"_a, "_cartesians"_a, "_ids"_a,
+            py::keep_alive<1, 2>(), py::keep_alive<1, 3>(), py::keep_alive<1, 4>(),
+            py::keep_alive<1, 5>(), py::keep_alive<1, 6>())
         .def(
             "_getScanContext",
-            [](const SCManager &self, int idx) { return self.polarcontexts_[idx]; }, "idx"_a);
+            [](const SCManager &self, size_t id) {
+                const int idx = self.indexOf(id);
+                if (idx < 0)
+                    throw py::key_error("no keyframe with id " + std::to_string(id) +
+                                        " (skipped or evicted)");
+                return Eigen::MatrixXd(self.descriptorAt(idx));
+            },
+            "id"_a)
+        .def(
+            "_getCartesian",
+            [](const SCManager &self, size_t id) {
+                const int idx = self.indexOf(id);
+                if (idx < 0)
+                    throw py::key_error("no keyframe with id " + std::to_string(id) +
+                                        " (skipped or evicted)");
+                return Eigen::MatrixXd(self.cartesianAt(idx));
+            },
+            "id"_a)
+        .def("_getCandidateTranslations",
+             [](const SCManager &self) {
+                 Eigen::MatrixXd translations(self.candidate_translations_.size(), 2);
+                 for (size_t idx = 0; idx < self.candidate_translations_.size(); idx++)
+                     translations.row(idx) = self.candidate_translations_[idx].transpose();
+                 return translations;
+             })
+        .def("_getNumScans", [](const SCManager &self) { return self.polarcontexts_.size(); })
+        .def("_getIds", [](const SCManager &self) { return self.polarcontext_ids_; })
+        .def("_getLastMatched",
+             [](const SCManager &self) { return self.polarcontext_last_matched_; })
+        .def("_memoryUsage", &SCManager::memoryUsage)
+        .def("_getState",
+             [](const SCManager &self) {
+                 return std::make_tuple(self.tree_making_period_conter,
+                                        self.polarcontext_invkeys_to_search_.size(),
+                                        self.num_scans_seen_);
+             })
+        .def(
+            "_restoreState",
+            [](SCManager &self, int counter, size_t num_keys, size_t num_scans_seen) {
+                self.tree_making_period_conter = counter;
+                self.num_scans_seen_ = num_scans_seen;
+                if (num_keys > 0) self.rebuildTree(num_keys);
+            },
+            "counter"_a, "num_keys"_a, "num_scans_seen"_a);
 }
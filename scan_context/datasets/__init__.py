@@ -54,8 +54,12 @@ def dataloader_types() -> Dict:
 def dataset_factory(dataloader: str, data_dir: Path, *args, **kwargs):
     import importlib
 
+    from scan_context.tools.archive import is_archive
+
     dataloader_type = dataloader_types()[dataloader]
     module = importlib.import_module(f".{dataloader}", __name__)
     assert hasattr(module, dataloader_type), f"{dataloader_type} is not defined in {module}"
     dataset = getattr(module, dataloader_type)
+    if is_archive(data_dir) and not getattr(dataset, "supports_archives", False):
+        raise ValueError(f"The {dataloader} dataloader can not read {data_dir}, extract it first")
     return dataset(data_dir=data_dir, *args, **kwargs)
@@ -29,6 +29,9 @@ import open3d as o3d
 
 
 class GenericDataset:
+    # The intensities are thresholded natively, relative to the brightest point of each scan
+    scan_context_config = {"min_intensity": 0.25, "normalize_intensity": True}
+
     def __init__(self, data_dir: Path, *_, **__):
         # Config stuff
         self.sequence_id = os.path.basename(os.path.abspath(data_dir))
@@ -53,6 +56,4 @@ class GenericDataset:
     def read_point_cloud(self, file_path: str):
         pointcloud = o3d.t.io.read_point_cloud(file_path).point
         points, intensity = pointcloud.positions.numpy(), pointcloud.intensity.numpy()
-        intensity = intensity / intensity.max()
-        keep_ind = np.where(intensity > 0.25)[0]
-        return points[keep_ind].astype(np.float64), intensity[keep_ind]
+        return np.hstack((points, intensity.reshape(-1, 1))).astype(np.float64)
@@ -20,27 +20,32 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import glob
 import os
 from pathlib import Path
 
 import numpy as np
-import open3d as o3d
+from plyfile import PlyData
+
+from scan_context.tools.archive import open_file_source
 
 
 class HeLiPRDataset:
+    supports_archives = True
+
     def __init__(self, data_dir: Path, sequence: str, *_, **__):
-        self.sequence_id = f"{os.path.basename(data_dir)}_{sequence}"
+        # A sequence directory or the archive it ships in (e.g., Roundabout01.zip)
+        self.source = open_file_source(data_dir)
+        self.sequence_id = f"{self.source.name}_{sequence}"
         self.data_dir = os.path.realpath(data_dir)
-        self.sequence_dir = os.path.join(self.data_dir, "LiDAR", sequence)
-        self.scan_files = sorted(glob.glob(self.sequence_dir + "/*.ply"))
+        self.sequence_dir = os.path.join("LiDAR", sequence)
+        self.scan_files = self.source.glob(self.sequence_dir + "/*.ply")
 
-        self.gt_file = os.path.join(self.data_dir, "LiDAR_GT", f"global_{sequence}_gt.txt")
+        self.gt_file = os.path.join("LiDAR_GT", f"global_{sequence}_gt.txt")
 
         if len(self.scan_files) == 0:
             raise ValueError(f"Tried to read point cloud files in {data_dir} but none found")
         try:
-            self.gt_closure_indices = np.loadtxt(
+            self.gt_closure_indices = self.source.loadtxt(
                 os.path.join(self.sequence_dir, "loop_closure", "gt_closures.txt")
             )
         except FileNotFoundError:
@@ -53,9 +58,9 @@ class HeLiPRDataset:
         return self.read_point_cloud(idx)
 
     def get_data(self, idx: int):
-        file_path = self.scan_files[idx]
-        pcd = o3d.io.read_point_cloud(file_path)
-        return np.asarray(pcd.points)
+        with self.source.open(self.scan_files[idx]) as f:
+            vertex = PlyData.read(f)["vertex"]
+        return np.stack([vertex["x"], vertex["y"], vertex["z"]], axis=1)
 
     def read_point_cloud(self, idx: int):
         data = self.get_data(idx)
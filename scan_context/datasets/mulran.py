@@ -20,25 +20,27 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import glob
 import os
 from pathlib import Path
 
 import numpy as np
 
+from scan_context.tools.archive import open_file_source
+
 
 class MulranDataset:
+    supports_archives = True
+
     def __init__(self, data_dir: Path, *_, **__):
         self.data_dir = os.path.realpath(data_dir)
-        self.sequence_id = os.path.basename(data_dir)
-        self.velodyne_dir = os.path.join(self.data_dir, "Ouster/")
+        # A sequence directory or the archive it ships in (e.g., KAIST01.zip)
+        self.source = open_file_source(data_dir)
+        self.sequence_id = self.source.name
 
-        self.scan_files = sorted(glob.glob(self.velodyne_dir + "*.bin"))
+        self.scan_files = self.source.glob("Ouster/*.bin")
 
         try:
-            self.gt_closure_indices = np.loadtxt(
-                os.path.join(self.data_dir, "loop_closure", "gt_closures.txt")
-            )
+            self.gt_closure_indices = self.source.loadtxt("loop_closure/gt_closures.txt")
         except FileNotFoundError:
             self.gt_closure_indices = None
 
@@ -49,5 +51,5 @@ class MulranDataset:
         return self.read_point_cloud(self.scan_files[idx])
 
     def read_point_cloud(self, file_path: str):
-        points = np.fromfile(file_path, dtype=np.float32).reshape((-1, 4))[:, :3]
+        points = self.source.read_array(file_path, np.float32).reshape((-1, 4))[:, :3]
         return points.astype(np.float64)
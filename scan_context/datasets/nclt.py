@@ -25,16 +25,23 @@ import sys
 from pathlib import Path
 
 import numpy as np
+from scipy.spatial.transform import Rotation
+
+from scan_context.tools.archive import open_file_source
 
 
 class NCLTDataset:
     """Adapted from PyLidar-SLAM"""
 
+    supports_archives = True
+
     def __init__(self, data_dir: Path, *_, **__):
-        self.sequence_id = os.path.basename(data_dir)
+        # A sequence directory or an archive of it (e.g., 2012-01-08.tar)
+        self.source = open_file_source(data_dir)
+        self.sequence_id = self.source.name
         self.data_dir = os.path.join(os.path.realpath(data_dir), "")
-        self.scans_dir = os.path.join(self.data_dir, "velodyne_sync")
-        scan_files = np.array(sorted(os.listdir(str(self.scans_dir))), dtype=str)
+        self.scans_dir = "velodyne_sync"
+        scan_files = np.array(sorted(self.source.listdir(self.scans_dir)), dtype=str)
         poses_file = os.path.realpath(
             os.path.join(
                 self.data_dir,
@@ -45,11 +52,10 @@ class NCLTDataset:
         gt_data = np.loadtxt(poses_file, delimiter=",")
         self.timestamps, timestamp_filter = self.load_valid_timestamps(gt_data, scan_files)
         self.scan_files = scan_files[timestamp_filter]
+        self.gt_poses = self.interpolate_poses(gt_data, self.timestamps)
 
         try:
-            self.gt_closure_indices = np.loadtxt(
-                os.path.join(self.data_dir, "loop_closure", "gt_closures.txt")
-            )
+            self.gt_closure_indices = self.source.loadtxt("loop_closure/gt_closures.txt")
         except FileNotFoundError:
             self.gt_closure_indices = None
 
@@ -70,7 +76,7 @@ class NCLTDataset:
             z = z_s * scaling + offset
             return x, y, z
 
-        binary = np.fromfile(file_path, dtype=np.int16)
+        binary = self.source.read_array(file_path, np.int16)
         x = np.ascontiguousarray(binary[::4])
         y = np.ascontiguousarray(binary[1::4])
         z = np.ascontiguousarray(binary[2::4])
@@ -92,3 +98,17 @@ class NCLTDataset:
         )
         filter_ = (timestamps > np.min(gt_t)) * (timestamps < np.max(gt_t))
         return timestamps[filter_], filter_
+
+    @staticmethod
+    def interpolate_poses(gt_data: np.ndarray, timestamps: np.ndarray):
+        # Linear interpolation of the position and of the (unwrapped) roll, pitch, heading
+        gt_data = gt_data[~np.isnan(gt_data).any(axis=1)]
+        values = np.c_[gt_data[:, 1:4], np.unwrap(gt_data[:, 4:7], axis=0)]
+        interpolated = np.stack(
+            [np.interp(timestamps, gt_data[:, 0], column) for column in values.T], axis=1
+        )
+        poses = np.tile(np.eye(4), (len(timestamps), 1, 1))
+        poses[:, :3, :3] = Rotation.from_euler("xyz", interpolated[:, 3:]).as_matrix()
+        poses[:, :3, 3] = interpolated[:, :3]
+        # The scans are flipped to have z pointing up, i.e., rotated by pi around x
+        return poses @ np.diag([1.0, -1.0, -1.0, 1.0])
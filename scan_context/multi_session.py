@@ -0,0 +1,237 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from pybind.scan_context import ScanContext
+from scan_context.pipeline import create_results_dir
+from scan_context.shared_database import SharedDatabase
+from scan_context.tools.parallel_encoding import encode_scans
+from scan_context.tools.pipeline_results import PipelineResults
+from scan_context.tools.progress_bar import get_progress_bar
+
+
+class ReferenceDatabase:
+    """Scan Contexts of one or more reference sessions, queried by the scans of another session.
+
+    Every scan offered to the database gets the next id, whether it becomes a keyframe or not, and
+    is located by its session and frame. Once built, the database is only read: queries never
+    update it, so they can run on several threads at once. Build it once, save it and reuse it for
+    any number of query sessions.
+    """
+
+    def __init__(self, scan_context_config: Optional[Dict[str, Any]] = None):
+        self.scan_context_config = scan_context_config or {}
+        self.scan_context = ScanContext(**self.scan_context_config)
+        self.session_names: List[str] = []
+        self._sessions: List[int] = []  # by id
+        self._frames: List[int] = []  # by id
+        self._ids: Dict[Tuple[int, int], int] = {}  # (session, frame) -> id
+
+    def add_session(self, dataset, name: Optional[str] = None, num_workers: int = 0) -> None:
+        """Add all the scans of a dataset, encoded on num_workers processes if not 0."""
+        session = len(self.session_names)
+        self.session_names.append(name if name is not None else dataset.sequence_id)
+        scan_contexts, cartesians = None, None
+        if num_workers > 0:
+            scan_contexts, cartesians = encode_scans(
+                dataset, 0, len(dataset), self.scan_context_config, num_workers
+            )
+        try:
+            for frame_idx in get_progress_bar(0, len(dataset)):
+                if scan_contexts is not None:
+                    scan_context = scan_contexts[frame_idx]
+                    cartesian = cartesians[frame_idx] if cartesians is not None else None
+                else:
+                    scan_context, cartesian = self.scan_context.make_scan_context_and_cartesian(
+                        dataset[frame_idx]
+                    )
+                self.scan_context.add_scan_context(scan_context, cartesian=cartesian)
+                self._add_location(session, frame_idx)
+        finally:
+            if scan_contexts is not None:
+                scan_contexts.close(unlink=True)
+            if cartesians is not None:
+                cartesians.close(unlink=True)
+        self.scan_context.build_database()
+
+    def query(
+        self, scan_context: np.ndarray, cartesian: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Candidate ids, distances, yaws and initial guesses, see ScanContext.query_database."""
+        return self.scan_context.query_database(scan_context, cartesian)
+
+    def locate(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Session indices and frames of database ids."""
+        ids = np.asarray(ids, int)
+        return np.asarray(self._sessions, int)[ids], np.asarray(self._frames, int)[ids]
+
+    def database_id(self, session: int, frame: int) -> int:
+        return self._ids[(int(session), int(frame))]
+
+    def export_shared(self, name: Optional[str] = None) -> SharedDatabase:
+        """The keyframes in shared memory for ScanContextView workers, close it with unlink=True."""
+        return SharedDatabase.export(self.scan_context, self.scan_context_config, name)
+
+    def save(self, path: Path) -> None:
+        ids = self.scan_context.get_ids()
+        cartesians = [self.scan_context.get_cartesian(id) for id in ids]
+        if any(cartesian is None for cartesian in cartesians):
+            cartesians = []
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                config=json.dumps(self.scan_context_config),
+                session_names=np.asarray(self.session_names, dtype=str),
+                sessions=np.asarray(self._sessions, int),
+                frames=np.asarray(self._frames, int),
+                ids=ids,
+                last_matched=self.scan_context.get_last_matched(),
+                scan_contexts=np.asarray([self.scan_context.get_scan_context(id) for id in ids]),
+                cartesians=np.asarray(cartesians),
+                state=np.asarray(self.scan_context.get_state(), int),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "ReferenceDatabase":
+        with np.load(path) as data:
+            database = cls(json.loads(str(data["config"])))
+            database.session_names = data["session_names"].tolist()
+            for session, frame in zip(data["sessions"].tolist(), data["frames"].tolist()):
+                database._add_location(session, frame)
+            cartesians = data["cartesians"] if len(data["cartesians"]) else None
+            last_matched = data["last_matched"].tolist()
+            for idx, id in enumerate(data["ids"].tolist()):
+                database.scan_context.restore_scan_context(
+                    data["scan_contexts"][idx],
+                    id,
+                    last_matched[idx],
+                    cartesians[idx] if cartesians is not None else None,
+                )
+            database.scan_context.restore_state(*data["state"].tolist())
+        database.scan_context.build_database()
+        return database
+
+    def _add_location(self, session: int, frame: int) -> None:
+        self._ids[(session, frame)] = len(self._sessions)
+        self._sessions.append(session)
+        self._frames.append(frame)
+
+    def __len__(self) -> int:
+        return len(self.scan_context)
+
+
+def load_cross_session_closures(path: Path, reference: ReferenceDatabase) -> np.ndarray:
+    """Ground truth closures between a query session and a reference database, as (id, frame).
+
+    Each row of the file (.txt or .npy) is a query frame and a reference frame, preceded by the
+    index of the reference session when the database holds more than one.
+    """
+    rows = np.load(path) if str(path).endswith(".npy") else np.loadtxt(path, ndmin=2)
+    rows = np.atleast_2d(np.asarray(rows, int))
+    if rows.shape[1] == 2:
+        if len(reference.session_names) > 1:
+            raise ValueError(
+                f"{path} has no session column, but the database holds "
+                f"{len(reference.session_names)} sessions"
+            )
+        rows = np.c_[rows[:, 0], np.zeros(len(rows), int), rows[:, 1]]
+    return np.asarray(
+        [[reference.database_id(session, frame), query] for query, session, frame in rows], int
+    ).reshape(-1, 2)
+
+
+class MultiSessionPipeline:
+    """Streams a query sequence against a reference database and reports cross-session closures.
+
+    The scans are read, encoded and queried on num_workers threads (the native calls release the
+    GIL), the database is never updated. closures.txt holds one row per closure: query frame,
+    reference session, reference frame, distance and the flattened 4 x 4 initial guess.
+    """
+
+    def __init__(
+        self,
+        reference: ReferenceDatabase,
+        dataset,
+        results_dir: Path,
+        gt_closures: Optional[np.ndarray] = None,
+        num_workers: int = 0,
+    ):
+        self.reference = reference
+        self._dataset = dataset
+        self.results_dir = results_dir
+        self._num_workers = num_workers
+        self.dataset_name = f"{self._dataset.sequence_id}_vs_{'+'.join(reference.session_names)}"
+
+        self.closures = []
+        self.gt_closures = gt_closures
+        scan_context_thresholds = np.arange(0.1, 1.0, 0.05)
+        self.results = PipelineResults(
+            gt_closures if gt_closures is not None else np.zeros((0, 2), int),
+            self.dataset_name,
+            scan_context_thresholds,
+            symmetric=False,
+        )
+
+    def run(self) -> PipelineResults:
+        if self._num_workers > 0:
+            with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+                self._collect(executor.map(self._query, range(len(self._dataset))))
+        else:
+            self._collect(map(self._query, range(len(self._dataset))))
+        if self.gt_closures is not None:
+            self.results.compute_metrics()
+        self._log_to_file()
+        return self.results
+
+    def _query(self, frame_idx: int):
+        scan_context, cartesian = self.reference.scan_context.make_scan_context_and_cartesian(
+            self._dataset[frame_idx]
+        )
+        return frame_idx, self.reference.query(scan_context, cartesian)
+
+    def _collect(self, results) -> None:
+        for frame_idx, candidates in tqdm(
+            results, total=len(self._dataset), unit=" frames", dynamic_ncols=True
+        ):
+            candidate_ids, candidate_dists, _, initial_guesses = candidates
+            sessions, frames = self.reference.locate(candidate_ids)
+            for candidate_id, session, frame, dist, initial_guess in zip(
+                candidate_ids, sessions, frames, candidate_dists, initial_guesses.reshape(-1, 16)
+            ):
+                if dist < 0.4:
+                    self.closures.append(np.r_[frame_idx, session, frame, dist, initial_guess])
+                self.results.append(frame_idx, candidate_id, dist)
+
+    def _log_to_file(self) -> None:
+        self.results_dir = create_results_dir(self.results_dir, self.dataset_name)
+        if self.gt_closures is not None:
+            self.results.log_to_file_pr(os.path.join(self.results_dir, "metrics.txt"))
+        self.results.log_to_file_closures(self.results_dir)
+        closures = np.asarray(self.closures).reshape(-1, 20)
+        np.savetxt(os.path.join(self.results_dir, "closures.txt"), closures)
@@ -23,14 +23,19 @@
 import datetime
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import numpy as np
 
 from pybind.scan_context import ScanContext
+from scan_context.tools.checkpoint import PipelineCheckpoint
+from scan_context.tools.parallel_encoding import encode_scans
 from scan_context.tools.pipeline_results import PipelineResults
 from scan_context.tools.progress_bar import get_progress_bar
-from scan_context.tools.visualization import draw_scan_context
+from scan_context.tools.visualization import ScanContextVisualizer
+
+# Candidates closer than this are written to closures.txt
+CLOSURE_THRESHOLD = 0.4
 
 
 class ScanContextPipeline:
@@ -39,15 +44,32 @@ class ScanContextPipeline:
         dataset,
         results_dir: Path,
         visualize: Optional[bool] = False,
+        visualization_output: Optional[str] = None,
+        checkpoint_period: int = 0,
+        resume: bool = False,
+        scan_context_config: Optional[Dict[str, Any]] = None,
+        num_workers: int = 0,
     ):
         self._dataset = dataset
         self._first = 0
         self._last = len(self._dataset)
 
+        # Started in _run_pipeline, after the encoding workers are forked
+        self._visualizer = None
         self._visualize = visualize
+        self._visualization_output = visualization_output
         self.results_dir = results_dir
 
-        self.scan_context = ScanContext()
+        # Dataset hints (e.g., the intensity threshold of a sensor) go first, then the user config
+        self._scan_context_config = {
+            **getattr(self._dataset, "scan_context_config", {}),
+            **(scan_context_config or {}),
+        }
+        self.scan_context = ScanContext(**self._scan_context_config)
+        # 0: online, otherwise all the scans are encoded on num_workers processes before querying
+        self._num_workers = num_workers
+        self._scan_contexts = None
+        self._cartesians = None
         self.dataset_name = self._dataset.sequence_id
 
         self.closures = []
@@ -58,6 +80,18 @@ class ScanContextPipeline:
             self.gt_closure_indices, self.dataset_name, scan_context_thresholds
         )
 
+        self._checkpoint_period = checkpoint_period
+        self._checkpoint = None
+        self._results_since_checkpoint = []
+        self._closures_checkpointed = 0
+        if self._checkpoint_period > 0 or resume:
+            checkpoint_dir = os.path.join(
+                self.results_dir, "scan_context_results", self.dataset_name, "checkpoint"
+            )
+            self._checkpoint = PipelineCheckpoint(checkpoint_dir, self.dataset_name)
+        if resume:
+            self._resume_from_checkpoint()
+
     def run(self):
         self._run_pipeline()
         if self.gt_closure_indices is not None:
@@ -67,26 +101,124 @@ class ScanContextPipeline:
         return self.results
 
     def _run_pipeline(self):
-        scan = self._dataset[self._first]
-        self.scan_context.process_new_scan(scan)
-        for query_idx in get_progress_bar(self._first + 1, self._last):
-            scan = self._dataset[query_idx]
-            self.scan_context.process_new_scan(scan)
-            query_idx, candidate_ids, candidate_dists, candidate_yaws = self.scan_context.check_for_closure()
-            if self._visualize:
-                for candidate_id in candidate_ids:
-                    draw_scan_context(
-                        [
+        if self._first >= self._last:
+            # Nothing left to encode or query, e.g. when resuming a finished run
+            if self._checkpoint is not None:
+                self._checkpoint.close()
+            return
+        if self._num_workers > 0:
+            self._scan_contexts, self._cartesians = encode_scans(
+                self._dataset,
+                self._first,
+                self._last,
+                self._scan_context_config,
+                self._num_workers,
+            )
+        if self._visualize or self._visualization_output is not None:
+            self._visualizer = ScanContextVisualizer(
+                display=self._visualize, output=self._visualization_output
+            )
+        try:
+            self._run_queries()
+        finally:
+            if self._scan_contexts is not None:
+                self._scan_contexts.close(unlink=True)
+                self._scan_contexts = None
+            if self._cartesians is not None:
+                self._cartesians.close(unlink=True)
+                self._cartesians = None
+
+    def _run_queries(self):
+        if self._visualizer is None and self._checkpoint is None and self._scan_contexts is None:
+            self._run_native()
+            return
+        if self._first == 0:
+            self._add_scan(self._first)
+            self._first += 1
+        for frame_idx in get_progress_bar(self._first, self._last):
+            # Scans not admitted as keyframes are not queried either
+            if self._add_scan(frame_idx):
+                self._check_for_closures()
+            if self._checkpoint_period > 0 and (frame_idx + 1) % self._checkpoint_period == 0:
+                self._save_checkpoint(frame_idx)
+        if self._visualizer is not None:
+            self._visualizer.close()
+        if self._checkpoint is not None:
+            if self._checkpoint_period > 0:
+                self._save_checkpoint(self._last - 1)
+            self._checkpoint.close()
+
+    def _run_native(self) -> None:
+        # Insert, query and thresholding without leaving the native side, the progress bar moves as
+        # the scans are read
+        frames = get_progress_bar(self._first, self._last)
+        scans = (self._dataset[frame_idx] for frame_idx in frames)
+        for scores, closures in self.scan_context.iter_sequence(
+            scans, closure_threshold=CLOSURE_THRESHOLD
+        ):
+            self.closures.extend(closures)
+            self.results.extend(scores)
+
+    def _add_scan(self, frame_idx: int) -> bool:
+        if self._scan_contexts is not None:
+            cartesian = self._cartesians[frame_idx] if self._cartesians is not None else None
+            return self.scan_context.add_scan_context(
+                self._scan_contexts[frame_idx], cartesian=cartesian
+            )
+        return self.scan_context.process_new_scan(self._dataset[frame_idx])
+
+    def _check_for_closures(self) -> None:
+        (
+            query_idx,
+            candidate_ids,
+            candidate_dists,
+            candidate_yaws,
+        ) = self.scan_context.check_for_closure()
+        if query_idx != -1:
+            initial_guesses = self.scan_context.initial_guesses().reshape(-1, 16)
+            for candidate_id, dist, yaw, initial_guess in zip(
+                candidate_ids, candidate_dists, candidate_yaws, initial_guesses
+            ):
+                if dist < CLOSURE_THRESHOLD:
+                    if self._visualizer is not None:
+                        self._visualizer.submit(
                             self.scan_context.get_scan_context(query_idx),
                             self.scan_context.get_scan_context(candidate_id),
-                        ]
-                    )
-            if query_idx != -1:
-                for candidate_id, dist, yaw in zip(candidate_ids, candidate_dists, candidate_yaws):
-                    if dist < 0.4:
-                        relative_tf = np.array([[np.cos(yaw), -np.sin(yaw), 0, 0], [np.sin(yaw), np.cos(yaw), 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
-                        self.closures.append(np.r_[candidate_id, query_idx, relative_tf.flatten()])
-                    self.results.append(query_idx, candidate_id, dist)
+                            query_idx,
+                            candidate_id,
+                            dist,
+                            yaw,
+                        )
+                    self.closures.append(np.r_[candidate_id, query_idx, initial_guess])
+                self.results.append(query_idx, candidate_id, dist)
+                if self._checkpoint is not None:
+                    self._results_since_checkpoint.append((query_idx, candidate_id, dist))
+
+    def _save_checkpoint(self, last_frame: int) -> None:
+        self._checkpoint.save(
+            last_frame,
+            self.scan_context,
+            self.closures[self._closures_checkpointed :],
+            self._results_since_checkpoint,
+        )
+        self._closures_checkpointed = len(self.closures)
+        self._results_since_checkpoint = []
+
+    def _resume_from_checkpoint(self) -> None:
+        state = self._checkpoint.load()
+        if state is None:
+            print(f"[WARNING] No checkpoint found for {self.dataset_name}, starting from scratch")
+            return
+        for id in sorted(state.scan_contexts):
+            self.scan_context.restore_scan_context(
+                state.scan_contexts[id], id, state.last_matched[id], state.cartesians.get(id)
+            )
+        self.scan_context.restore_state(*state.state)
+        self.closures.extend(state.closures)
+        self._closures_checkpointed = len(self.closures)
+        for query_idx, candidate_id, dist in state.results:
+            self.results.append(int(query_idx), int(candidate_id), dist)
+        self._first = state.last_frame + 1
 
     def _run_evaluation(self) -> None:
         self.results.compute_metrics()
@@ -99,17 +231,19 @@ class ScanContextPipeline:
         np.savetxt(os.path.join(self.results_dir, "closures.txt"), np.asarray(self.closures))
 
     def _create_results_dir(self) -> Path:
-        def get_timestamp() -> str:
-            return datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        return create_results_dir(self.results_dir, self.dataset_name)
 
-        results_dir = os.path.join(
-            self.results_dir, "scan_context_results", self.dataset_name, get_timestamp()
-        )
-        latest_dir = os.path.join(
-            self.results_dir, "scan_context_results", self.dataset_name, "latest"
-        )
-        os.makedirs(results_dir, exist_ok=True)
-        os.unlink(latest_dir) if os.path.exists(latest_dir) or os.path.islink(latest_dir) else None
-        os.symlink(results_dir, latest_dir)
 
-        return results_dir
+def create_results_dir(results_dir: Path, dataset_name: str) -> Path:
+    """Timestamped directory for the results of a run, linked to by <dataset_name>/latest."""
+
+    def get_timestamp() -> str:
+        return datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+
+    run_dir = os.path.join(results_dir, "scan_context_results", dataset_name, get_timestamp())
+    latest_dir = os.path.join(results_dir, "scan_context_results", dataset_name, "latest")
+    os.makedirs(run_dir, exist_ok=True)
+    os.unlink(latest_dir) if os.path.exists(latest_dir) or os.path.islink(latest_dir) else None
+    os.symlink(run_dir, latest_dir)
+
+    return run_dir
@@ -0,0 +1,409 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import IntEnum
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from pybind.scan_context import ScanContext
+from scan_context.tools.latency import LatencyStats
+
+# Messages in both directions: uint8 opcode (status for a response), uint32 payload size, payload.
+_HEADER = struct.Struct("<BI")
+# Scans (float32) and descriptors (float64): uint32 rows, uint32 cols, 3 float64 position (nan if
+# unknown), followed by the row-major values
+_MATRIX = struct.Struct("<II3d")
+_ID = struct.Struct("<q")
+_INSERTED = struct.Struct("<q?")  # id, admitted as a keyframe
+_CANDIDATES = struct.Struct("<qI")  # query id, number of candidates, then ids, dists and yaws
+_SHAPE = struct.Struct("<II")
+
+
+class Op(IntEnum):
+    INSERT_SCAN = 1
+    INSERT_SCAN_CONTEXT = 2
+    QUERY = 3
+    GET_SCAN_CONTEXT = 4
+    STATS = 5
+
+
+class Status(IntEnum):
+    OK = 0
+    ERROR = 1
+    KEY_ERROR = 2
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """A TCP address for "host:port", anything else is the path of a UNIX domain socket."""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return socket.AF_INET, (host or "localhost", int(port))
+    return socket.AF_UNIX, address
+
+
+def _read_message(stream: BinaryIO) -> Optional[Tuple[int, bytes]]:
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    code, size = _HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return code, payload
+
+
+def _pack_matrix(matrix: np.ndarray, dtype, position: Optional[np.ndarray] = None) -> bytes:
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    position = np.full(3, np.nan) if position is None else np.asarray(position, float)
+    return _MATRIX.pack(*matrix.shape, *position) + matrix.tobytes()
+
+
+def _unpack_matrix(payload: bytes, dtype) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    rows, cols, *position = _MATRIX.unpack_from(payload)
+    matrix = np.frombuffer(payload, dtype=dtype, offset=_MATRIX.size).reshape(rows, cols)
+    position = np.asarray(position)
+    return matrix, None if np.isnan(position).any() else position
+
+
+class _Task(NamedTuple):
+    op: Op
+    args: tuple
+    future: Future
+
+
+class ScanContextServer:
+    """Serves one ScanContext database to many clients over a UNIX socket or localhost TCP.
+
+    Every connection gets a reader thread, its requests are handled on a pool of num_threads, which
+    also encodes the scans (natively, without the GIL). Only one worker thread touches the
+    database: it applies the inserts in arrival order and answers all the queries queued in between
+    at once, with a single native pass over the same tree. The batch_window gives concurrent
+    queries some time to join a batch.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        scan_context: Optional[ScanContext] = None,
+        num_threads: int = 8,
+        max_batch_size: int = 64,
+        batch_window: float = 0.0,
+    ):
+        self.scan_context = scan_context if scan_context is not None else ScanContext()
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.latency = LatencyStats("Request latency")
+
+        self._tasks = queue.Queue()
+        # Running aggregates of the batches, updated under _lock
+        self._num_batches = 0
+        self._batch_size_sum = 0
+        self._queue_depth_sum = 0
+        self._queue_depth_max = 0
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+        self._database_worker = threading.Thread(target=self._serve_database, daemon=True)
+
+        family, self._address = parse_address(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self._address)
+        self._socket.listen()
+
+    @property
+    def address(self) -> str:
+        address = self._socket.getsockname()
+        return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else address
+
+    def serve_forever(self) -> None:
+        self._database_worker.start()
+        readers = []
+        with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+            try:
+                while not self._shutdown.is_set():
+                    try:
+                        connection, _ = self._socket.accept()
+                    except OSError:
+                        break  # shut down
+                    with self._lock:
+                        self._connections.add(connection)
+                    reader = threading.Thread(
+                        target=self._handle_connection, args=(connection, pool), daemon=True
+                    )
+                    reader.start()
+                    readers.append(reader)
+            finally:
+                self.shutdown()
+                with self._lock:
+                    for connection in self._connections:
+                        try:
+                            connection.shutdown(socket.SHUT_RDWR)  # wakes up the readers
+                        except OSError:
+                            pass
+                for reader in readers:
+                    reader.join()
+                self._tasks.put(None)
+                self._database_worker.join()
+
+    def shutdown(self) -> None:
+        if self._shutdown.is_set():
+            return
+        self._shutdown.set()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)  # wakes up accept()
+        except OSError:
+            pass
+        self._socket.close()
+        if self._socket.family == socket.AF_UNIX:
+            try:
+                os.unlink(self._address)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "ScanContextServer":
+        self._server_thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._server_thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self._server_thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {f"latency_{metric}": value for metric, value in self.latency.summary().items()}
+        with self._lock:
+            stats["batches"] = self._num_batches
+            if self._num_batches:
+                stats["batch_size_mean"] = self._batch_size_sum / self._num_batches
+                stats["queue_depth_mean"] = self._queue_depth_sum / self._num_batches
+                stats["queue_depth_max"] = self._queue_depth_max
+        if self._database_worker.is_alive():
+            stats["num_keyframes"] = self._submit(Op.STATS).result()
+        else:
+            stats["num_keyframes"] = len(self.scan_context)
+        return {metric: float(value) for metric, value in stats.items()}
+
+    def _submit(self, op: Op, *args) -> Future:
+        future = Future()
+        self._tasks.put(_Task(op, args, future))
+        return future
+
+    def _handle_connection(self, connection: socket.socket, pool: ThreadPoolExecutor) -> None:
+        with connection, connection.makefile("rb") as stream:
+            while (message := _read_message(stream)) is not None:
+                start = time.perf_counter()
+                status, response = pool.submit(self._respond, *message).result()
+                try:
+                    connection.sendall(_HEADER.pack(status, len(response)) + response)
+                except OSError:
+                    break
+                self.latency.record(time.perf_counter() - start)
+        with self._lock:
+            self._connections.discard(connection)
+
+    def _respond(self, op: int, payload: bytes) -> Tuple[Status, bytes]:
+        try:
+            return Status.OK, self._handle_request(Op(op), payload)
+        except KeyError as error:
+            return Status.KEY_ERROR, str(error.args[0]).encode()
+        except Exception as error:
+            return Status.ERROR, f"{type(error).__name__}: {error}".encode()
+
+    def _handle_request(self, op: Op, payload: bytes) -> bytes:
+        if op == Op.INSERT_SCAN:
+            scan, position = _unpack_matrix(payload, np.float32)
+            # Encoded on this thread, only the insertion goes through the database worker. All the
+            # fields are kept, e.g., the intensities for the intensity threshold and encoder
+            scan_context, cartesian = self.scan_context.make_scan_context_and_cartesian(
+                scan.astype(np.float64)
+            )
+            inserted = self._submit(Op.INSERT_SCAN_CONTEXT, scan_context, position, cartesian)
+            return _INSERTED.pack(*inserted.result())
+        if op == Op.INSERT_SCAN_CONTEXT:
+            scan_context, position = _unpack_matrix(payload, np.float64)
+            inserted = self._submit(Op.INSERT_SCAN_CONTEXT, scan_context, position, None)
+            return _INSERTED.pack(*inserted.result())
+        if op == Op.QUERY:
+            query_id, ids, dists, yaws = self._submit(Op.QUERY, *_ID.unpack(payload)).result()
+            return (
+                _CANDIDATES.pack(query_id, len(ids))
+                + ids.astype(np.int64).tobytes()
+                + dists.astype(np.float64).tobytes()
+                + yaws.astype(np.float64).tobytes()
+            )
+        if op == Op.GET_SCAN_CONTEXT:
+            scan_context = self._submit(Op.GET_SCAN_CONTEXT, *_ID.unpack(payload)).result()
+            return _SHAPE.pack(*scan_context.shape) + scan_context.astype(np.float64).tobytes()
+        if op == Op.STATS:
+            return json.dumps(self.stats()).encode()
+        raise ValueError(f"Unknown operation {op}")
+
+    def _serve_database(self) -> None:
+        while (task := self._tasks.get()) is not None:
+            batch = [task]
+            queue_depth = 1 + self._tasks.qsize()
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    task = self._tasks.get(block=timeout > 0, timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if task is None:
+                    self._tasks.put(None)  # stop after this batch
+                    break
+                batch.append(task)
+            with self._lock:
+                self._num_batches += 1
+                self._batch_size_sum += len(batch)
+                self._queue_depth_sum += queue_depth
+                self._queue_depth_max = max(self._queue_depth_max, queue_depth)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Task]) -> None:
+        # The queries between two inserts see the same database, they are answered together
+        queries = []
+        for task in batch:
+            if task.op == Op.QUERY:
+                queries.append(task)
+                continue
+            self._run_queries(queries)
+            queries = []
+            self._run_task(task)
+        self._run_queries(queries)
+
+    def _run_queries(self, queries: List[_Task]) -> None:
+        if not queries:
+            return
+        try:
+            results = self.scan_context.check_for_closures([query.args[0] for query in queries])
+        except Exception as error:
+            for query in queries:
+                query.future.set_exception(error)
+            return
+        for query, result in zip(queries, results):
+            query.future.set_result(result)
+
+    def _run_task(self, task: _Task) -> None:
+        try:
+            if task.op == Op.INSERT_SCAN_CONTEXT:
+                scan_context, position, cartesian = task.args
+                admitted = self.scan_context.add_scan_context(scan_context, position, cartesian)
+                # Every offered scan consumes the next id
+                task.future.set_result((self.scan_context.get_state()[2] - 1, admitted))
+            elif task.op == Op.GET_SCAN_CONTEXT:
+                task.future.set_result(self.scan_context.get_scan_context(*task.args))
+            elif task.op == Op.STATS:
+                task.future.set_result(len(self.scan_context))
+        except Exception as error:
+            task.future.set_exception(error)
+
+
+class ScanContextClient:
+    """Mirrors the ScanContext API for a database served by a ScanContextServer.
+
+    check_for_closure() queries the latest keyframe inserted by this client. A client can be shared
+    between threads, the requests are serialized on its connection.
+    """
+
+    def __init__(self, address: str):
+        family, address = parse_address(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._stream = self._socket.makefile("rb")
+        self._lock = threading.Lock()
+        self._last_keyframe_id = -1
+
+    def process_new_scan(self, scan: np.ndarray, position: Optional[np.ndarray] = None) -> bool:
+        return self._insert(Op.INSERT_SCAN, _pack_matrix(scan, np.float32, position))
+
+    def add_scan_context(
+        self, scan_context: np.ndarray, position: Optional[np.ndarray] = None
+    ) -> bool:
+        payload = _pack_matrix(scan_context, np.float64, position)
+        return self._insert(Op.INSERT_SCAN_CONTEXT, payload)
+
+    def check_for_closure(self) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        if self._last_keyframe_id == -1:
+            return -1, np.zeros(0, int), np.zeros(0), np.zeros(0)
+        return self.query(self._last_keyframe_id)
+
+    def query(self, id: int) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        """Closure candidates of any stored keyframe, see ScanContext.check_for_closures."""
+        response = self._request(Op.QUERY, _ID.pack(id))
+        query_id, num_candidates = _CANDIDATES.unpack_from(response)
+        offset = _CANDIDATES.size
+        ids = np.frombuffer(response, np.int64, num_candidates, offset)
+        dists = np.frombuffer(response, np.float64, num_candidates, offset + 8 * num_candidates)
+        yaws = np.frombuffer(response, np.float64, num_candidates, offset + 16 * num_candidates)
+        return query_id, ids.astype(int), dists.copy(), yaws.copy()
+
+    def get_scan_context(self, id: int) -> np.ndarray:
+        response = self._request(Op.GET_SCAN_CONTEXT, _ID.pack(id))
+        shape = _SHAPE.unpack_from(response)
+        return np.frombuffer(response, np.float64, offset=_SHAPE.size).reshape(shape).copy()
+
+    def stats(self) -> Dict[str, float]:
+        return json.loads(self._request(Op.STATS))
+
+    def close(self) -> None:
+        self._stream.close()
+        self._socket.close()
+
+    def __enter__(self) -> "ScanContextClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return int(self.stats()["num_keyframes"])
+
+    def _insert(self, op: Op, payload: bytes) -> bool:
+        id, admitted = _INSERTED.unpack(self._request(op, payload))
+        if admitted:
+            self._last_keyframe_id = id
+        return admitted
+
+    def _request(self, op: Op, payload: bytes = b"") -> bytes:
+        with self._lock:
+            self._socket.sendall(_HEADER.pack(op, len(payload)) + payload)
+            message = _read_message(self._stream)
+        if message is None:
+            raise ConnectionError("The server closed the connection")
+        status, response = message
+        if status == Status.KEY_ERROR:
+            raise KeyError(response.decode())
+        if status != Status.OK:
+            raise RuntimeError(response.decode())
+        return response
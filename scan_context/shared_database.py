@@ -0,0 +1,202 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import multiprocessing
+import struct
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from pybind.scan_context import ScanContext
+
+# Segment layout: the size of the json header (uint64), the header itself (the ScanContext config
+# and the offset, shape and dtype of every array) and the arrays, each one aligned to 64 bytes. The
+# offsets are relative to the end of the header
+_HEADER_SIZE = struct.Struct("<Q")
+_ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+# Names of the segments created by this process (or the one it was forked from)
+_created = set()
+
+
+def _attach(name: str) -> SharedMemory:
+    # Only the creator tracks the segment: before Python 3.13 attaching registers it too, and the
+    # resource tracker of a process that is not a child of the creator unlinks it at exit. The
+    # children of a process share its tracker, which keeps a single registration per segment
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    shm = SharedMemory(name=name)
+    if name not in _created and multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedDatabase:
+    """The keyframes of a ScanContext in a single shared memory segment, see ScanContextView.
+
+    The descriptors and cartesian grids are stored transposed (i.e., column-major as the native
+    side keeps them) so that the queries read them in place. Attach to an existing segment by name,
+    or create one with export().
+    """
+
+    def __init__(self, name: str):
+        self._shm = _attach(name)
+        self._map_arrays()
+
+    def _map_arrays(self) -> None:
+        (header_size,) = _HEADER_SIZE.unpack_from(self._shm.buf)
+        header_end = _HEADER_SIZE.size + header_size
+        header = json.loads(bytes(self._shm.buf[_HEADER_SIZE.size : header_end]))
+        self.scan_context_config: Dict[str, Any] = header["scan_context_config"]
+        data_offset = _aligned(header_end)
+        self.arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=data_offset + offset)
+            for key, (offset, shape, dtype) in header["arrays"].items()
+        }
+
+    @classmethod
+    def export(
+        cls,
+        scan_context: ScanContext,
+        scan_context_config: Optional[Dict[str, Any]] = None,
+        name: Optional[str] = None,
+    ) -> "SharedDatabase":
+        """Copy all the keyframes of scan_context (built with scan_context_config) to a new segment.
+
+        The caller owns the segment and must close it with unlink=True once the views are done.
+        """
+        ids = scan_context.get_ids()
+        if not len(ids):
+            raise ValueError("There are no keyframes to export")
+        num_rings, num_sectors = scan_context.get_scan_context(ids[0]).shape
+        cartesian = scan_context.get_cartesian(ids[0])
+        cartesians_shape = (len(ids), *cartesian.shape[::-1]) if cartesian is not None else (0,)
+        layout = {
+            "scan_contexts": ((len(ids), num_sectors, num_rings), np.float64),
+            "ring_keys": ((len(ids), num_rings), np.float32),
+            "sector_keys": ((len(ids), num_sectors), np.float64),
+            "cartesians": (cartesians_shape, np.float64),
+            "ids": ((len(ids),), np.uint64),
+        }
+        arrays, size = {}, 0
+        for key, (shape, dtype) in layout.items():
+            arrays[key] = (size, shape, np.dtype(dtype).str)
+            size = _aligned(size + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        header = json.dumps({"scan_context_config": scan_context_config or {}, "arrays": arrays})
+        header_end = _HEADER_SIZE.size + len(header)
+
+        shm = SharedMemory(name=name, create=True, size=_aligned(header_end) + size)
+        _HEADER_SIZE.pack_into(shm.buf, 0, len(header))
+        shm.buf[_HEADER_SIZE.size : header_end] = header.encode()
+        _created.add(shm.name)
+        # The creator keeps its (tracked) handle, unlinked with close(unlink=True)
+        database = cls.__new__(cls)
+        database._shm = shm
+        database._map_arrays()
+        try:
+            scan_context._pipeline._exportDatabase(
+                database.arrays["scan_contexts"],
+                database.arrays["ring_keys"],
+                database.arrays["sector_keys"],
+                database.arrays["cartesians"],
+                database.arrays["ids"],
+            )
+        except BaseException:
+            database.close(unlink=True)
+            raise
+        return database
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __len__(self) -> int:
+        return len(self.arrays["ids"])
+
+    def close(self, unlink: bool = False) -> None:
+        self.arrays = {}
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class ScanContextView:
+    """Read-only queries against a SharedDatabase, e.g., one view per worker of a process pool.
+
+    Attached by name, the descriptors stay in the shared segment and only the ring keys are copied
+    into the tree of this process. The queries never update the database, so several threads can
+    also share a view. A view is pickled as the name of its segment.
+
+    Only the query_database() path is supported: the view holds no keyframes of its own, so
+    check_for_closure(s) and what only applies to them (the sequence_window verification, the
+    admission and eviction of keyframes) are not available. Insert the scans in a ScanContext for
+    those.
+    """
+
+    def __init__(self, name: str):
+        self.database = SharedDatabase(name)
+        self.scan_context = ScanContext(**self.database.scan_context_config)
+        arrays = self.database.arrays
+        # The native side keeps the arrays alive as long as it reads them
+        self.scan_context._pipeline._attachDatabase(
+            arrays["scan_contexts"],
+            arrays["ring_keys"],
+            arrays["sector_keys"],
+            arrays["cartesians"],
+            arrays["ids"],
+        )
+
+    def query(self, scan: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Encode a scan and query it, see ScanContext.query_database."""
+        scan_context, cartesian = self.scan_context.make_scan_context_and_cartesian(scan)
+        return self.scan_context.query_database(scan_context, cartesian)
+
+    def query_database(
+        self, scan_context: np.ndarray, cartesian: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return self.scan_context.query_database(scan_context, cartesian)
+
+    def get_scan_context(self, id: int) -> np.ndarray:
+        return self.scan_context.get_scan_context(id)
+
+    def get_ids(self) -> np.ndarray:
+        return self.database.arrays["ids"].astype(int)
+
+    def __len__(self) -> int:
+        return len(self.database)
+
+    def __reduce__(self):
+        return ScanContextView, (self.database.name,)
+
+    def close(self) -> None:
+        # The native side has to let go of the arrays before the segment can be closed
+        self.scan_context.close()
+        self.scan_context = None
+        self.database.close()
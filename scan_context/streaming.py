@@ -0,0 +1,288 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from pybind.scan_context import ScanContext
+from scan_context.tools.latency import LatencyStats
+
+# Frames sent over a pipe or a socket: uint32 number of points, uint32 number of fields per point,
+# followed by the points as row-major float32 (x, y, z first, then the intensity if any).
+_FRAME_HEADER = struct.Struct("<II")
+
+
+def write_frame(stream: BinaryIO, scan: np.ndarray) -> None:
+    scan = np.ascontiguousarray(scan, dtype=np.float32)
+    stream.write(_FRAME_HEADER.pack(*scan.shape))
+    stream.write(scan.tobytes())
+
+
+def read_frames(stream: BinaryIO) -> Iterator[np.ndarray]:
+    while True:
+        header = stream.read(_FRAME_HEADER.size)
+        if len(header) < _FRAME_HEADER.size:
+            return
+        num_points, num_fields = _FRAME_HEADER.unpack(header)
+        payload = stream.read(4 * num_points * num_fields)
+        if len(payload) < 4 * num_points * num_fields:
+            return
+        points = np.frombuffer(payload, dtype=np.float32).reshape(num_points, num_fields)
+        yield points.astype(np.float64)
+
+
+class DirectorySource:
+    """Yields the scans written to a directory, in name order, as they appear.
+
+    Producers should write to a temporary name (dotfile or .tmp) and rename it once complete.
+    Supported files are raw float32 .bin scans with 4 fields per point (x, y, z, intensity) and
+    .npy arrays. All the fields are kept, i.e., the intensities reach the encoder.
+    """
+
+    SUPPORTED_EXTENSIONS = (".bin", ".npy")
+
+    def __init__(self, directory: str, poll_interval: float = 0.005, idle_timeout: float = 5.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        seen = set()
+        last_scan = time.perf_counter()
+        while time.perf_counter() - last_scan < self.idle_timeout:
+            new_files = sorted(
+                name
+                for name in os.listdir(self.directory)
+                if name not in seen
+                and not name.startswith(".")
+                and name.endswith(self.SUPPORTED_EXTENSIONS)
+            )
+            if not new_files:
+                time.sleep(self.poll_interval)
+                continue
+            for name in new_files:
+                seen.add(name)
+                yield self.read_scan(os.path.join(self.directory, name))
+            last_scan = time.perf_counter()
+
+    @staticmethod
+    def read_scan(file_path: str) -> np.ndarray:
+        if file_path.endswith(".npy"):
+            return np.load(file_path).astype(np.float64)
+        return np.fromfile(file_path, dtype=np.float32).reshape((-1, 4)).astype(np.float64)
+
+
+class FifoSource:
+    """Yields the frames written to a named pipe until the writer closes it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        with open(self.path, "rb") as fifo:
+            yield from read_frames(fifo)
+
+
+class UnixSocketSource:
+    """Accepts a single producer on a UNIX domain socket and yields its frames."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.path)
+            server.listen(1)
+            connection, _ = server.accept()
+            with connection, connection.makefile("rb") as stream:
+                yield from read_frames(stream)
+        os.unlink(self.path)
+
+
+class BackpressurePolicy(str, Enum):
+    block = "block"  # the source waits for room in the queue
+    drop_oldest = "drop-oldest"  # the oldest queued scan makes room for the new one
+    keyframe_skip = "keyframe-skip"  # when full, only every keyframe_stride-th scan gets in
+
+
+class BoundedScanQueue:
+    def __init__(self, maxsize: int, policy: BackpressurePolicy, keyframe_stride: int = 5):
+        self.maxsize = maxsize
+        self.policy = BackpressurePolicy(policy)
+        self.keyframe_stride = keyframe_stride
+        self._items = deque()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, sequence_id: int, item) -> int:
+        """Queue an item, returns the number of scans dropped to do so (or instead of it)."""
+        with self._condition:
+            dropped = 0
+            if self.policy == BackpressurePolicy.block:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._condition.wait()
+            elif len(self._items) >= self.maxsize:
+                is_keyframe = sequence_id % self.keyframe_stride == 0
+                if self.policy == BackpressurePolicy.keyframe_skip and not is_keyframe:
+                    return 1
+                self._items.popleft()
+                dropped = 1
+            self._items.append(item)
+            self._condition.notify_all()
+            return dropped
+
+    def get(self):
+        """Returns the next item, or None once the queue is closed and drained."""
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class StreamClosure(NamedTuple):
+    query_id: int  # sequence number of the scan in the stream
+    candidate_id: int
+    distance: float
+    yaw: float
+
+
+class StreamingScanContext:
+    """Runs ScanContext on a live stream of scans.
+
+    The source is read on the calling thread into a bounded queue. One worker thread encodes the
+    scans, a second one inserts the descriptors and detects closures in arrival order, so encoding
+    the next scan overlaps with querying the previous one. Closures are published through
+    on_closure as soon as they are found, and the end-to-end latency of every scan (from its
+    arrival to the end of its query) is checked against the deadline. An exception in a worker
+    (e.g., a malformed scan or a failing on_closure) stops the run and is raised again by run().
+    """
+
+    def __init__(
+        self,
+        scan_context: Optional[ScanContext] = None,
+        queue_size: int = 4,
+        policy: BackpressurePolicy = BackpressurePolicy.block,
+        keyframe_stride: int = 5,
+        deadline: float = 0.1,
+        threshold: float = 0.4,
+        on_closure: Optional[Callable[[StreamClosure], None]] = None,
+    ):
+        self.scan_context = scan_context if scan_context is not None else ScanContext()
+        self.threshold = threshold
+        self.on_closure = on_closure if on_closure is not None else lambda closure: None
+        self.stats = LatencyStats("End-to-end latency", deadline)
+
+        self._scans = BoundedScanQueue(queue_size, policy, keyframe_stride)
+        self._scan_contexts = queue.Queue(maxsize=queue_size)
+        self._sequence_ids = []  # scan id -> sequence number in the stream
+        self._error: Optional[BaseException] = None
+
+    def run(self, source) -> LatencyStats:
+        workers = [
+            threading.Thread(target=self._encode, daemon=True),
+            threading.Thread(target=self._detect, daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for sequence_id, scan in enumerate(source):
+                if self._error is not None:
+                    break
+                self.stats.count("received")
+                dropped = self._scans.put(sequence_id, (sequence_id, time.perf_counter(), scan))
+                self.stats.count("dropped", dropped)
+        finally:
+            self._scans.close()
+            for worker in workers:
+                worker.join()
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        self._scans.close()  # unblocks the source
+
+    def _encode(self) -> None:
+        try:
+            while self._error is None and (item := self._scans.get()) is not None:
+                sequence_id, arrival_time, scan = item
+                scan_context = self.scan_context.make_scan_context(scan)
+                self._scan_contexts.put((sequence_id, arrival_time, scan_context))
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            self._scan_contexts.put(None)
+
+    def _detect(self) -> None:
+        try:
+            self._detect_closures()
+        except BaseException as error:
+            self._fail(error)
+            # Keep draining so that the encoder can always put its sentinel
+            while self._scan_contexts.get() is not None:
+                pass
+
+    def _detect_closures(self) -> None:
+        while (item := self._scan_contexts.get()) is not None:
+            sequence_id, arrival_time, scan_context = item
+            self._sequence_ids.append(sequence_id)
+            if not self.scan_context.add_scan_context(scan_context):
+                self.stats.count("skipped")
+                self.stats.record(time.perf_counter() - arrival_time)
+                continue
+            (
+                query_idx,
+                candidate_ids,
+                candidate_dists,
+                candidate_yaws,
+            ) = self.scan_context.check_for_closure()
+            if query_idx != -1:
+                for candidate_id, dist, yaw in zip(candidate_ids, candidate_dists, candidate_yaws):
+                    if dist < self.threshold:
+                        self.stats.count("closures")
+                        self.on_closure(
+                            StreamClosure(sequence_id, self._sequence_ids[candidate_id], dist, yaw)
+                        )
+            self.stats.record(time.perf_counter() - arrival_time)
@@ -0,0 +1,226 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import fnmatch
+import glob
+import io
+import json
+import mmap
+import os
+import struct
+import tarfile
+import zipfile
+from typing import BinaryIO, Dict, List, Tuple, Union
+
+import numpy as np
+
+ARCHIVE_EXTENSIONS = (".tar", ".zip")
+COMPRESSED_TAR_EXTENSIONS = (".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_archive(path) -> bool:
+    return os.path.isfile(path) and str(path).lower().endswith(
+        ARCHIVE_EXTENSIONS + COMPRESSED_TAR_EXTENSIONS
+    )
+
+
+class DirectoryFileSource:
+    """Files of a dataset directory, named relative to it."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.name = os.path.basename(os.path.normpath(root))
+
+    def glob(self, pattern: str) -> List[str]:
+        files = glob.glob(os.path.join(self.root, pattern))
+        return sorted(os.path.relpath(file, self.root) for file in files)
+
+    def listdir(self, directory: str) -> List[str]:
+        return os.listdir(os.path.join(self.root, directory))
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.root, name))
+
+    def read_array(self, name: str, dtype) -> np.ndarray:
+        return np.fromfile(os.path.join(self.root, name), dtype=dtype)
+
+    def open(self, name: str) -> BinaryIO:
+        return open(os.path.join(self.root, name), "rb")
+
+    def local_path(self, name: str) -> str:
+        """Where auxiliary files (e.g., the ground truth closures) are read and written."""
+        return os.path.join(self.root, name)
+
+    def loadtxt(self, name: str, **kwargs) -> np.ndarray:
+        return np.loadtxt(self.local_path(name), **kwargs)
+
+
+class ArchiveFileSource:
+    """Files of a dataset packed in an uncompressed tar or a zip archive, read without extraction.
+
+    The member index (name -> data offset, size, compression) is built once and cached next to the
+    archive, or in ~/.cache/scan_context if that is not writable. Stored members are read as slices
+    of a read-only memory map of the archive, deflated zip members through zipfile. When all the
+    members are in a directory named after the archive (e.g., KAIST01/Ouster/... in KAIST01.zip),
+    names are relative to it.
+    Auxiliary files are looked up in the archive first, then in a directory next to it named after
+    the archive (e.g., KAIST01/loop_closure/gt_closures.txt next to KAIST01.zip).
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, archive_path):
+        self.archive_path = os.path.realpath(archive_path)
+        if self.archive_path.lower().endswith(COMPRESSED_TAR_EXTENSIONS):
+            raise ValueError(
+                f"{archive_path} is a compressed tar, its members can not be read without "
+                "decompressing the whole stream. Repack it as an uncompressed .tar or as a .zip"
+            )
+        self.name = self._strip_extension(os.path.basename(self.archive_path))
+        self._members = self._load_index()
+        self._root = self._common_root(self._members, self.name)
+        self._mmap = None
+        self._zip_file = None
+        self._zip_pid = None
+
+    def glob(self, pattern: str) -> List[str]:
+        return sorted(name for name in self._names() if fnmatch.fnmatchcase(name, pattern))
+
+    def listdir(self, directory: str) -> List[str]:
+        prefix = directory.rstrip("/") + "/"
+        return [
+            name[len(prefix) :]
+            for name in self._names()
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]
+        ]
+
+    def exists(self, name: str) -> bool:
+        return self._root + name in self._members or os.path.exists(self.local_path(name))
+
+    def read_array(self, name: str, dtype) -> np.ndarray:
+        """Read-only array over the member, without a copy when it is stored uncompressed."""
+        return np.frombuffer(self._read(name), dtype=dtype)
+
+    def open(self, name: str) -> BinaryIO:
+        if self._root + name not in self._members:
+            return open(self.local_path(name), "rb")
+        return io.BytesIO(self._read(name))
+
+    def local_path(self, name: str) -> str:
+        return os.path.join(os.path.dirname(self.archive_path), self.name, name)
+
+    def loadtxt(self, name: str, **kwargs) -> np.ndarray:
+        with self.open(name) as f:
+            return np.loadtxt(f, **kwargs)
+
+    def _names(self):
+        return (name[len(self._root) :] for name in self._members)
+
+    def _read(self, name: str) -> Union[bytes, memoryview]:
+        try:
+            offset, size, compress_type = self._members[self._root + name]
+        except KeyError:
+            raise FileNotFoundError(f"{name} not found in {self.archive_path}") from None
+        if compress_type == zipfile.ZIP_STORED:
+            if self._mmap is None:
+                # Safe to share with forked processes, a map has no file position
+                with open(self.archive_path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)[offset : offset + size]
+        # A ZipFile has a file position, each (forked) process needs its own
+        if self._zip_pid != os.getpid():
+            self._zip_file = zipfile.ZipFile(self.archive_path)
+            self._zip_pid = os.getpid()
+        return self._zip_file.read(self._root + name)
+
+    def _load_index(self) -> Dict[str, Tuple[int, int, int]]:
+        stat = os.stat(self.archive_path)
+        signature = [self.INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+        index_files = [
+            self.archive_path + ".index.json",
+            os.path.join(
+                os.path.expanduser("~/.cache/scan_context"),
+                f"{os.path.basename(self.archive_path)}.{stat.st_size}.index.json",
+            ),
+        ]
+        for index_file in index_files:
+            if os.path.exists(index_file):
+                with open(index_file, "r") as f:
+                    index = json.load(f)
+                if index["signature"] == signature:
+                    return {name: tuple(member) for name, member in index["members"].items()}
+
+        members = self._build_index()
+        for index_file in index_files:
+            try:
+                os.makedirs(os.path.dirname(index_file), exist_ok=True)
+                with open(index_file + ".tmp", "w") as f:
+                    json.dump({"signature": signature, "members": members}, f)
+                os.replace(index_file + ".tmp", index_file)
+                break
+            except OSError:
+                continue
+        return members
+
+    def _build_index(self) -> Dict[str, Tuple[int, int, int]]:
+        if zipfile.is_zipfile(self.archive_path):
+            return self._build_zip_index()
+        members = {}
+        with tarfile.open(self.archive_path, "r:") as tar:
+            for member in tar:
+                if member.isfile():
+                    name = member.name[2:] if member.name.startswith("./") else member.name
+                    members[name] = (member.offset_data, member.size, zipfile.ZIP_STORED)
+        return members
+
+    def _build_zip_index(self) -> Dict[str, Tuple[int, int, int]]:
+        # The data of a member starts after its local header, whose extra field may differ from
+        # the one in the central directory
+        local_header = struct.Struct("<4s5H3I2H")
+        members = {}
+        with zipfile.ZipFile(self.archive_path) as zip_file, open(self.archive_path, "rb") as f:
+            for info in zip_file.infolist():
+                if info.is_dir():
+                    continue
+                f.seek(info.header_offset)
+                fields = local_header.unpack(f.read(local_header.size))
+                name_length, extra_length = fields[-2:]
+                offset = info.header_offset + local_header.size + name_length + extra_length
+                members[info.filename] = (offset, info.file_size, info.compress_type)
+        return members
+
+    @staticmethod
+    def _common_root(members, archive_name: str) -> str:
+        root = archive_name + "/"
+        return root if all(name.startswith(root) for name in members) else ""
+
+    @staticmethod
+    def _strip_extension(file_name: str) -> str:
+        for extension in COMPRESSED_TAR_EXTENSIONS + ARCHIVE_EXTENSIONS:
+            if file_name.lower().endswith(extension):
+                return file_name[: -len(extension)]
+        return file_name
+
+
+def open_file_source(path) -> Union[DirectoryFileSource, ArchiveFileSource]:
+    if is_archive(path):
+        return ArchiveFileSource(path)
+    return DirectoryFileSource(path)
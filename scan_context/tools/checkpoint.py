@@ -0,0 +1,187 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CheckpointState:
+    last_frame: int
+    state: Tuple[int, int, int]
+    scan_contexts: Dict[int, np.ndarray] = field(default_factory=dict)  # by keyframe id
+    last_matched: Dict[int, int] = field(default_factory=dict)
+    cartesians: Dict[int, np.ndarray] = field(default_factory=dict)  # if estimate_translation
+    closures: List[np.ndarray] = field(default_factory=list)
+    results: List[np.ndarray] = field(default_factory=list)
+
+
+class PipelineCheckpoint:
+    """Append-only checkpoints of a ScanContextPipeline run.
+
+    Every checkpoint only stores what changed since the previous one (new, evicted and recently
+    matched keyframes, closures and PipelineResults entries) as a numbered delta file. The manifest
+    is replaced atomically after the delta is on disk, so a job killed mid-write resumes from the
+    previous checkpoint. Writes happen on a background thread to not stall the main loop.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, checkpoint_dir: str, dataset_name: str):
+        self.checkpoint_dir = checkpoint_dir
+        self.dataset_name = dataset_name
+        self.num_deltas = 0
+        self._last_id = -1
+        self._live_ids = set()
+        self._num_scans_seen = 0
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def load(self) -> Optional[CheckpointState]:
+        manifest_file = os.path.join(self.checkpoint_dir, self.MANIFEST)
+        if not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        if manifest["dataset_name"] != self.dataset_name:
+            raise ValueError(
+                f"Checkpoint in {self.checkpoint_dir} belongs to {manifest['dataset_name']}, "
+                f"not to {self.dataset_name}"
+            )
+
+        state = CheckpointState(manifest["last_frame"], tuple(manifest["state"]))
+        # Deltas beyond the manifest count are leftovers of an interrupted write, ignore them
+        for delta_idx in range(manifest["num_deltas"]):
+            with np.load(self._delta_file(delta_idx)) as delta:
+                state.scan_contexts.update(zip(delta["ids"].tolist(), delta["scan_contexts"]))
+                if len(delta["cartesians"]):
+                    state.cartesians.update(zip(delta["ids"].tolist(), delta["cartesians"]))
+                state.last_matched.update(
+                    zip(delta["matched_ids"].tolist(), delta["matched_stamps"].tolist())
+                )
+                for evicted_id in delta["evicted_ids"].tolist():
+                    del state.scan_contexts[evicted_id]
+                    del state.last_matched[evicted_id]
+                    state.cartesians.pop(evicted_id, None)
+                state.closures.extend(delta["closures"])
+                state.results.extend(delta["results"])
+        self.num_deltas = manifest["num_deltas"]
+        self._live_ids = set(state.scan_contexts)
+        self._last_id = max(self._live_ids, default=-1)
+        self._num_scans_seen = state.state[2]
+        return state
+
+    def save(
+        self,
+        last_frame: int,
+        scan_context,
+        closures: List[np.ndarray],
+        results: List[np.ndarray],
+    ) -> None:
+        """Queue a delta holding everything appended after the previous checkpoint."""
+        ids = scan_context.get_ids()
+        new_ids = ids[ids > self._last_id]
+        new_scan_contexts = np.asarray([scan_context.get_scan_context(id) for id in new_ids])
+        new_cartesians = [scan_context.get_cartesian(id) for id in new_ids]
+        if any(cartesian is None for cartesian in new_cartesians):
+            new_cartesians = []
+        new_cartesians = np.asarray(new_cartesians)
+        live_ids = set(ids.tolist())
+        evicted_ids = np.asarray(sorted(self._live_ids - live_ids), dtype=int)
+        # The stamps only grow, the ones not older than the previous checkpoint have changed
+        last_matched = scan_context.get_last_matched()
+        matched = last_matched >= self._num_scans_seen
+        state = [int(value) for value in scan_context.get_state()]
+        manifest = {
+            "dataset_name": self.dataset_name,
+            "num_deltas": self.num_deltas + 1,
+            "last_frame": int(last_frame),
+            "state": state,
+        }
+        self.wait()
+        self._pending = self._writer.submit(
+            self._write_delta,
+            self.num_deltas,
+            new_ids,
+            new_scan_contexts,
+            new_cartesians,
+            evicted_ids,
+            ids[matched],
+            last_matched[matched],
+            np.asarray(closures, dtype=np.float64).reshape(-1, 18),
+            np.asarray(results, dtype=np.float64).reshape(-1, 3),
+            manifest,
+        )
+        self.num_deltas += 1
+        self._live_ids = live_ids
+        self._last_id = max(self._last_id, int(ids[-1]) if len(ids) else -1)
+        self._num_scans_seen = state[2]
+
+    def wait(self) -> None:
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def close(self) -> None:
+        self.wait()
+        self._writer.shutdown()
+
+    def _delta_file(self, delta_idx: int) -> str:
+        return os.path.join(self.checkpoint_dir, f"delta_{delta_idx:06d}.npz")
+
+    def _write_delta(
+        self,
+        delta_idx,
+        ids,
+        scan_contexts,
+        cartesians,
+        evicted_ids,
+        matched_ids,
+        matched_stamps,
+        closures,
+        results,
+        manifest,
+    ) -> None:
+        delta_file = self._delta_file(delta_idx)
+        with open(delta_file + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                ids=ids,
+                scan_contexts=scan_contexts,
+                cartesians=cartesians,
+                evicted_ids=evicted_ids,
+                matched_ids=matched_ids,
+                matched_stamps=matched_stamps,
+                closures=closures,
+                results=results,
+            )
+        os.replace(delta_file + ".tmp", delta_file)
+
+        manifest_file = os.path.join(self.checkpoint_dir, self.MANIFEST)
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_file + ".tmp", manifest_file)
@@ -87,6 +87,47 @@ def scan_context_pipeline(
         "-v",
         rich_help_panel="Additional Options",
     ),
+    visualization_output: Optional[str] = typer.Option(
+        None,
+        "--visualization-output",
+        show_default=False,
+        help="[Optional] Write the detected closures to a video (.mp4, .avi) or to an image file "
+        "holding the latest one, e.g., on a headless server",
+        rich_help_panel="Additional Options",
+    ),
+    num_workers: int = typer.Option(
+        0,
+        "--num-workers",
+        "-j",
+        help="[Optional] Encode all the scans on N processes first, then run the queries in order "
+        "(0 encodes and queries each scan in turn)",
+        rich_help_panel="Additional Options",
+    ),
+    checkpoint_period: int = typer.Option(
+        0,
+        "--checkpoint-period",
+        help="[Optional] Write an incremental checkpoint every N frames (0 disables it)",
+        rich_help_panel="Additional Options",
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="[Optional] Continue from the latest checkpoint stored in the results directory",
+        rich_help_panel="Additional Options",
+    ),
+    sequence_window: int = typer.Option(
+        0,
+        "--sequence-window",
+        help="[Optional] Reject the closures whose N previous keyframes do not match the ones "
+        "around the candidate (0 disables it)",
+        rich_help_panel="Additional Options",
+    ),
+    sequence_threshold: float = typer.Option(
+        0.4,
+        "--sequence-threshold",
+        help="[Optional] Max mean scan context distance over the --sequence-window keyframes",
+        rich_help_panel="Additional Options",
+    ),
 ):
     # Lazy-loading for faster CLI
     from scan_context.datasets import dataset_factory
@@ -101,6 +142,14 @@ def scan_context_pipeline(
         ),
         results_dir=results_dir,
         visualize=visualize,
+        visualization_output=visualization_output,
+        checkpoint_period=checkpoint_period,
+        resume=resume,
+        scan_context_config={
+            "sequence_window": sequence_window,
+            "sequence_dist_threshold": sequence_threshold,
+        },
+        num_workers=num_workers,
     ).run().print()
 
 
@@ -0,0 +1,163 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.transform import Rotation
+from tqdm.auto import tqdm
+
+
+def _read_pose_table(poses_file: str) -> np.ndarray:
+    with open(poses_file, "r") as f:
+        delimiter = "," if "," in f.readline() else None
+    return np.atleast_2d(np.loadtxt(poses_file, delimiter=delimiter, comments="#"))
+
+
+def load_poses(poses_file: str) -> np.ndarray:
+    """Read a pose file as Nx4x4 transformations, the format is told by the number of columns.
+
+    3: x y z, 4: t x y z, 8: t x y z qx qy qz qw (TUM), 12: 3x4 row-major (KITTI), 13: t + 3x4,
+    16: 4x4 row-major. Comma or whitespace separated, lines starting with # are skipped.
+    """
+    data = _read_pose_table(poses_file)
+    poses = np.tile(np.eye(4), (len(data), 1, 1))
+    num_cols = data.shape[1]
+    if num_cols in (3, 4):
+        poses[:, :3, 3] = data[:, -3:]
+    elif num_cols == 8:
+        poses[:, :3, :3] = Rotation.from_quat(data[:, 4:]).as_matrix()
+        poses[:, :3, 3] = data[:, 1:4]
+    elif num_cols in (12, 13):
+        poses[:, :3, :] = data[:, -12:].reshape(-1, 3, 4)
+    elif num_cols == 16:
+        poses = data.reshape(-1, 4, 4)
+    else:
+        raise ValueError(f"Unsupported pose file {poses_file} with {num_cols} columns")
+    return poses
+
+
+def load_timestamps(poses_file: str) -> Optional[np.ndarray]:
+    """The first column of a pose file with 4, 8 or 13 columns, None for the untimed formats."""
+    data = _read_pose_table(poses_file)
+    return data[:, 0] if data.shape[1] in (4, 8, 13) else None
+
+
+def radius_closures(
+    positions: np.ndarray,
+    radius: float,
+    min_index_gap: int,
+    chunk_size: int = 8192,
+    num_workers: int = -1,
+    timestamps: Optional[np.ndarray] = None,
+    min_time_gap: float = 0.0,
+) -> np.ndarray:
+    """All the (i, j) pairs with j >= i + min_index_gap closer than radius, sorted by i then j.
+
+    With timestamps, the pairs must also be at least min_time_gap apart in time, so a robot
+    standing still does not close loops with itself whatever the frame rate.
+
+    The KD-tree is queried in chunks, each one on num_workers threads, so the memory stays
+    bounded by the neighbors of a chunk instead of the N^2 distance matrix.
+    """
+    tree = cKDTree(positions)
+    closures = []
+    for first in range(0, len(positions), chunk_size):
+        neighbors = tree.query_ball_point(
+            positions[first : first + chunk_size], r=radius, workers=num_workers
+        )
+        num_neighbors = np.fromiter(map(len, neighbors), dtype=int, count=len(neighbors))
+        if num_neighbors.sum() == 0:
+            continue
+        queries = np.repeat(np.arange(first, first + len(neighbors)), num_neighbors)
+        candidates = np.concatenate([np.asarray(idx, dtype=int) for idx in neighbors])
+        keep = candidates >= queries + min_index_gap
+        if timestamps is not None:
+            keep &= np.abs(timestamps[candidates] - timestamps[queries]) >= min_time_gap
+        closures.append(np.c_[queries[keep], candidates[keep]])
+    if not closures:
+        return np.empty((0, 2), dtype=int)
+    closures = np.concatenate(closures)
+    return closures[np.lexsort((closures[:, 1], closures[:, 0]))]
+
+
+# Per-process state of the overlap workers, set up by _init_overlap_worker
+_worker_voxelize = None
+
+
+def _voxelize_scan(dataset, poses, voxel_size, idx) -> np.ndarray:
+    """Sorted unique keys of the voxels occupied by a scan, in the world frame."""
+    points = dataset[idx][:, :3] @ poses[idx, :3, :3].T + poses[idx, :3, 3]
+    voxels = np.floor(points / voxel_size).astype(np.int64) + (1 << 20)
+    # 21 bits per axis are enough for +-1e6 voxels
+    return np.unique((voxels[:, 0] << 42) | (voxels[:, 1] << 21) | voxels[:, 2])
+
+
+def _init_overlap_worker(dataloader, data_dir, sequence, poses, voxel_size, cache_size):
+    global _worker_voxelize
+    from scan_context.datasets import dataset_factory
+
+    dataset = dataset_factory(dataloader=dataloader, data_dir=data_dir, sequence=sequence)
+    # Closures come sorted by query, the scans of a chunk are mostly shared
+    _worker_voxelize = functools.lru_cache(maxsize=cache_size)(
+        functools.partial(_voxelize_scan, dataset, poses, voxel_size)
+    )
+
+
+def _chunk_overlaps(closures: np.ndarray) -> np.ndarray:
+    overlaps = np.empty(len(closures))
+    for closure_idx, (scan_i, scan_j) in enumerate(closures):
+        voxels_i, voxels_j = _worker_voxelize(scan_i), _worker_voxelize(scan_j)
+        num_common = len(np.intersect1d(voxels_i, voxels_j, assume_unique=True))
+        overlaps[closure_idx] = num_common / max(min(len(voxels_i), len(voxels_j)), 1)
+    return overlaps
+
+
+def compute_overlaps(
+    closures: np.ndarray,
+    dataloader: str,
+    data_dir: str,
+    sequence: Optional[str],
+    poses: np.ndarray,
+    voxel_size: float = 0.5,
+    num_workers: Optional[int] = None,
+    chunk_size: int = 256,
+    cache_size: int = 512,
+) -> np.ndarray:
+    """Share of the voxels of the smaller scan also occupied by the other one, for each closure."""
+    chunks = [closures[first : first + chunk_size] for first in range(0, len(closures), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_overlap_worker,
+        initargs=(dataloader, data_dir, sequence, poses, voxel_size, cache_size),
+    ) as executor:
+        overlaps = list(
+            tqdm(
+                executor.map(_chunk_overlaps, chunks),
+                total=len(chunks),
+                unit=" chunks",
+                dynamic_ncols=True,
+            )
+        )
+    return np.concatenate(overlaps) if overlaps else np.empty(0)
@@ -0,0 +1,165 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from scan_context.datasets import available_dataloaders
+from scan_context.tools.cmd import name_callback
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+docstring = """
+:ScanContext: ground truth closures from poses\n
+\b
+[bold green]Examples: [/bold green]
+# Scans closer than 10 m and at least 100 frames apart, from a KITTI-style pose file
+$ scan_context_gt --poses-file poses.txt --radius 10 <path-to-sequence>:open_file_folder:
+# Use the poses of the dataloader, and keep the pairs sharing half of their voxels
+$ scan_context_gt --dataloader nclt --overlap-threshold 0.5 <path-to-nclt-sequence>
+"""
+
+
+@app.command(help=docstring)
+def scan_context_gt(
+    data: Path = typer.Argument(
+        ...,
+        help="The data directory used by the specified dataloader",
+        show_default=False,
+    ),
+    dataloader: str = typer.Option(
+        None,
+        show_default=False,
+        case_sensitive=False,
+        autocompletion=available_dataloaders,
+        callback=name_callback,
+        help="[Optional] Dataloader providing the poses and, for the overlap check, the scans",
+    ),
+    sequence: Optional[str] = typer.Option(
+        None,
+        "--sequence",
+        "-s",
+        show_default=False,
+        help="[Optional] For some dataloaders, you need to specify a given sequence",
+    ),
+    poses_file: Optional[Path] = typer.Option(
+        None,
+        "--poses-file",
+        show_default=False,
+        help="[Optional] One pose per scan, instead of the poses of the dataloader",
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        "-o",
+        show_default=False,
+        help="[Optional] Defaults to <data>/loop_closure/gt_closures.txt (next to an archive, in "
+        "a directory named after it)",
+    ),
+    radius: float = typer.Option(10.0, help="Maximum distance between the scan positions [m]"),
+    min_index_gap: int = typer.Option(100, help="Minimum number of frames between the scans"),
+    min_time_gap: float = typer.Option(
+        0.0,
+        help="Minimum time between the scans [s], read from the first column of the pose file "
+        "or from the timestamps of the dataloader (0 disables the check)",
+    ),
+    timestamp_scale: float = typer.Option(
+        1.0, help="Seconds per timestamp unit, e.g. 1e-6 for the microseconds of NCLT"
+    ),
+    overlap_threshold: float = typer.Option(
+        0.0,
+        help="Minimum share of common voxels between the scans (0 disables the check)",
+        rich_help_panel="Overlap Check",
+    ),
+    voxel_size: float = typer.Option(0.5, rich_help_panel="Overlap Check"),
+    num_workers: Optional[int] = typer.Option(
+        None,
+        show_default=False,
+        help="[Optional] Number of processes, defaults to the number of CPUs",
+        rich_help_panel="Overlap Check",
+    ),
+):
+    # Lazy-loading for faster CLI
+    import numpy as np
+
+    from scan_context.datasets import dataset_factory
+    from scan_context.tools.archive import open_file_source
+    from scan_context.tools.gt_closures import (
+        compute_overlaps,
+        load_poses,
+        load_timestamps,
+        radius_closures,
+    )
+
+    if poses_file is None and dataloader is None:
+        raise typer.BadParameter("Either --poses-file or --dataloader is required")
+    if overlap_threshold > 0 and dataloader is None:
+        raise typer.BadParameter("The overlap check reads the scans, --dataloader is required")
+
+    dataset = None
+    if dataloader is not None:
+        dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+    if poses_file is not None:
+        poses = load_poses(str(poses_file))
+    elif hasattr(dataset, "gt_poses"):
+        poses = dataset.gt_poses
+    else:
+        raise typer.BadParameter(f"The {dataloader} dataloader has no poses, use --poses-file")
+    if dataset is not None and len(poses) != len(dataset):
+        raise typer.BadParameter(f"{len(poses)} poses for {len(dataset)} scans")
+
+    timestamps = None
+    if min_time_gap > 0:
+        if poses_file is not None:
+            timestamps = load_timestamps(str(poses_file))
+        elif hasattr(dataset, "timestamps"):
+            timestamps = np.asarray(dataset.timestamps, dtype=np.float64)
+        if timestamps is None:
+            raise typer.BadParameter(
+                "--min-time-gap needs a pose file with a time column or a dataloader with "
+                "timestamps"
+            )
+        timestamps = timestamps * timestamp_scale
+
+    closures = radius_closures(
+        poses[:, :3, 3], radius, min_index_gap, timestamps=timestamps, min_time_gap=min_time_gap
+    )
+    time_gap = f" and {min_time_gap} s" if timestamps is not None else ""
+    print(f"{len(closures)} pairs within {radius} m and {min_index_gap} frames{time_gap} apart")
+    if overlap_threshold > 0 and len(closures):
+        overlaps = compute_overlaps(
+            closures, dataloader, str(data), sequence, poses, voxel_size, num_workers
+        )
+        closures = closures[overlaps >= overlap_threshold]
+        print(f"{len(closures)} pairs with an overlap of at least {overlap_threshold}")
+
+    if output is None:
+        output = open_file_source(data).local_path(os.path.join("loop_closure", "gt_closures.txt"))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    np.savetxt(output, closures, fmt="%d")
+    print(f"Ground truth closures written to {output}")
+
+
+def run():
+    app()
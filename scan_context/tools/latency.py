@@ -0,0 +1,93 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+
+class LatencyStats:
+    """Thread-safe collection of per-item latencies, checked against an optional deadline.
+
+    The count, the maximum and the deadline misses cover every item, the percentiles only the last
+    window ones, so a long-running process keeps a bounded memory and summary() a bounded cost.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, name: str, deadline: Optional[float] = None, window: int = 10000) -> None:
+        self._name = name
+        self._deadline = deadline
+        self._latencies = deque(maxlen=window)
+        self._num_latencies = 0
+        self._max_latency = 0.0
+        self._deadline_misses = 0
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._num_latencies += 1
+            self._max_latency = max(self._max_latency, latency)
+            if self._deadline is not None and latency > self._deadline:
+                self._deadline_misses += 1
+
+    def count(self, counter: str, increment: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + increment
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = np.asarray(self._latencies)
+            num_latencies = self._num_latencies
+            max_latency = self._max_latency
+            deadline_misses = self._deadline_misses
+            counters = dict(self._counters)
+        summary = {"count": num_latencies}
+        if num_latencies:
+            for percentile in self.PERCENTILES:
+                summary[f"p{percentile}"] = np.percentile(latencies, percentile)
+            summary["max"] = max_latency
+            if self._deadline is not None:
+                summary["deadline_misses"] = deadline_misses
+        summary.update(counters)
+        return summary
+
+    def _rich_table(self, table_format: box.Box = box.HORIZONTALS) -> Table:
+        table = Table(box=table_format, title=self._name)
+        if self._deadline is not None:
+            table.caption = f"Deadline: {1e3 * self._deadline:.1f} ms"
+        table.add_column("Metric", justify="center", style="cyan")
+        table.add_column("Value", justify="left", style="green")
+        for metric, value in self.summary().items():
+            is_latency = metric.startswith("p") or metric == "max"
+            table.add_row(metric, f"{1e3 * value:.2f} ms" if is_latency else f"{value}")
+        return table
+
+    def log_to_console(self) -> None:
+        console = Console()
+        console.print(self._rich_table())
@@ -0,0 +1,147 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+from scan_context.datasets import available_dataloaders
+from scan_context.tools.cmd import name_callback
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+docstring = """
+:ScanContext: place recognition across sessions\n
+\b
+[bold green]Examples: [/bold green]
+# Build a database from two reference sequences, save it and query a third one against it
+$ scan_context_multi_session --dataloader mulran -r <path-to-ref-1> -r <path-to-ref-2> --database refs.npz --gt-closures gt.txt <path-to-query>:open_file_folder: <results-dir>
+# Reuse the saved database for another query session, on 8 threads
+$ scan_context_multi_session --dataloader mulran --database refs.npz -j 8 <path-to-query> <results-dir>
+"""
+
+
+@app.command(help=docstring)
+def scan_context_multi_session(
+    data: Path = typer.Argument(
+        ...,
+        help="The data directory of the query session, used by the specified dataloader",
+        show_default=False,
+    ),
+    results_dir: Path = typer.Argument(
+        ...,
+        help="The path where results are to be stored",
+        show_default=False,
+        exists=False,
+    ),
+    dataloader: str = typer.Option(
+        None,
+        show_default=False,
+        case_sensitive=False,
+        autocompletion=available_dataloaders,
+        callback=name_callback,
+        help="[Optional] Use a specific dataloader from those supported",
+    ),
+    sequence: Optional[str] = typer.Option(
+        None,
+        "--sequence",
+        "-s",
+        show_default=False,
+        help="[Optional] For some dataloaders, you need to specify a given sequence",
+    ),
+    references: Optional[List[Path]] = typer.Option(
+        None,
+        "--reference",
+        "-r",
+        show_default=False,
+        help="Data directory of a reference session (repeat it for several), read with the same "
+        "dataloader",
+    ),
+    reference_sequences: Optional[List[str]] = typer.Option(
+        None,
+        "--reference-sequence",
+        show_default=False,
+        help="[Optional] Sequence of each reference session, in the order of --reference",
+    ),
+    database: Optional[Path] = typer.Option(
+        None,
+        "--database",
+        "-d",
+        show_default=False,
+        help="Reference database file (.npz): loaded if no --reference is given, otherwise the "
+        "database built from the references is saved there",
+    ),
+    gt_closures: Optional[Path] = typer.Option(
+        None,
+        "--gt-closures",
+        show_default=False,
+        help="[Optional] Cross-session ground truth: rows of query frame, (reference session,) "
+        "reference frame",
+    ),
+    num_workers: int = typer.Option(
+        0,
+        "--num-workers",
+        "-j",
+        help="[Optional] Encode the references on N processes and query on N threads",
+    ),
+):
+    # Lazy-loading for faster CLI
+    from scan_context.datasets import dataset_factory
+    from scan_context.multi_session import (
+        MultiSessionPipeline,
+        ReferenceDatabase,
+        load_cross_session_closures,
+    )
+
+    if references:
+        reference_sequences = reference_sequences or [None] * len(references)
+        if len(reference_sequences) != len(references):
+            raise typer.BadParameter("Give one --reference-sequence per --reference")
+        reference_datasets = [
+            dataset_factory(
+                dataloader=dataloader, data_dir=reference_data, sequence=reference_sequence
+            )
+            for reference_data, reference_sequence in zip(references, reference_sequences)
+        ]
+        reference = ReferenceDatabase(getattr(reference_datasets[0], "scan_context_config", None))
+        for reference_dataset in reference_datasets:
+            reference.add_session(reference_dataset, num_workers=num_workers)
+        if database is not None:
+            reference.save(database)
+    elif database is not None:
+        reference = ReferenceDatabase.load(database)
+    else:
+        raise typer.BadParameter("Give the reference sessions (--reference) or a --database")
+
+    MultiSessionPipeline(
+        reference=reference,
+        dataset=dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence),
+        results_dir=results_dir,
+        gt_closures=(
+            load_cross_session_closures(gt_closures, reference) if gt_closures is not None else None
+        ),
+        num_workers=num_workers,
+    ).run().print()
+
+
+def run():
+    app()
@@ -0,0 +1,148 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from pybind.scan_context import ScanContext
+
+
+class SharedScanContexts:
+    """Descriptors of the frames [first, last) in a shared memory block, indexed by frame."""
+
+    def __init__(self, first: int, last: int, shape, name: Optional[str] = None):
+        self.first = first
+        self.last = last
+        self.shape = (last - first, *shape)
+        size = int(np.prod(self.shape)) * np.dtype(np.float64).itemsize
+        self._shm = SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self._shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __getitem__(self, frame_idx: int) -> np.ndarray:
+        return self.array[frame_idx - self.first]
+
+    def __setitem__(self, frame_idx: int, scan_context: np.ndarray) -> None:
+        self.array[frame_idx - self.first] = scan_context
+
+    def close(self, unlink: bool = False) -> None:
+        del self.array
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+# Per-process state of the encoding workers, set up by _init_encoding_worker
+_worker_state = None
+
+
+def _init_encoding_worker(
+    dataset, scan_context_config, first, last, shape, shm_name, cartesian_shape, cartesian_shm_name
+):
+    global _worker_state
+    # Forked, the dataset is inherited instead of pickled
+    _worker_state = (
+        dataset,
+        ScanContext(**scan_context_config),
+        SharedScanContexts(first, last, shape, shm_name),
+        SharedScanContexts(first, last, cartesian_shape, cartesian_shm_name)
+        if cartesian_shm_name is not None
+        else None,
+    )
+
+
+def _encode_chunk(frame_range) -> int:
+    dataset, scan_context, scan_contexts, cartesians = _worker_state
+    for frame_idx in range(*frame_range):
+        if cartesians is None:
+            scan_contexts[frame_idx] = scan_context.make_scan_context(dataset[frame_idx])
+            continue
+        (
+            scan_contexts[frame_idx],
+            cartesians[frame_idx],
+        ) = scan_context.make_scan_context_and_cartesian(dataset[frame_idx])
+    return frame_range[1] - frame_range[0]
+
+
+def encode_scans(
+    dataset,
+    first: int,
+    last: int,
+    scan_context_config: Optional[Dict[str, Any]] = None,
+    num_workers: Optional[int] = None,
+    chunk_size: int = 64,
+) -> Tuple[SharedScanContexts, Optional[SharedScanContexts]]:
+    """Read and encode the scans [first, last) on a pool of forked processes.
+
+    The workers write the descriptors (and the cartesian grids if estimate_translation is set)
+    straight into shared memory, only the frame ranges and their sizes go through pipes. The caller
+    owns the results and must close them with unlink=True. The first scan is encoded here to size
+    the blocks, the workers encode the rest.
+    """
+    scan_context_config = scan_context_config or {}
+    scan_context, cartesian = ScanContext(**scan_context_config).make_scan_context_and_cartesian(
+        dataset[first]
+    )
+    shape = scan_context.shape
+    scan_contexts = SharedScanContexts(first, last, shape)
+    cartesian_shape = cartesian.shape if cartesian is not None else None
+    cartesians = SharedScanContexts(first, last, cartesian_shape) if cartesian is not None else None
+    scan_contexts[first] = scan_context
+    if cartesians is not None:
+        cartesians[first] = cartesian
+    frame_ranges = [
+        (chunk_first, min(chunk_first + chunk_size, last))
+        for chunk_first in range(first + 1, last, chunk_size)
+    ]
+    try:
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_encoding_worker,
+            initargs=(
+                dataset,
+                scan_context_config,
+                first,
+                last,
+                shape,
+                scan_contexts.name,
+                cartesian_shape,
+                cartesians.name if cartesians is not None else None,
+            ),
+        ) as executor, tqdm(
+            total=last - first, initial=1, unit=" frames", dynamic_ncols=True, desc="Encoding"
+        ) as progress_bar:
+            for num_encoded in executor.map(_encode_chunk, frame_ranges):
+                progress_bar.update(num_encoded)
+    except BaseException:
+        scan_contexts.close(unlink=True)
+        if cartesians is not None:
+            cartesians.close(unlink=True)
+        raise
+    return scan_contexts, cartesians
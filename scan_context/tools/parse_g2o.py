@@ -1,12 +1,15 @@
 #!/bin/python3
 import copy
+import functools
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
 
 import numpy as np
 import open3d as o3d
 import typer
-from matplotlib import pyplot as plt
 from kiss_icp.datasets.generic import GenericDataset
+from matplotlib import pyplot as plt
 from pgo.pose_graph_optimizer import PoseGraphOptimizer
 
 
@@ -82,11 +85,12 @@ def ransac(source_down, target_down, source_fpfh, target_fpfh, voxel_size):
     return result
 
 
-def gicp(source, target, initial_guess, voxel_size):
+def gicp(source, target, initial_guess, voxel_size, verbose=True):
     distance_threshold = voxel_size * 0.4
-    print(":: GICP registration is applied on original point")
-    print("   clouds to refine the alignment. This time we use a strict")
-    print("   distance threshold %.3f." % distance_threshold)
+    if verbose:
+        print(":: GICP registration is applied on original point")
+        print("   clouds to refine the alignment. This time we use a strict")
+        print("   distance threshold %.3f." % distance_threshold)
     result = o3d.pipelines.registration.registration_generalized_icp(
         source,
         target,
@@ -108,9 +112,80 @@ def global_registration(source, target, voxel_size):
         return False, np.eye(4)
 
 
-def main(data_dir: str = typer.Argument(""), gt_poses_file: str = typer.Argument(""), closure_dir: str = typer.Argument("")):
+# Per-process state of the closure verification workers, set up by _init_verification_worker
+_worker_load_scan = None
+_worker_config = None
+
+
+def _load_downsampled_scan(dataset, downsample_voxel_size, idx):
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(dataset[idx][:, :3]))
+    if downsample_voxel_size > 0:
+        pcd = pcd.voxel_down_sample(downsample_voxel_size)
+    return pcd
+
+
+def _init_verification_worker(data_dir, downsample_voxel_size, cache_size, voxel_size, fitness):
+    global _worker_load_scan, _worker_config
+    # Each worker keeps its own LRU cache, verify_closures groups the closures by scan so that the
+    # ones sharing a scan mostly land in the same chunk
+    _worker_load_scan = functools.lru_cache(maxsize=cache_size)(
+        functools.partial(_load_downsampled_scan, GenericDataset(data_dir), downsample_voxel_size)
+    )
+    _worker_config = (voxel_size, fitness)
+
+
+def _verify_closure(closure) -> Optional[Tuple[int, int, np.ndarray]]:
+    voxel_size, fitness = _worker_config
+    scan_i, scan_j, initial_guess = closure
+    estimate = gicp(
+        _worker_load_scan(scan_i), _worker_load_scan(scan_j), initial_guess, voxel_size, False
+    )
+    if estimate.fitness > fitness:
+        return scan_i, scan_j, np.asarray(estimate.transformation)
+    return None
+
+
+def verify_closures(
+    data_dir: str,
+    closures: np.ndarray,
+    voxel_size: float = 1.0,
+    fitness: float = 0.5,
+    downsample_voxel_size: float = 0.0,
+    num_workers: Optional[int] = None,
+    cache_size: int = 256,
+    chunksize: int = 16,
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """Run GICP on every candidate closure in parallel and yield the accepted ones.
+
+    closures holds one row per candidate as written by ScanContextPipeline, i.e. the two scan
+    indices followed by the flattened 4x4 initial guess. The closures are verified sorted by
+    scan_i (then scan_j), so that the chunks of a worker share scans and hit its cache, and the
+    accepted ones are yielded as (scan_i, scan_j, transformation) in that order. The scans are
+    only downsampled before GICP if downsample_voxel_size is positive.
+    """
+    closures = np.asarray(closures).reshape(-1, 18)
+    closures = closures[np.lexsort((closures[:, 1], closures[:, 0]))]
+    tasks = [(int(ids[0]), int(ids[1]), ids[2:].reshape(4, 4)) for ids in closures]
+    initargs = (data_dir, downsample_voxel_size, cache_size, voxel_size, fitness)
+    with ProcessPoolExecutor(
+        num_workers, initializer=_init_verification_worker, initargs=initargs
+    ) as pool:
+        for result in pool.map(_verify_closure, tasks, chunksize=chunksize):
+            if result is not None:
+                yield result
+
+
+def main(
+    data_dir: str = typer.Argument(""),
+    gt_poses_file: str = typer.Argument(""),
+    closure_dir: str = typer.Argument(""),
+    num_workers: Optional[int] = typer.Option(None, help="Number of GICP worker processes"),
+    cache_size: int = typer.Option(256, help="Downsampled scans cached per worker"),
+    downsample_voxel_size: float = typer.Option(
+        0.0, help="Voxel size of the cached scans, 0 keeps all the points"
+    ),
+):
     optimizer = PoseGraphOptimizer()
-    dataset = GenericDataset(data_dir)
     # Load poses and add them to the graph with the odometry edges
     gt_poses = np.load(gt_poses_file)
 
@@ -130,22 +205,14 @@ def main(data_dir: str = typer.Argument(""), gt_poses_file: str = typer.Argument
         closures = closures.reshape(1, -1)
     omega_closure = 1e3 * np.eye(6)
     with o3d.utility.VerbosityContextManager(o3d.utility.VerbosityLevel.Debug) as cm:
-        for ids in closures:
-            try:
-                pose = ids[2:].reshape(4, 4)
-            except ValueError:
-                continue
-            scan_i = int(ids[0])
-            scan_j = int(ids[1])
-            source = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(dataset[scan_i]))
-            target = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(dataset[scan_j]))
-            success = False
-            estimate = gicp(source, target, pose, 1.0)
-            if estimate.fitness > 0.5:
-                success = True
-            if success:
-                # draw_registration_result(source, target, estimate.transformation)
-                optimizer.add_factor(scan_j, scan_i, estimate.transformation, omega_closure)
+        for scan_i, scan_j, transformation in verify_closures(
+            data_dir,
+            closures,
+            downsample_voxel_size=downsample_voxel_size,
+            num_workers=num_workers,
+            cache_size=cache_size,
+        ):
+            optimizer.add_factor(scan_j, scan_i, transformation, omega_closure)
 
         optimizer.optimize()
         optimizer.write_graph(os.path.join(closure_dir, "out.g2o"))
@@ -51,9 +51,18 @@ class Metrics:
 
 
 class PipelineResults:
-    def __init__(self, gt_closures: np.ndarray, dataset_name: str, scan_context_thresholds) -> None:
+    def __init__(
+        self,
+        gt_closures: np.ndarray,
+        dataset_name: str,
+        scan_context_thresholds,
+        symmetric: bool = True,
+    ) -> None:
         self._dataset_name = dataset_name
         self._scan_context_thresholds = scan_context_thresholds
+        # False when the indices of a pair come from different sessions, e.g., a reference database
+        # and a query sequence: the pairs are then (nn_idx, query_idx) as passed to append()
+        self._symmetric = symmetric
 
         self.predicted_closures: Dict[float, Set[Tuple[int]]] = {}
         for threshold in self._scan_context_thresholds:
@@ -62,7 +71,7 @@ class PipelineResults:
         self.metrics: Dict[float, Metrics] = {}
 
         gt_closures = gt_closures if gt_closures.shape[1] == 2 else gt_closures.T
-        self.gt_closures: Set[Tuple[int]] = set(map(lambda x: tuple(sorted(x)), gt_closures))
+        self.gt_closures: Set[Tuple[int]] = set(map(self._pair, gt_closures))
 
     def print(self) -> None:
         if self.metrics:
@@ -73,17 +82,29 @@ class PipelineResults:
         for index in indices:
             self.predicted_closures[self._scan_context_thresholds[index]].add((nn_idx, query_idx))
 
+    def extend(self, scores: np.ndarray) -> None:
+        """Vectorized append() of (query_idx, nn_idx, dist) rows, e.g., from run_sequence."""
+        scores = np.asarray(scores).reshape(-1, 3)
+        for threshold in self._scan_context_thresholds:
+            selected = scores[scores[:, 2] < threshold]
+            self.predicted_closures[threshold].update(
+                zip(selected[:, 1].astype(int).tolist(), selected[:, 0].astype(int).tolist())
+            )
+
     def compute_metrics(
         self,
     ) -> None:
         for key in self._scan_context_thresholds:
             closures = self.predicted_closures[key]
-            closures = set(map(lambda x: tuple(sorted(x)), closures))
+            closures = set(map(self._pair, closures))
             tp = len(self.gt_closures.intersection(closures))
             fp = len(closures) - tp
             fn = len(self.gt_closures) - tp
             self.metrics[key] = Metrics(tp, fp, fn)
 
+    def _pair(self, closure) -> Tuple[int]:
+        return tuple(sorted(closure)) if self._symmetric else tuple(closure)
+
     def _rich_table_pr(self, table_format: box.Box = box.HORIZONTALS) -> Table:
         table = Table(box=table_format, title=self._dataset_name)
         table.caption = f"Loop Closure Distance Threshold:"
@@ -0,0 +1,73 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import typer
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+docstring = """
+:ScanContext: database shared by many clients\n
+\b
+[bold green]Examples: [/bold green]
+# Serve one database on a UNIX socket, clients connect with ScanContextClient("/tmp/sc.sock")
+$ scan_context_server /tmp/sc.sock
+# Or on localhost TCP, giving concurrent queries 2 ms to join a batch
+$ scan_context_server localhost:5555 --batch-window-ms 2
+"""
+
+
+@app.command(help=docstring)
+def scan_context_server(
+    address: str = typer.Argument(
+        ...,
+        help="The UNIX socket path or the host:port to listen on",
+        show_default=False,
+    ),
+    num_threads: int = typer.Option(8, help="Threads handling the requests (and encoding scans)"),
+    max_batch_size: int = typer.Option(64, help="Maximum number of requests served at once"),
+    batch_window_ms: float = typer.Option(
+        0.0, help="How long a batch waits for more requests after the first one"
+    ),
+):
+    # Lazy-loading for faster CLI
+    import json
+    import signal
+
+    from scan_context.service import ScanContextServer
+
+    server = ScanContextServer(
+        address,
+        num_threads=num_threads,
+        max_batch_size=max_batch_size,
+        batch_window=1e-3 * batch_window_ms,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    print(f"Serving on {server.address}, Ctrl+C to stop", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    server.latency.log_to_console()
+    print(json.dumps(server.stats(), indent=2))
+
+
+def run():
+    app()
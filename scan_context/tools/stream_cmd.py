@@ -0,0 +1,93 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from enum import Enum
+from pathlib import Path
+
+import typer
+
+from scan_context.streaming import BackpressurePolicy
+
+
+class SourceType(str, Enum):
+    directory = "directory"
+    fifo = "fifo"
+    socket = "socket"
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+docstring = """
+:ScanContext: on a live stream of scans\n
+\b
+[bold green]Examples: [/bold green]
+# Detect closures on the scans dropped in a directory, keeping up with a 10 Hz LiDAR
+$ scan_context_stream --source-type directory --deadline-ms 100 <path-to-scans>:open_file_folder:
+# Read length-prefixed float32 frames from a UNIX socket, dropping the oldest scan when behind
+$ scan_context_stream --source-type socket --policy drop-oldest /tmp/scans.sock
+"""
+
+
+@app.command(help=docstring)
+def scan_context_stream(
+    source: Path = typer.Argument(
+        ...,
+        help="The directory, named pipe or UNIX socket path to read the scans from",
+        show_default=False,
+    ),
+    source_type: SourceType = typer.Option(SourceType.directory, case_sensitive=False),
+    queue_size: int = typer.Option(4, help="Maximum number of scans waiting to be processed"),
+    policy: BackpressurePolicy = typer.Option(
+        BackpressurePolicy.block, help="What to do with new scans when the queue is full"
+    ),
+    keyframe_stride: int = typer.Option(5, help="Scans kept by the keyframe-skip policy"),
+    deadline_ms: float = typer.Option(100.0, help="End-to-end latency budget per scan"),
+    threshold: float = typer.Option(0.4, help="Scan Context distance to publish a closure"),
+):
+    # Lazy-loading for faster CLI
+    from scan_context.streaming import (
+        DirectorySource,
+        FifoSource,
+        StreamingScanContext,
+        UnixSocketSource,
+    )
+
+    sources = {
+        SourceType.directory: DirectorySource,
+        SourceType.fifo: FifoSource,
+        SourceType.socket: UnixSocketSource,
+    }
+    StreamingScanContext(
+        queue_size=queue_size,
+        policy=policy,
+        keyframe_stride=keyframe_stride,
+        deadline=1e-3 * deadline_ms,
+        threshold=threshold,
+        on_closure=lambda closure: print(
+            f"closure {closure.candidate_id} -> {closure.query_id}: "
+            f"distance {closure.distance:.3f}, yaw {closure.yaw:.3f} rad",
+            flush=True,
+        ),
+    ).run(sources[source_type](str(source))).log_to_console()
+
+
+def run():
+    app()
@@ -20,14 +20,136 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import copy
-from typing import List
+import os
+import queue
+import threading
+from typing import Optional
 
 import cv2
 import numpy as np
 
 
-def draw_scan_context(scan_contexts: List[np.ndarray]) -> None:
-    for i, scan_context in enumerate(scan_contexts):
-        cv2.imshow(f"Scan Context {i}", scan_context)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+def render_closure(
+    query_sc: np.ndarray,
+    candidate_sc: np.ndarray,
+    query_id: int,
+    candidate_id: int,
+    dist: float,
+    yaw: float,
+    scale: int = 8,
+) -> np.ndarray:
+    """Mosaic of the query, the candidate and the candidate aligned by yaw, colormapped by height.
+
+    Both descriptors share the same color scale, empty bins are black.
+    """
+    num_shift = int(round(yaw / (2 * np.pi) * candidate_sc.shape[1]))
+    rows = [query_sc, candidate_sc, np.roll(candidate_sc, num_shift, axis=1)]
+    max_height = max(query_sc.max(), candidate_sc.max(), 1e-6)
+    tiles = []
+    for scan_context in rows:
+        heights = np.uint8(255 * np.clip(scan_context / max_height, 0.0, 1.0))
+        tile = cv2.applyColorMap(heights, cv2.COLORMAP_JET)
+        tile[scan_context == 0] = 0
+        tile = cv2.resize(tile, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        tile = cv2.copyMakeBorder(tile, 0, 2, 0, 0, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+        tiles.append(tile)
+    mosaic = np.vstack(tiles)
+
+    banner = np.zeros((32, mosaic.shape[1], 3), dtype=np.uint8)
+    text = (
+        f"query {query_id} | candidate {candidate_id} | "
+        f"dist {dist:.3f} | yaw {np.rad2deg(yaw):.1f} deg"
+    )
+    cv2.putText(banner, text, (8, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+    return np.vstack([banner, mosaic])
+
+
+class ScanContextVisualizer:
+    """Renders closures on a background thread, never blocking the caller.
+
+    Closures are handed over through a bounded queue and dropped when it is full, so a slow display
+    or encoder only costs frames of the visualization. Mosaics are shown in a window and/or written
+    to a video (.mp4, .avi) or to an image file that always holds the latest closure, for headless
+    runs. A rendering error (e.g., no display, or an output cv2 can not write) stops the worker, it
+    is raised again by the next submit() or by close().
+    """
+
+    VIDEO_CODECS = {".mp4": "mp4v", ".avi": "MJPG", ".mkv": "MJPG"}
+
+    def __init__(
+        self,
+        display: bool = True,
+        output: Optional[str] = None,
+        queue_size: int = 8,
+        fps: float = 10.0,
+    ) -> None:
+        self.display = display
+        self.output = output
+        self.fps = fps
+        self.num_dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._video_writer = None
+        self._error: Optional[BaseException] = None
+        self._worker = threading.Thread(target=self._render_loop, daemon=True)
+        self._worker.start()
+
+    def submit(
+        self,
+        query_sc: np.ndarray,
+        candidate_sc: np.ndarray,
+        query_id: int,
+        candidate_id: int,
+        dist: float,
+        yaw: float,
+    ) -> bool:
+        """Queue a closure for rendering, returns False if it was dropped."""
+        if self._error is not None:
+            raise self._error
+        try:
+            self._queue.put_nowait((query_sc, candidate_sc, query_id, candidate_id, dist, yaw))
+            return True
+        except queue.Full:
+            self.num_dropped += 1
+            return False
+
+    def close(self) -> None:
+        # A failed worker does not drain the queue anymore, do not wait for room in it
+        while self._worker.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._worker.join()
+        if self._video_writer is not None:
+            self._video_writer.release()
+        if self._error is not None:
+            raise self._error
+        if self.display:
+            cv2.destroyAllWindows()
+
+    def _render_loop(self) -> None:
+        try:
+            while (closure := self._queue.get()) is not None:
+                mosaic = render_closure(*closure)
+                if self.output is not None:
+                    self._write(mosaic)
+                if self.display:
+                    cv2.imshow("Scan Context closures", mosaic)
+                    cv2.waitKey(1)
+        except BaseException as error:
+            self._error = error
+
+    def _write(self, mosaic: np.ndarray) -> None:
+        extension = os.path.splitext(self.output)[1].lower()
+        if extension not in self.VIDEO_CODECS:
+            # Replaced atomically, a viewer never reads a half-written image
+            tmp_file = self.output + ".tmp" + extension
+            cv2.imwrite(tmp_file, mosaic)
+            os.replace(tmp_file, self.output)
+            return
+        if self._video_writer is None:
+            fourcc = cv2.VideoWriter_fourcc(*self.VIDEO_CODECS[extension])
+            height, width = mosaic.shape[:2]
+            self._video_writer = cv2.VideoWriter(self.output, fourcc, self.fps, (width, height))
+        self._video_writer.write(mosaic)
@@ -26,12 +26,21 @@ setup(
     packages=find_packages(),
     cmake_install_dir="pybind/",
     cmake_install_target="install_python_bindings",
-    entry_points={"console_scripts": ["scan_context_pipeline=scan_context.tools.cmd:run"]},
+    entry_points={
+        "console_scripts": [
+            "scan_context_pipeline=scan_context.tools.cmd:run",
+            "scan_context_stream=scan_context.tools.stream_cmd:run",
+            "scan_context_gt=scan_context.tools.gt_cmd:run",
+            "scan_context_server=scan_context.tools.server_cmd:run",
+            "scan_context_multi_session=scan_context.tools.multi_session_cmd:run",
+        ]
+    },
     install_requires=[
         "numpy",
         "typer[all]>=0.6.0",
         "open3d>=0.13",
         "tqdm",
         "plyfile",
+        "scipy",
     ],
 )
@@ -0,0 +1,62 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from typing import List
+
+import numpy as np
+import pytest
+
+
+def synthetic_scans(
+    num_scans: int,
+    num_places: int,
+    num_points: int = 2000,
+    noise: float = 0.05,
+    seed: int = 0,
+    num_objects: int = 0,
+) -> List[np.ndarray]:
+    """Scans of num_places random places visited in turn, i.e., scan i revisits scan i - num_places.
+
+    Every visit sees the points of its place with fresh gaussian noise, in the same frame. The
+    points of a place are uniform in a 80 m cube, or spread over num_objects pillars of random
+    heights for scenes whose max-height bins tell the places apart.
+    """
+    rng = np.random.default_rng(seed)
+    places = [random_place(rng, num_points, num_objects) for _ in range(num_places)]
+    return [
+        places[scan_idx % num_places] + rng.normal(0, noise, (num_points, 3))
+        for scan_idx in range(num_scans)
+    ]
+
+
+def random_place(rng: np.random.Generator, num_points: int, num_objects: int) -> np.ndarray:
+    if num_objects == 0:
+        return rng.uniform(-40, 40, (num_points, 3))
+    centers = rng.uniform(-40, 40, (num_objects, 2))
+    heights = rng.uniform(1, 10, num_objects)
+    objects = rng.integers(num_objects, size=num_points)
+    xy = centers[objects] + rng.normal(0, 1, (num_points, 2))
+    return np.c_[xy, rng.uniform(0, 1, num_points) * heights[objects]]
+
+
+@pytest.fixture
+def make_scans():
+    return synthetic_scans
@@ -0,0 +1,82 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import numpy as np
+import pytest
+
+from pybind.scan_context import ScanContext
+
+NUM_PLACES = 100
+NUM_REVISITS = 20
+LANE_OFFSET = 3.0
+
+
+def lane_change_scans(make_scans):
+    """A drive through NUM_PLACES places, then back through the first NUM_REVISITS of them in the
+    opposite direction, LANE_OFFSET meters aside.
+
+    The places before the revisits are enough for the tree to hold the revisited ones.
+    """
+    scans = make_scans(NUM_PLACES + NUM_REVISITS, NUM_PLACES, num_objects=30)
+    turn_around = np.diag([-1.0, -1.0, 1.0])
+    return scans[:NUM_PLACES] + [
+        (scan + [0.0, LANE_OFFSET, 0.0]) @ turn_around.T for scan in scans[NUM_PLACES:]
+    ]
+
+
+def best_candidates(make_scans, **config):
+    """Query id, best candidate id, its distance and its initial guess for every revisit."""
+    scan_context = ScanContext(descriptor="cartesian", augment_reverse=True, **config)
+    results = []
+    for scan_idx, scan in enumerate(lane_change_scans(make_scans)):
+        scan_context.process_new_scan(scan)
+        query_idx, candidate_ids, candidate_dists, _ = scan_context.check_for_closure()
+        if scan_idx >= NUM_PLACES:
+            guess = scan_context.initial_guesses()[0]
+            results.append((query_idx, candidate_ids[0], candidate_dists[0], guess))
+    return results
+
+
+@pytest.mark.parametrize("estimate_translation", [False, True])
+@pytest.mark.parametrize("rotation_search", ["vkey_window", "full_fft"])
+def test_lane_shifted_revisits(make_scans, rotation_search, estimate_translation):
+    results = best_candidates(
+        make_scans, rotation_search=rotation_search, estimate_translation=estimate_translation
+    )
+    assert len(results) == NUM_REVISITS
+    # The guess maps the candidate into the query frame: turned around, LANE_OFFSET to the right
+    expected = np.diag([-1.0, -1.0, 1.0, 1.0])
+    expected[1, 3] = -LANE_OFFSET
+    for query_idx, candidate_id, candidate_dist, guess in results:
+        assert candidate_id == query_idx - NUM_PLACES
+        assert candidate_dist < 0.13
+        np.testing.assert_allclose(guess[:3, :3], expected[:3, :3], atol=1e-6)
+        # Within the resolution of the lateral bins (or of the translation cells)
+        np.testing.assert_allclose(guess[:3, 3], expected[:3, 3], atol=0.5)
+
+
+def test_full_fft_does_not_change_the_cartesian_search(make_scans):
+    lateral = best_candidates(make_scans, rotation_search="vkey_window")
+    full_fft = best_candidates(make_scans, rotation_search="full_fft")
+    assert len(lateral) == len(full_fft) == NUM_REVISITS
+    for lateral_result, full_fft_result in zip(lateral, full_fft):
+        assert lateral_result[:3] == full_fft_result[:3]
+        np.testing.assert_array_equal(lateral_result[3], full_fft_result[3])
@@ -0,0 +1,52 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import io
+
+import numpy as np
+import pytest
+
+from pybind.scan_context import ScanContext
+from scan_context.streaming import read_frames, write_frame
+
+
+@pytest.mark.parametrize("shape", [(100, 2), (100,), (100, 0)])
+def test_scans_without_xyz_are_rejected(shape):
+    scan_context = ScanContext()
+    with pytest.raises(ValueError):
+        scan_context.make_scan_context(np.ones(shape))
+    with pytest.raises(ValueError):
+        scan_context.process_new_scan(np.ones(shape))
+
+
+def test_streamed_frames_keep_the_intensities(make_scans):
+    (points,) = make_scans(1, num_places=1, num_points=1000)
+    scan = np.c_[points, np.linspace(0, 1, 1000)].astype(np.float32)
+    stream = io.BytesIO()
+    write_frame(stream, scan)
+    stream.seek(0)
+    (frame,) = read_frames(stream)
+    assert frame.shape == (1000, 4)
+
+    scan_context = ScanContext(bin_encoder="max_intensity")
+    np.testing.assert_array_equal(
+        scan_context.make_scan_context(frame), scan_context.make_scan_context(scan)
+    )
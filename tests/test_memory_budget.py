@@ -0,0 +1,52 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import numpy as np
+
+from pybind.scan_context import ScanContext
+
+
+def test_evictions_do_not_rebuild_the_tree_at_every_insert(make_scans):
+    budget = 2_000_000
+    scan_context = ScanContext(max_memory_bytes=budget)
+    num_over_budget, num_tree_resets = 0, 0
+    for scan in make_scans(1000, num_places=1000, num_points=500):
+        had_tree = scan_context.memory_usage()["tree"] > 0
+        scan_context.process_new_scan(scan)
+        usage = scan_context.memory_usage()
+        assert sum(usage.values()) <= budget
+        if len(scan_context.get_ids()) < scan_context.get_state()[2]:
+            num_over_budget += 1
+            num_tree_resets += had_tree and usage["tree"] == 0
+        scan_context.check_for_closure()
+    assert num_over_budget > 500
+    # every eviction invalidates the tree, they happen in batches down to the low-water mark
+    assert 0 < num_tree_resets < num_over_budget / 10
+
+
+def test_evictions_keep_the_ids_of_the_latest_keyframes(make_scans):
+    scan_context = ScanContext(max_memory_bytes=1_000_000)
+    for scan in make_scans(300, num_places=300, num_points=500):
+        scan_context.process_new_scan(scan)
+    ids = scan_context.get_ids()
+    assert len(ids) < 300
+    assert np.all(np.diff(ids) > 0)
+    assert ids[-1] == 299
@@ -0,0 +1,64 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import numpy as np
+
+from pybind.scan_context import ScanContext
+
+NUM_PLACES = 150
+NUM_REVISITS = 20
+# A revisit scan replaced by a scan of a place far from the revisited ones
+PLANTED_SCAN = NUM_PLACES + 10
+PLANTED_PLACE = 90
+SEQUENCE_WINDOW = 5
+
+
+def best_candidates(scans, **config):
+    scan_context = ScanContext(**config)
+    results = {}
+    for scan_idx, scan in enumerate(scans):
+        scan_context.process_new_scan(scan)
+        query_idx, candidate_ids, candidate_dists, _ = scan_context.check_for_closure()
+        if scan_idx >= NUM_PLACES:
+            results[query_idx] = (candidate_ids[0], candidate_dists[0])
+    return results, scan_context.get_pruning_stats()
+
+
+def test_sequence_window_rejects_a_planted_candidate(make_scans):
+    scans = make_scans(NUM_PLACES + NUM_REVISITS, NUM_PLACES, num_objects=30)
+    scans[PLANTED_SCAN] = scans[PLANTED_PLACE]
+
+    # On its own, the planted scan matches its place as well as the true revisits do
+    results, stats = best_candidates(scans)
+    assert results[PLANTED_SCAN][0] == PLANTED_PLACE
+    assert results[PLANTED_SCAN][1] < 0.13
+    assert stats["sequence_rejected"] == 0
+
+    # The scans before it revisit other places than the ones before its candidate
+    results, stats = best_candidates(scans, sequence_window=SEQUENCE_WINDOW)
+    assert results[PLANTED_SCAN] == (PLANTED_PLACE, np.inf)
+    assert stats["sequence_rejected"] > 0
+    for query_idx in range(NUM_PLACES + SEQUENCE_WINDOW, NUM_PLACES + NUM_REVISITS):
+        if query_idx == PLANTED_SCAN:
+            continue
+        candidate_id, candidate_dist = results[query_idx]
+        assert candidate_id == query_idx - NUM_PLACES
+        assert candidate_dist < 0.13
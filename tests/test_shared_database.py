@@ -0,0 +1,48 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import subprocess
+import sys
+import time
+
+from pybind.scan_context import ScanContext
+from scan_context.shared_database import ScanContextView, SharedDatabase
+
+
+def test_an_unrelated_process_does_not_unlink_the_segment(make_scans):
+    scan_context = ScanContext()
+    for scan in make_scans(60, num_places=60, num_points=500):
+        scan_context.process_new_scan(scan)
+    database = SharedDatabase.export(scan_context)
+    try:
+        attach = (
+            f"from scan_context.shared_database import ScanContextView as V; V({database.name!r})"
+        )
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+        subprocess.run([sys.executable, "-c", attach], env=env, check=True)
+        # The resource tracker of the other process cleans up once it is gone
+        time.sleep(0.5)
+        view = ScanContextView(database.name)
+        assert len(view) == 60
+        view.close()
+    finally:
+        database.close(unlink=True)
@@ -0,0 +1,69 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+
+from scan_context.streaming import BackpressurePolicy, StreamingScanContext
+
+
+def run_with_timeout(streaming: StreamingScanContext, source, timeout: float = 30.0):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["stats"] = streaming.run(source)
+        except BaseException as error:
+            outcome["error"] = error
+
+    runner = threading.Thread(target=target, daemon=True)
+    runner.start()
+    runner.join(timeout)
+    assert not runner.is_alive(), "run() hangs after a worker failed"
+    return outcome
+
+
+def test_bad_frame_fails_the_run(make_scans):
+    def source():
+        yield from make_scans(10, num_places=5)
+        yield "not a scan"
+        yield from make_scans(100, num_places=5)
+
+    streaming = StreamingScanContext(queue_size=2, policy=BackpressurePolicy.block)
+    outcome = run_with_timeout(streaming, source())
+    assert isinstance(outcome.get("error"), ValueError)
+
+
+def test_failing_on_closure_fails_the_run(make_scans):
+    def on_closure(closure):
+        raise RuntimeError("callback failed")
+
+    streaming = StreamingScanContext(queue_size=2, on_closure=on_closure)
+    outcome = run_with_timeout(streaming, make_scans(500, num_places=5))
+    assert isinstance(outcome.get("error"), RuntimeError)
+
+
+def test_run_without_errors(make_scans):
+    closures = []
+    streaming = StreamingScanContext(queue_size=2, on_closure=closures.append)
+    outcome = run_with_timeout(streaming, make_scans(100, num_places=5))
+    assert "error" not in outcome
+    assert outcome["stats"] is streaming.stats
+    assert len(closures) > 0
@@ -0,0 +1,53 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import time
+
+import numpy as np
+import pytest
+
+from scan_context.tools.visualization import ScanContextVisualizer
+
+
+def test_rendering_errors_are_raised_by_close(tmp_path):
+    # cv2 can not write an image without an extension, the worker fails at the first closure
+    visualizer = ScanContextVisualizer(display=False, output=str(tmp_path / "closures"))
+    scan_context = np.random.default_rng(0).uniform(0, 10, (20, 60))
+    visualizer.submit(scan_context, scan_context, 1, 0, 0.1, 0.0)
+    visualizer._worker.join(timeout=10.0)
+    # the queue is not drained anymore, close() must not wait for room in it
+    while not visualizer._queue.full():
+        visualizer._queue.put_nowait((scan_context, scan_context, 2, 0, 0.1, 0.0))
+    start = time.perf_counter()
+    with pytest.raises(Exception):
+        visualizer.close()
+    assert time.perf_counter() - start < 5.0
+    with pytest.raises(Exception):
+        visualizer.submit(scan_context, scan_context, 2, 0, 0.1, 0.0)
+
+
+def test_closures_are_written(tmp_path):
+    output = tmp_path / "closure.png"
+    visualizer = ScanContextVisualizer(display=False, output=str(output))
+    scan_context = np.random.default_rng(0).uniform(0, 10, (20, 60))
+    assert visualizer.submit(scan_context, scan_context, 1, 0, 0.1, 0.0)
+    visualizer.close()
+    assert output.exists()